@@ -0,0 +1,279 @@
+#script which gives asyncio counterparts of the loads and queries: the SQLite
+#work runs on threads, one writer thread by database file and a pool of reader
+#threads by session, so the event loop is never blocked
+
+#import modules
+import os
+import asyncio
+import threading
+import functools
+import concurrent.futures
+
+from file2db import file_to_db
+from query_db import execute_query, is_query, connect_database
+from session import Session
+
+#writer thread of each database file, shared by the sessions of the process
+writers = {}
+writers_lock = threading.Lock()
+
+def writer_executor(database):
+    """Return the single-thread executor writing to a database file."""
+
+    path = os.path.realpath(database)
+    with writers_lock:
+        if path not in writers:
+            writers[path] = concurrent.futures.ThreadPoolExecutor(
+                1, thread_name_prefix='writer')
+
+    return writers[path]
+
+async def run_cancellable(executor, func, running=None):
+    """Run a function on an executor thread. If the task is cancelled before
+    the function starts, it does not run. Once started, the cancel event in
+    the running dictionary is set, so that a load stops before its next batch
+    and rolls back, and the statement of the connection it records there is
+    interrupted."""
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, func)
+    except asyncio.CancelledError:
+        running = running if running != None else {}
+        if running.get('cancel') != None:
+            running['cancel'].set()
+        if running.get('conn') != None:
+            running['conn'].interrupt()
+        raise
+
+async def file_to_db_async(db_path, tb_name, new_table, file_path, **options):
+    """Load a file with file_to_db on the writer thread of the database.
+    Cancelling the task stops the load and drops its rows which were not
+    committed. Return the number of rows inserted."""
+
+    cancel = threading.Event()
+    func = functools.partial(file_to_db, db_path, tb_name, new_table,
+                             file_path, cancel=cancel, **options)
+
+    return await run_cancellable(writer_executor(db_path), func,
+                                 {'cancel': cancel})
+
+async def execute_query_async(database, exec_str,
+                              output_file='query_results.txt', **options):
+    """Execute a statement and save its results with execute_query. Queries
+    run on a thread of the default executor, other statements on the writer
+    thread of the database, which commits them. The connection, opened with
+    the read profile and pragmas of the options unless one is given in conn,
+    is interrupted if the task is cancelled, and the changes of an
+    interrupted statement are rolled back. Return the title and first row
+    strings."""
+
+    conn = options.pop('conn', None)
+    query = is_query(exec_str)
+    running = {}
+
+    def run():
+        own_conn = conn == None
+        if own_conn:
+            running['conn'] = connect_database(
+                database, options.get('read_profile', 'default'),
+                options.get('pragmas'))
+        else:
+            running['conn'] = conn
+        try:
+            result = execute_query(database, exec_str, output_file,
+                                   conn=running['conn'], **options)
+            if not query:
+                running['conn'].commit()
+            return result
+        finally:
+            opened = running.pop('conn')
+            if own_conn:
+                opened.close()
+
+    executor = None if query else writer_executor(database)
+
+    return await run_cancellable(executor, run, running)
+
+class AsyncSession:
+    """Session whose loads and statements run on the writer thread of the
+    database and whose queries run on a pool of reader threads, each with its
+    read-only connection. Cancelling a task interrupts its statement, and
+    stops a load before its next batch."""
+
+    def __init__(self, database, pool_size=4, read_profile='default',
+                 pragmas=None):
+        self.session = Session(database, pool_size, read_profile, pragmas)
+        self.writer = writer_executor(database)
+        self.readers = concurrent.futures.ThreadPoolExecutor(
+            pool_size, thread_name_prefix='reader')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+    async def write(self, func, *args, **kwargs):
+        """Run a method of the session on the writer thread. A cancel event
+        given to the method is set if the task is cancelled."""
+
+        running = {'cancel': kwargs.get('cancel')}
+
+        def run():
+            running['conn'] = self.session.writer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                running.pop('conn')
+
+        return await run_cancellable(self.writer, run, running)
+
+    async def read(self, func):
+        """Run a function of a read-only connection on a reader thread."""
+
+        running = {}
+
+        def run():
+            conn = self.session.acquire()
+            running['conn'] = conn
+            try:
+                return func(conn)
+            finally:
+                running.pop('conn')
+                self.session.release(conn)
+
+        return await run_cancellable(self.readers, run, running)
+
+    async def load(self, file_path, tb_name, new_table=True, **options):
+        """Load a file in a table with the options of file_to_db. Return the
+        number of rows inserted."""
+
+        return await self.write(self.session.load, file_path, tb_name,
+                                new_table, cancel=threading.Event(),
+                                **options)
+
+    async def load_files(self, file_paths, tb_name=None, new_table=True,
+                         **options):
+        """Load several files with the options of files_to_db. Return the list
+        of (file, table, rows, error) for each file."""
+
+        return await self.write(self.session.load_files, file_paths, tb_name,
+                                new_table, cancel=threading.Event(),
+                                **options)
+
+    async def execute(self, exec_str, params=()):
+        """Execute a statement changing the database and commit it. Return the
+        number of rows changed."""
+
+        return await self.write(self.session.execute, exec_str, params)
+
+    async def query(self, exec_str, params=()):
+        """Execute a query. Return the column names and the list of rows."""
+
+        def run(conn):
+            cur = conn.execute(exec_str, params)
+            title = [i[0] for i in cur.description or []]
+            rows = cur.fetchall()
+            cur.close()
+            return title, rows
+
+        return await self.read(run)
+
+    async def stream(self, exec_str, params=(), fetch_size=1000, buffer=2):
+        """Execute a query. Return the column names and an async iterator of
+        batches of fetch_size rows. The reader thread fetches at most buffer
+        batches ahead of the consumer. Closing the iterator early stops the
+        query and gives its connection back to the pool."""
+
+        loop = asyncio.get_running_loop()
+        batches = asyncio.Queue(buffer)
+        stop = threading.Event()
+        running = {}
+
+        def put(item):
+            #wait for room in the queue, unless the consumer is gone
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(batches.put(item),
+                                                 loop).result()
+
+        def produce():
+            conn = self.session.acquire()
+            running['conn'] = conn
+            cur = None
+            try:
+                cur = conn.execute(exec_str, params)
+                put([i[0] for i in cur.description or []])
+                while not stop.is_set():
+                    rows = cur.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    put(rows)
+                put(None)
+            except Exception as err:
+                put(err)
+            finally:
+                if cur != None:
+                    cur.close()
+                running.pop('conn')
+                self.session.release(conn)
+
+        producer = loop.run_in_executor(self.readers, produce)
+
+        def cancel():
+            stop.set()
+            conn = running.get('conn')
+            if conn != None:
+                conn.interrupt()
+            #free a producer waiting for room in the queue
+            while not batches.empty():
+                batches.get_nowait()
+
+        try:
+            title = await batches.get()
+        except asyncio.CancelledError:
+            cancel()
+            raise
+        if isinstance(title, Exception):
+            await producer
+            raise title
+
+        async def iterate():
+            try:
+                while True:
+                    item = await batches.get()
+                    if item == None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                cancel()
+
+        return title, iterate()
+
+    async def export(self, exec_str, output_file='query_results.txt',
+                     **options):
+        """Execute a statement and save its results in a file with the options
+        of execute_query. Return the title and first row strings."""
+
+        def run(conn):
+            return execute_query(self.session.database, exec_str, output_file,
+                                 conn=conn, **options)
+
+        if not is_query(exec_str):
+            return await self.write(self.session.export, exec_str, output_file,
+                                    **options)
+
+        return await self.read(run)
+
+    async def close(self):
+        """Close the connections of the session once their threads are
+        done."""
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.readers.shutdown)
+        await loop.run_in_executor(self.writer, self.session.close)
+
+        return None
@@ -0,0 +1,275 @@
+#script which keeps statistics of the columns of tables as they are loaded: the
+#number of values and of NULL values, the minimum, the maximum and a
+#HyperLogLog sketch estimating the number of distinct values, so that these
+#metadata queries are answered without scanning the tables. Loads which can
+#update rows (upserts) mark the statistics of their table as inexact, and
+#queries are no longer answered from them
+
+#import modules
+import re
+import math
+import hashlib
+
+#table of the database recording the statistics of the columns
+stats_table = 'file2db_stats'
+
+#the sketch has 2**precision registers of one byte, its relative error is
+#about 1.04 / sqrt(2**precision), 1.6 % for 4096 registers
+precision = 12
+n_registers = 1 << precision
+
+def value_hash(value):
+    """Return a 64-bit hash of a value, the same in every process. Numbers
+    which SQLite compares as equal (1 and 1.0) have the same hash."""
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bytes):
+        data = b'b' + value
+    elif isinstance(value, str):
+        data = b't' + value.encode('utf-8', 'surrogatepass')
+    else:
+        data = b'n' + repr(value).encode('ascii')
+
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+def sketch_add(sketch, value):
+    """Add a value to a sketch: the register given by the first bits of its
+    hash keeps the highest rank of the first 1 bit of the other bits."""
+
+    h = value_hash(value)
+    index = h >> (64 - precision)
+    rest = h & ((1 << (64 - precision)) - 1)
+    rank = 64 - precision - rest.bit_length() + 1
+    if rank > sketch[index]:
+        sketch[index] = rank
+
+    return None
+
+def sketch_merge(sketch, other):
+    """Return the sketch of the union of the values of two sketches."""
+
+    return bytearray(map(max, sketch, other))
+
+def sketch_estimate(sketch):
+    """Return the estimated number of distinct values added to a sketch."""
+
+    alpha = 0.7213 / (1 + 1.079 / n_registers)
+    estimate = alpha * n_registers ** 2 / sum([2.0 ** -i for i in sketch])
+
+    #small cardinalities are better counted by the empty registers
+    zeros = sketch.count(0)
+    if estimate <= 2.5 * n_registers and zeros > 0:
+        estimate = n_registers * math.log(n_registers / zeros)
+
+    return int(round(estimate))
+
+def order_key(value):
+    """Return a key sorting values as SQLite does: numbers, then text, then
+    blobs."""
+
+    if isinstance(value, str):
+        return (1, value)
+    if isinstance(value, bytes):
+        return (2, value)
+
+    return (0, value)
+
+def new_stats(columns):
+    """Return empty statistics of a list of columns."""
+
+    return [{'column': column, 'rows': 0, 'nulls': 0, 'min': None,
+             'max': None, 'sketch': bytearray(n_registers), 'exact': True}
+            for column in columns]
+
+def update_value(stats, value):
+    """Add a value to the statistics of a column."""
+
+    stats['rows'] += 1
+    if value == None:
+        stats['nulls'] += 1
+        return None
+
+    key = order_key(value)
+    if stats['min'] == None or key < order_key(stats['min']):
+        stats['min'] = value
+    if stats['max'] == None or key > order_key(stats['max']):
+        stats['max'] = value
+    sketch_add(stats['sketch'], value)
+
+    return None
+
+def stats_rows(rows, stats):
+    """Generate rows, adding their values to the statistics of the columns."""
+
+    for row in rows:
+        for column, value in zip(stats, row):
+            update_value(column, value)
+        yield row
+
+def merge_stats(stats, other):
+    """Add the statistics of other values of a column to its statistics."""
+
+    for value in (other['min'], other['max']):
+        if value != None:
+            key = order_key(value)
+            if stats['min'] == None or key < order_key(stats['min']):
+                stats['min'] = value
+            if stats['max'] == None or key > order_key(stats['max']):
+                stats['max'] = value
+    stats['rows'] += other['rows']
+    stats['nulls'] += other['nulls']
+    stats['sketch'] = sketch_merge(stats['sketch'], other['sketch'])
+    stats['exact'] = stats['exact'] and other['exact']
+
+    return stats
+
+def create_stats_table(cur):
+    """Create the statistics table if it is not in the database."""
+
+    cur.execute('CREATE TABLE IF NOT EXISTS {} (tb_name TEXT, column_name '
+                'TEXT, position INTEGER, rows INTEGER, nulls INTEGER, min, '
+                'max, sketch BLOB, exact INTEGER, PRIMARY KEY (tb_name, '
+                'column_name))'\
+                .format(stats_table))
+
+    return None
+
+def has_stats(cur, tb_name):
+    """Tell if statistics of a table are recorded in the database."""
+
+    cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = ? AND "
+                "type = 'table'", (stats_table,))
+    if cur.fetchone()[0] == 0:
+        return False
+    cur.execute('SELECT COUNT(*) FROM {} WHERE tb_name = ?'\
+                .format(stats_table), (tb_name,))
+
+    return cur.fetchone()[0] > 0
+
+def clear_stats(cur, tb_name):
+    """Remove the statistics of a table, which is created again."""
+
+    if has_stats(cur, tb_name):
+        cur.execute('DELETE FROM {} WHERE tb_name = ?'.format(stats_table),
+                    (tb_name,))
+
+    return None
+
+def save_stats(cur, tb_name, stats, exact=True):
+    """Add the statistics of the rows inserted in a table to those recorded in
+    the database, in the transaction of the rows, then empty them so that the
+    next rows are counted from zero. The statistics of the table are no longer
+    exact if the rows were not all new (upserts)."""
+
+    create_stats_table(cur)
+    for position, column in enumerate(stats):
+        cur.execute('SELECT rows, nulls, min, max, sketch, exact FROM {} '
+                    'WHERE tb_name = ? AND column_name = ?'.format(stats_table),
+                    (tb_name, column['column']))
+        row = cur.fetchone()
+        total = new_stats([column['column']])[0]
+        if row != None:
+            total.update(rows=row[0], nulls=row[1], min=row[2], max=row[3],
+                         sketch=bytearray(row[4]), exact=bool(row[5]))
+        merge_stats(total, column)
+        cur.execute('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?, ?, ?, ?, '
+                    '?, ?)'.format(stats_table),
+                    (tb_name, column['column'], position, total['rows'],
+                     total['nulls'], total['min'], total['max'],
+                     bytes(total['sketch']), int(total['exact'] and exact)))
+        column.update(new_stats([column['column']])[0])
+
+    return None
+
+def read_stats(cur, tb_name):
+    """Return the statistics of the columns of a table, in the order of the
+    table, or an empty list if none are recorded."""
+
+    if not has_stats(cur, tb_name):
+        return []
+    cur.execute('SELECT column_name, rows, nulls, min, max, sketch, exact '
+                'FROM {} WHERE tb_name = ? ORDER BY position'\
+                .format(stats_table), (tb_name,))
+
+    return [{'column': row[0], 'rows': row[1], 'nulls': row[2],
+             'min': row[3], 'max': row[4], 'sketch': bytearray(row[5]),
+             'exact': bool(row[6])} for row in cur.fetchall()]
+
+def distinct_values(stats):
+    """Return the estimated number of distinct values of a column, at most its
+    number of values which are not NULL."""
+
+    return min(sketch_estimate(stats['sketch']), stats['rows'] - stats['nulls'])
+
+def stats_report(cur, tb_name):
+    """Return the column names and the rows of a report of the statistics of
+    the columns of a table. The counts of inexact statistics are upper
+    bounds."""
+
+    title = ['column', 'rows', 'nulls', 'min', 'max', 'distinct', 'exact']
+    rows = [(i['column'], i['rows'], i['nulls'], i['min'], i['max'],
+             distinct_values(i), int(i['exact']))
+            for i in read_stats(cur, tb_name)]
+
+    return title, rows
+
+#aggregates answered by the statistics, with an optional alias
+name_pattern = r'(?:"[^"]+"|\[[^\]]+\]|`[^`]+`|\w+)'
+stats_item = re.compile(r'(COUNT|MIN|MAX)\s*\(\s*(DISTINCT\s+)?(\*|{0})\s*\)'
+                        r'(?:\s+(?:AS\s+)?({0}))?$'.format(name_pattern),
+                        re.IGNORECASE)
+stats_select = re.compile(r'\s*SELECT\s+(.+?)\s+FROM\s+({})\s*;?\s*$'\
+                          .format(name_pattern), re.IGNORECASE | re.DOTALL)
+
+def unquote(name):
+    """Remove the quotes of an SQL name."""
+
+    if name[0] in '"[`':
+        return name[1:-1]
+
+    return name
+
+def stats_query(cur, exec_str):
+    """Answer a query from the statistics of its table when it only selects
+    COUNT(*), COUNT(column), COUNT(DISTINCT column), MIN(column) and
+    MAX(column) of a whole table. COUNT(DISTINCT column) is an estimate.
+    Return the column names and the row of results, or None if the query
+    cannot be answered from the statistics or they are not exact."""
+
+    match = stats_select.match(exec_str)
+    if match == None:
+        return None
+    columns = dict([(i['column'].lower(), i)
+                    for i in read_stats(cur, unquote(match.group(2)))])
+    if not columns or not all([i['exact'] for i in columns.values()]):
+        return None
+
+    title = []
+    row = []
+    for item in match.group(1).split(','):
+        item = item.strip()
+        found = stats_item.match(item)
+        if found == None:
+            return None
+        function, distinct, name, alias = found.groups()
+        function = function.upper()
+        if name == '*':
+            if function != 'COUNT' or distinct:
+                return None
+            stats = list(columns.values())[0]
+            value = stats['rows']
+        else:
+            stats = columns.get(unquote(name).lower())
+            if stats == None or (distinct and function != 'COUNT'):
+                return None
+            if function == 'COUNT' and distinct:
+                value = distinct_values(stats)
+            elif function == 'COUNT':
+                value = stats['rows'] - stats['nulls']
+            else:
+                value = stats[function.lower()]
+        title.append(unquote(alias) if alias != None else item)
+        row.append(value)
+
+    return title, [tuple(row)]
@@ -0,0 +1,156 @@
+#script which stores the low-cardinality text columns of a table as integer
+#codes: the rows are kept in a data table, the distinct values of each coded
+#column in a lookup table, and a view named after the table joins them back
+#under the original column names
+
+#import modules
+import itertools
+
+#table of the database recording the coded columns of each table
+dictionaries_table = 'file2db_dictionaries'
+
+#a text column is coded if its sample has at most this ratio of distinct
+#values to values
+dictionary_ratio = 0.1
+
+def data_table(tb_name):
+    """Return the name of the table holding the rows of a coded table."""
+
+    return '{}_data'.format(tb_name)
+
+def lookup_table(tb_name, column):
+    """Return the name of the lookup table of a coded column."""
+
+    return '{0}_{1}_values'.format(tb_name, column)
+
+def value_key(value):
+    """Return the text stored for a value in a TEXT column."""
+
+    return value if isinstance(value, str) else str(value)
+
+def low_cardinality(field_type, rows, ratio=dictionary_ratio):
+    """Return the text columns of a list of (column, type) whose sample rows
+    have at most ratio distinct values per value."""
+
+    columns = []
+    for index, (column, sql_type) in enumerate(field_type):
+        if sql_type != 'TEXT':
+            continue
+        values = [row[index] for row in rows if row[index] != None]
+        distinct = set([value_key(i) for i in values])
+        if values and len(distinct) <= ratio * len(values):
+            columns.append(column)
+
+    return columns
+
+def coded_type(field_type, coded):
+    """Return the list of (column, type) of the data table: coded columns are
+    integers."""
+
+    return [(column, 'INTEGER' if column in coded else sql_type)
+            for column, sql_type in field_type]
+
+def coded_columns(cur, tb_name):
+    """Return the coded columns of a table, an empty list if it is not
+    coded."""
+
+    cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = ? AND "
+                "type = 'table'", (dictionaries_table,))
+    if cur.fetchone()[0] == 0:
+        return []
+    cur.execute('SELECT column_name FROM {} WHERE tb_name = ? ORDER BY '
+                'rowid'.format(dictionaries_table), (tb_name,))
+
+    return [row[0] for row in cur.fetchall()]
+
+def clear_dictionary(cur, tb_name):
+    """Forget the coded columns of a table, which is created again."""
+
+    if coded_columns(cur, tb_name):
+        cur.execute('DELETE FROM {} WHERE tb_name = ?'\
+                    .format(dictionaries_table), (tb_name,))
+
+    return None
+
+def view_select(tb_name, columns, coded):
+    """Return the query of the rows of the data table of a coded table, aliased
+    d, with the original values of the coded columns, in the order of the list
+    of columns."""
+
+    selected = []
+    joins = []
+    for column in columns:
+        if column not in coded:
+            selected.append('d.{}'.format(column))
+            continue
+        alias = 'l{}'.format(len(joins))
+        selected.append('{0}.value AS {1}'.format(alias, column))
+        joins.append('LEFT JOIN {0} {1} ON {1}.code = d.{2}'\
+                     .format(lookup_table(tb_name, column), alias, column))
+
+    return 'SELECT {0} FROM {1} d {2}'.format(', '.join(selected),
+                                              data_table(tb_name),
+                                              ' '.join(joins)).strip()
+
+def create_dictionary(cur, tb_name, columns, coded):
+    """Create the lookup tables of the coded columns of a table, record them
+    and create the view presenting the rows of the data table with the
+    original values, in the order of the list of columns."""
+
+    cur.execute('CREATE TABLE IF NOT EXISTS {} (tb_name TEXT, column_name '
+                'TEXT, lookup TEXT, PRIMARY KEY (tb_name, column_name))'\
+                .format(dictionaries_table))
+
+    for column in columns:
+        if column not in coded:
+            continue
+        lookup = lookup_table(tb_name, column)
+        cur.execute('CREATE TABLE {} (code INTEGER PRIMARY KEY, value TEXT '
+                    'UNIQUE)'.format(lookup))
+        cur.execute('INSERT INTO {} VALUES (?, ?, ?)'\
+                    .format(dictionaries_table), (tb_name, column, lookup))
+
+    cur.execute('CREATE VIEW {0} AS {1}'.format(
+        tb_name, view_select(tb_name, columns, coded)))
+
+    return None
+
+def load_codes(cur, tb_name, columns, coded):
+    """Return the encoders of the coded columns of the rows of a file, as a
+    list of (index in the row, dictionary of value codes, lookup table)."""
+
+    encoders = []
+    for index, column in enumerate(columns):
+        if column not in coded:
+            continue
+        lookup = lookup_table(tb_name, column)
+        cur.execute('SELECT value, code FROM {}'.format(lookup))
+        encoders.append((index, dict(cur.fetchall()), lookup))
+
+    return encoders
+
+def encode_rows(rows, cur, encoders):
+    """Generate rows whose coded values are replaced by their codes. New
+    values are added to their lookup table, in the transaction of the
+    rows."""
+
+    for row in rows:
+        row = list(row)
+        for index, codes, lookup in encoders:
+            value = row[index]
+            if value == None:
+                continue
+            key = value_key(value)
+            code = codes.get(key)
+            if code == None:
+                code = len(codes) + 1
+                codes[key] = code
+                cur.connection.execute('INSERT INTO {} VALUES (?, ?)'\
+                                       .format(lookup), (code, key))
+            row[index] = code
+        yield row
+
+def sample_rows(rows, n_rows=10000):
+    """Return the first rows of an iterator of rows."""
+
+    return list(itertools.islice(rows, n_rows))
@@ -2,21 +2,55 @@
 #command line
 
 #import modules
-import pandas as pd
 import sqlite3
 import os
 import sys
 import getopt
 import math #for isnan
+import itertools
+import codecs
+import glob
+import time
+import multiprocessing
+import mmap
+import io
+import hashlib
+import csv
+import gzip
+import bz2
+import lzma
+import logging
+
+#pandas is only needed by the pandas engine
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+from column_stats import stats_rows, new_stats, save_stats, has_stats, \
+    clear_stats
+from dictionary import data_table, low_cardinality, coded_type, \
+    coded_columns, clear_dictionary, create_dictionary, load_codes, \
+    encode_rows, sample_rows
+from text_search import has_search_index, create_search_index
+
+#messages of the loads, printed by the command line
+logger = logging.getLogger('file2db')
+
+class File2dbError(Exception):
+    """Error raised when a file cannot be loaded in the database."""
 
 def print_help():
     """Print help text."""
     help_text = \
     """Converts a CSV file to a table placed in a SQLite database.
     
-    python file2db.py -d[database] -t[table] -f[file] -e[encoding] -h
+    python file2db.py -d[database] -t[table] -f[file] -e[encoding] \
+-c[chunksize] -b[chunk bytes] -p[profile] -r[commit rows] -w[workers] \
+-u -k[primary key] -i[index] -a -g[engine] -s --dictionary --search[columns] -h
     
-    Please provide at least the options for the table and file.
+    Please provide at least the options for the table and file. When several
+    files are loaded the table is optional.
     
     -d, --database
     Full path to the database, including the file name. If not provided, the
@@ -28,15 +62,126 @@ def print_help():
     name given. Please provide "True" if you want to create the table.
     
     -t, --table
-    Name of the table in which to store the CSV file. Must be provided.
+    Name of the table in which to store the CSV file. Must be provided, except
+    when several files are loaded: then each file goes to a table named after
+    the file if no table is given, else all files are appended to the table.
     
     -f, --file
     Full path to the CSV file to be put in the database, including the file 
-    name. Must be provided.
+    name. Must be provided. Can be repeated or be a glob pattern (in quotes)
+    to load several files. Files compressed with gzip, bz2 or xz are
+    decompressed while they are read.
     
     -e, --encoding
-    Encoding used to decode the CSV file. If not provided, will try 'utf-8',
-    'latin-1' and 'utf-16'.
+    Encoding used to decode the CSV file. If not provided, the encoding is
+    detected from the byte order mark or a sample of the beginning of the
+    file, and 'latin-1' is used if 'utf-8' fails further in the file.
+
+    -c, --chunksize
+    Number of rows read from the CSV file and inserted in the table at a time.
+    If not provided, the whole file is loaded in memory before insertion.
+
+    -b, --chunk-bytes
+    Approximate number of bytes read from the CSV file at a time. The number
+    of rows per chunk is estimated from the beginning of the file. Ignored if
+    the chunksize is provided.
+
+    -p, --profile
+    Settings of the database connection used during the load. 'default' keeps
+    the SQLite defaults, 'fast' turns off the journal and disk syncs and locks
+    the database (only for scratch databases, a crash can corrupt them) and
+    'durable' uses write-ahead logging, safe for databases shared with other
+    processes. Safe settings are restored after the load, even if it fails.
+
+    -r, --commit-rows
+    Number of rows inserted between commits. If not provided, the whole file
+    is inserted in a single transaction.
+
+    -w, --workers
+    Number of processes parsing files when several files are loaded. Defaults
+    to the number of CPUs. When a single file is loaded, the file is split in
+    byte ranges (of the chunk bytes or 32 MiB) parsed by this number of
+    processes.
+
+    -u, --unordered
+    Insert the byte ranges of a file parsed by several processes in the order
+    they are parsed instead of the order of the file.
+
+    -k, --primary-key
+    Comma-separated columns of the primary key of the new table.
+
+    --unique
+    Comma-separated columns which must be unique in the new table. Can be
+    repeated.
+
+    -i, --index
+    Comma-separated columns of a secondary index, built after the file is
+    loaded. Can be repeated. The table is analyzed at the end of loads with
+    keys or indexes.
+
+    --without-rowid
+    Create the new table as a WITHOUT ROWID table (needs a primary key).
+
+    -a, --incremental
+    Record the progress of the load in the table file2db_sources of the
+    database, skip the file if it did not change since the last load and
+    resume from the last committed byte range if it grew or the last load
+    stopped. Each byte range (of the chunk bytes or 32 MiB) is committed with
+    its progress. A last line without newline is left for the next load. If
+    the part of the file loaded before changed, the load is refused, unless
+    rows are updated by a key (--key) and the file is loaded again.
+
+    --key
+    Comma-separated columns used to update existing rows instead of inserting
+    duplicates (upsert). A unique index is created on them if needed.
+
+    -g, --engine
+    Library used to read the CSV file: 'pandas' (default if installed) or
+    'csv', which streams rows with the standard library after a first pass
+    inferring the column types, and does not support chunks, workers on a
+    single file or incremental loads.
+
+    -s, --stats
+    Record statistics of each column in the table file2db_stats of the
+    database: the number of values, of NULL values, the minimum, the maximum
+    and an estimate of the number of distinct values (HyperLogLog sketch,
+    about 1.6 % error). Later loads in the table update them, even without
+    this option. Changes made outside file2db.py are not counted, and loads
+    with upserts (--key) mark them as inexact since the rows they update are
+    counted again. query_db.py --stats answers counts, minimums and maximums
+    of whole tables from exact statistics.
+
+    --dictionary
+    Store the text columns of a new table which have at most one distinct
+    value for ten values in the first rows as integer codes, each with a
+    lookup table of its values (named after the table and column followed
+    by _values). The rows are kept in the table named after the table
+    followed by _data, and the table is a view joining them back with the
+    original values and column names. Later loads in the table code their
+    values, even without this option. The view has no rowid: export it page
+    by page with a key.
+
+    --search
+    Comma-separated text columns indexed for full-text search (SQLite FTS5
+    table named after the table followed by _fts, with the trigram tokenizer
+    matching substrings of at least 3 characters). The index is filled once
+    the rows are loaded, then triggers keep it in sync with the inserts,
+    updates and deletes of the table, such as later loads. It does not copy
+    the text of the table. query_db.py --search looks up the index.
+
+    --shard-key
+    Column partitioning the table across several database files (shards),
+    numbered after the database file, each loaded by its own process. The
+    layout is saved in a manifest named after the database with the .json
+    extension, which query_db.py takes as database to query all the shards.
+
+    --shards
+    Number of shards of a table partitioned by a hash of the shard key.
+
+    --shard-bounds
+    Comma-separated sorted values of the shard key starting each shard after
+    the first, for a table partitioned by ranges of the key (dates for
+    example).
     
     -h, --help
     Display help.
@@ -45,16 +190,74 @@ def print_help():
     print(help_text)
     return None
 
+#dictionary of sqlite types corresponding to pandas dtypes, integers beyond
+#the signed 64 bits of SQLite (uint64) are kept as text
+sql_types = {'int64':'INTEGER', 'float64':'REAL', 'object':'TEXT',
+             'bool':'INTEGER', 'uint64':'TEXT'}
+
+#range of the integers of SQLite
+min_integer = -2 ** 63
+max_integer = 2 ** 63 - 1
+
+#values read as missing (NULL), as in pandas.read_csv
+na_values = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
+             '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN',
+             'None', 'n/a', 'nan', 'null'}
+
+#values read as booleans, as in pandas.read_csv
+bool_values = {'True': 1, 'TRUE': 1, 'true': 1, 'False': 0, 'FALSE': 0,
+               'false': 0}
+
+#pragmas set on the connection during the load, by load profile
+load_profiles = {
+    'default': {},
+    'fast': {'journal_mode': 'OFF', 'synchronous': 'OFF',
+             'cache_size': -262144, 'temp_store': 'MEMORY',
+             'locking_mode': 'EXCLUSIVE'},
+    'durable': {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                'cache_size': -65536, 'temp_store': 'MEMORY'},
+}
+
+#byte order marks, longest first because the UTF-32 marks start with UTF-16 ones
+byte_order_marks = [(codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+                    (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'),
+                    (codecs.BOM_UTF16_BE, 'utf-16')]
+
+#magic bytes and extensions of compressed files, with the function opening them
+compressions = [(b'\x1f\x8b', '.gz', gzip.open), (b'BZh', '.bz2', bz2.open),
+                (b'\xfd7zXZ\x00', '.xz', lzma.open)]
+
+#encoding used when a detected encoding fails further in the file
+decode_fallbacks = {'utf-8': 'latin-1'}
+
+#rows of the batches sent by the workers parsing several files, and number of
+#batches of each file waiting for the writer
+stream_rows = 10000
+stream_batches = 2
+
+#table of the database recording the progress of incremental loads
+sources_table = 'file2db_sources'
+
+#journal modes which are not safe to leave on the database after the load
+unsafe_journal_modes = ('OFF', 'MEMORY')
+
 def get_args():
     """Function which gets arguments passed when the function is run at the
-    command line. It returns the database file path, the table name and the
-    path for the file to be put in the table. Specify at least the full name 
-    (with path) for the file and a table name."""
+    command line. It returns a dictionary of keyword arguments for file_to_db,
+    with at least the database file path, the table name and the path for the
+    file to be put in the table. Specify at least the full name (with path)
+    for the file and a table name."""
     try:
         opts, args = getopt.getopt(sys.argv[1:], 
-                                   'd:t:n:f:e:h', 
+                                   'd:t:n:f:e:c:b:p:r:w:uk:i:ag:sh', 
                                    ['database=', 'table=', 'new=', 'file=', 'encoding=', 
-                                    'help'])
+                                    'chunksize=', 'chunk-bytes=', 'profile=',
+                                    'commit-rows=', 'workers=', 'unordered',
+                                    'primary-key=', 'unique=', 'index=',
+                                    'without-rowid', 'incremental', 'key=',
+                                    'engine=', 'shard-key=', 'shards=',
+                                    'shard-bounds=', 'stats', 'dictionary',
+                                    'search=', 'help'])
 
     except getopt.GetoptError as err:
         print(err)
@@ -68,8 +271,27 @@ def get_args():
     db_path = None
     tb_name = None
     new_table = None
-    file_path = None
+    file_paths = []
     encoding = None
+    chunksize = None
+    chunk_bytes = None
+    profile = 'default'
+    commit_rows = None
+    workers = None
+    ordered = True
+    primary_key = None
+    unique = []
+    indexes = []
+    without_rowid = False
+    incremental = False
+    upsert_key = None
+    engine = None
+    shard_key = None
+    shards = None
+    bounds = None
+    stats = False
+    dictionary = False
+    search_columns = None
     
     for opt, arg in opts:
         if opt in ('-h', '--help'):
@@ -82,29 +304,101 @@ def get_args():
         elif opt in ('-n', '--new'):
             new_table = True
         elif opt in ('-f', '--file'):
-            file_path = arg
+            file_paths.append(arg)
         elif opt in ('-e', '--encoding'):
             encoding = arg
+        elif opt in ('-c', '--chunksize'):
+            chunksize = int(arg)
+        elif opt in ('-b', '--chunk-bytes'):
+            chunk_bytes = int(arg)
+        elif opt in ('-p', '--profile'):
+            profile = arg
+        elif opt in ('-r', '--commit-rows'):
+            commit_rows = int(arg)
+        elif opt in ('-w', '--workers'):
+            workers = int(arg)
+        elif opt in ('-u', '--unordered'):
+            ordered = False
+        elif opt in ('-k', '--primary-key'):
+            primary_key = arg.split(',')
+        elif opt == '--unique':
+            unique.append(arg.split(','))
+        elif opt in ('-i', '--index'):
+            indexes.append(arg.split(','))
+        elif opt == '--without-rowid':
+            without_rowid = True
+        elif opt in ('-a', '--incremental'):
+            incremental = True
+        elif opt == '--key':
+            upsert_key = arg.split(',')
+        elif opt in ('-g', '--engine'):
+            engine = arg
+        elif opt == '--shard-key':
+            shard_key = arg
+        elif opt == '--shards':
+            shards = int(arg)
+        elif opt == '--shard-bounds':
+            bounds = arg.split(',')
+        elif opt in ('-s', '--stats'):
+            stats = True
+        elif opt == '--dictionary':
+            dictionary = True
+        elif opt == '--search':
+            search_columns = arg.split(',')
         else:
             print('Unhandled option')
     
-    if file_path == None:
+    if len(file_paths) == 0:
         print('Please provide a path for the file to be put in the dabase.')
         sys.exit()
+
+    #several files or a glob pattern are loaded by files_to_db
+    if len(file_paths) > 1 or glob.has_magic(file_paths[0]):
+        return dict(db_path=db_path, tb_name=tb_name, new_table=new_table,
+                    file_paths=file_paths, encoding=encoding,
+                    profile=profile, commit_rows=commit_rows, workers=workers,
+                    engine=engine, stats=stats)
         
     if tb_name == None:
         print('Please provide a table name.')
         sys.exit()
     
-    return db_path, tb_name, new_table, file_path, encoding
+    if profile not in load_profiles:
+        print('Please choose a profile among: {}.'\
+              .format(', '.join(load_profiles)))
+        sys.exit()
+
+    #a sharded table is loaded by shard_file_to_db
+    if shard_key != None:
+        return dict(db_path=db_path, tb_name=tb_name, file_path=file_paths[0],
+                    shard_key=shard_key, shards=shards, bounds=bounds,
+                    encoding=encoding, workers=workers, engine=engine,
+                    profile=profile, commit_rows=commit_rows,
+                    indexes=indexes, stats=stats)
+    
+    return dict(db_path=db_path, tb_name=tb_name, new_table=new_table,
+                file_path=file_paths[0], encoding=encoding, chunksize=chunksize,
+                chunk_bytes=chunk_bytes, profile=profile,
+                commit_rows=commit_rows, workers=workers, ordered=ordered,
+                primary_key=primary_key, unique=unique, indexes=indexes,
+                without_rowid=without_rowid, incremental=incremental,
+                upsert_key=upsert_key, engine=engine, stats=stats,
+                dictionary=dictionary, search_columns=search_columns)
+
+def sql_name(name):
+    """Replace characters not compatible with SQL syntax by underscore."""
+
+    return name.replace(':', '_').replace('.', '_').replace(' ', '_')\
+            .replace('-', '_')
 
-def create_tb_str(field_type, df, tb_name):
-    """Return a string that creates a SQLite table when executed by the cursors."""
+def create_tb_str(field_type, df, tb_name, primary_key=None, unique=None,
+                  without_rowid=False):
+    """Return a string that creates a SQLite table when executed by the cursors.
+    primary_key is a list of columns and unique a list of lists of columns."""
 
     #replace characters not compatible with SQL syntax by underscore
     for index, value in enumerate(field_type):
-        field_type[index] = (value[0].replace(':', '_').replace('.', '_')\
-                .replace(' ', '_').replace('-', '_'), value[1])
+        field_type[index] = (sql_name(value[0]), value[1])
 
     #convert spaces of table name to underscore
     tb_name = tb_name.replace(' ', '_')
@@ -113,16 +407,59 @@ def create_tb_str(field_type, df, tb_name):
     fields_str = ''
     for fields in field_type:
         fields_str += '{} {}, '.format(*fields)
+
+    #add table constraints
+    if primary_key:
+        fields_str += 'PRIMARY KEY ({}), '.format(
+                ', '.join([sql_name(i) for i in primary_key]))
+    for columns in unique or []:
+        fields_str += 'UNIQUE ({}), '.format(
+                ', '.join([sql_name(i) for i in columns]))
+
     exec_str_tb = 'CREATE TABLE {0} ({1})'.format(tb_name, fields_str.strip(', '))
+    if without_rowid:
+        exec_str_tb += ' WITHOUT ROWID'
     
     return exec_str_tb
 
+def create_index_strs(tb_name, indexes, unique=False):
+    """Return the strings that create secondary indexes on a table, from a list
+    of lists of columns."""
+
+    tb_name = tb_name.replace(' ', '_')
+
+    exec_strs = []
+    for columns in indexes:
+        columns = [sql_name(i) for i in columns]
+        if unique:
+            exec_str = 'CREATE UNIQUE INDEX IF NOT EXISTS uidx_{0}_{1} ON {0} ({2})'
+        else:
+            exec_str = 'CREATE INDEX IF NOT EXISTS idx_{0}_{1} ON {0} ({2})'
+        exec_strs.append(exec_str.format(tb_name, '_'.join(columns),
+                                         ', '.join(columns)))
+
+    return exec_strs
+
+def get_field_type(df):
+    """Return the list of (column, SQLite type) of a dataframe."""
+
+    return [(i, sql_types[str(j)]) for i, j in zip(df.columns, df.dtypes)]
+
+def get_field_str(columns):
+    """Return the string of column names compatible with SQL syntax used to
+    insert rows in a table."""
+
+    fields = [sql_name(i) for i in columns]
+
+    return ('{}, ' * len(fields)).strip(', ').format(*fields)
+
 def row_to_exec_str(df, row, field_type, tb_name, field_str):
     """Convert a row of a CSV file to an executable string for insertion of
     fields in an SQLite database table."""
     
     #get row values (records of the table)
-    values = [i for i in df.loc[row, :]]
+    #use the position because chunks keep the index of the whole file
+    values = [i for i in df.iloc[row, :]]
 
     #add quotation marks to values containing several words
     # and convert all nan values to NULL
@@ -154,8 +491,623 @@ def row_to_exec_str(df, row, field_type, tb_name, field_str):
     
     return exec_str
 
-def file_to_db(db_path=None, tb_name=None, new_table=None, file_path=None, encoding=None):
-    """Function which converts a file to a table in a database."""
+def compression(file_path):
+    """Return the extension of the compression of a file, detected from its
+    magic bytes or its extension, or None if the file is not compressed."""
+
+    with open(file_path, 'rb') as file:
+        magic = file.read(6)
+
+    for magic_bytes, extension, opener in compressions:
+        if magic.startswith(magic_bytes):
+            return extension
+    for magic_bytes, extension, opener in compressions:
+        if file_path.endswith(extension):
+            return extension
+
+    return None
+
+def open_source(file_path):
+    """Open a file in binary mode, decompressing it while it is read if it is
+    compressed."""
+
+    extension = compression(file_path)
+    for magic_bytes, ext, opener in compressions:
+        if ext == extension:
+            return opener(file_path, 'rb')
+
+    return open(file_path, 'rb')
+
+def detect_encoding(file_path, sample_size=65536):
+    """Detect the encoding of a file from its byte order mark or a sample of
+    its first bytes. Return the encoding and the reason why it was chosen."""
+
+    with open_source(file_path) as file:
+        sample = file.read(sample_size)
+
+    for bom, encoding in byte_order_marks:
+        if sample.startswith(bom):
+            return encoding, 'byte order mark'
+
+    #text in UTF-16 without byte order mark has a null byte in most characters
+    if sample[1::2].count(0) > len(sample) // 4:
+        return 'utf-16-le', 'null bytes in the sample'
+    if sample[0::2].count(0) > len(sample) // 4:
+        return 'utf-16-be', 'null bytes in the sample'
+
+    #the sample can end in the middle of a character
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return 'latin-1', 'sample is not valid utf-8'
+
+    return 'utf-8', 'sample is valid utf-8'
+
+def rows_per_chunk(file_path, chunk_bytes, sample_size=65536):
+    """Estimate the number of rows of a CSV file which fit in chunk_bytes from
+    the average length of the lines at the beginning of the file."""
+
+    with open_source(file_path) as file:
+        sample = file.read(sample_size)
+
+    #a single line longer than the sample is bigger than most chunks
+    n_lines = sample.count(b'\n')
+    if n_lines == 0:
+        return 1
+
+    return max(1, chunk_bytes * n_lines // len(sample))
+
+def bool_columns(df):
+    """Return the positions of the text columns of a dataframe which hold
+    booleans with missing values, kept as objects by pandas."""
+
+    return [index for index in range(df.shape[1])
+            if df.iloc[:, index].dtype == object and
+            df.iloc[:, index].notna().any() and
+            all([isinstance(i, bool) for i in df.iloc[:, index].dropna()])]
+
+def pin_dtypes(field_type):
+    """Return the pandas dtypes which keep the columns of later chunks
+    consistent with the SQLite types chosen from the first chunk."""
+
+    #integer columns are left free because missing values turn them to floats,
+    #check_dtypes checks them once they are read
+    pinned = {'TEXT': str, 'REAL': 'float64'}
+
+    return {col: pinned[typ] for col, typ in field_type if typ in pinned}
+
+def check_dtypes(df, field_type, bools=()):
+    """Raise ValueError if a chunk does not match the SQLite types chosen from
+    the first chunk. Text and real columns are pinned when they are read, an
+    integer column is checked to hold integers or booleans, also when missing
+    values turn them to floats or objects. The text columns at the positions
+    bools held booleans in the first chunk: their values are read back as
+    booleans, as in a load in one go. Return the chunk."""
+
+    for index in bools:
+        series = df.iloc[:, index]
+        if not all([i in bool_values for i in series.dropna()]):
+            raise ValueError("the column '{}' has values which are not "
+                             "booleans".format(field_type[index][0]))
+        df.iloc[:, index] = pd.Series([None if i != i else bool(bool_values[i])
+                                       for i in series], index=df.index,
+                                      dtype=object)
+
+    for index, (column, sql_type) in enumerate(field_type):
+        if sql_type != 'INTEGER':
+            continue
+        series = df.iloc[:, index]
+        if series.dtype.kind in 'ib':
+            continue
+        if series.dtype.kind == 'f':
+            values = series.dropna()
+            if (values == values.round()).all():
+                continue
+        elif series.dtype.kind == 'O':
+            #booleans with missing values are read as objects
+            if all([isinstance(i, bool) for i in series.dropna()]):
+                continue
+        raise ValueError("the column '{}' has values which are not integers"\
+                         .format(column))
+
+    return df
+
+def column_values(series):
+    """Convert a dataframe column to a list of native Python values which can
+    be bound to a SQLite statement, booleans as integers and missing values as
+    None (NULL)."""
+
+    if series.dtype == bool:
+        return series.astype('int64').tolist()
+
+    #integers too large for SQLite are stored in a text column
+    if series.dtype.kind == 'u':
+        return series.astype(str).tolist()
+
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+
+    return series.tolist()
+
+def df_to_rows(df):
+    """Return an iterator over the rows of a dataframe as tuples of native
+    values, converted column by column."""
+
+    columns = [column_values(df.iloc[:, index]) for index in range(df.shape[1])]
+
+    return zip(*columns)
+
+def insert_str(tb_name, field_str, ncols):
+    """Return a parameterized string inserting one row in a database table."""
+
+    return 'INSERT INTO {0} ({1}) VALUES ({2})'.format(tb_name, field_str,
+                            ', '.join(['?'] * ncols))
+
+def read_chunks(file_path, encoding, chunksize, field_type, bools=()):
+    """Generate the chunks of a CSV file, read with the column types of the
+    first chunk and its boolean text columns (see check_dtypes)."""
+
+    with open_source(file_path) as file:
+        for chunk in pd.read_csv(file, encoding=encoding, chunksize=chunksize,
+                                 dtype=pin_dtypes(field_type), compression=None):
+            yield check_dtypes(chunk, field_type, bools)
+
+def count_quotes(mm, start, end, block_size=1 << 20):
+    """Count the quotation marks of a memory-mapped file between two offsets,
+    block by block to bound memory use."""
+
+    count = 0
+    for pos in range(start, end, block_size):
+        count += mm[pos:min(pos + block_size, end)].count(b'"')
+
+    return count
+
+def record_end(mm, record_start, pos):
+    """Return the offset following the first newline at or after pos which is
+    not inside a quoted field. record_start must be the start of a record, so
+    the quotes between it and pos tell if pos is inside a quoted field."""
+
+    quotes = count_quotes(mm, record_start, pos)
+    while True:
+        newline = mm.find(b'\n', pos)
+        if newline == -1:
+            return len(mm)
+        quotes += count_quotes(mm, pos, newline)
+        if quotes % 2 == 0:
+            return newline + 1
+        pos = newline + 1
+
+def complete_end(mm, record_start, end):
+    """Return the offset following the last newline before end which is not
+    inside a quoted field, or record_start if there is none, so that a last
+    record without newline is left out."""
+
+    newline = mm.rfind(b'\n', record_start, end)
+    while newline != -1:
+        if count_quotes(mm, record_start, newline) % 2 == 0:
+            return newline + 1
+        newline = mm.rfind(b'\n', record_start, newline)
+
+    return record_start
+
+def record_ranges(file_path, range_bytes, start=None, complete=False):
+    """Split a CSV file in byte ranges of about range_bytes, from start or
+    after the header, which start and end on record boundaries. Newlines
+    inside quoted fields are not record boundaries. If complete is True, a
+    last record which does not end with a newline (still being written) is
+    left out."""
+
+    ranges = []
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return ranges
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if start == None:
+                start = record_end(mm, 0, 0)
+            while start < len(mm):
+                end = record_end(mm, start, min(start + range_bytes, len(mm)))
+                if complete and end == len(mm) and mm[end - 1:end] != b'\n':
+                    end = complete_end(mm, start, end)
+                    if end > start:
+                        ranges.append((start, end))
+                    break
+                ranges.append((start, end))
+                start = end
+
+    return ranges
+
+def byte_range_encoding(encoding):
+    """Tell if records of a file in an encoding can be split on newline
+    bytes, which is true for encodings compatible with ASCII."""
+
+    if codecs.lookup(encoding).name == 'utf-8-sig':
+        return True
+
+    return '\n,"'.encode(encoding) == b'\n,"'
+
+def parse_range(task):
+    """Parse a byte range of a CSV file with the columns and pinned types of
+    the first chunk and return its rows as native values. Run in worker
+    processes."""
+
+    file_path, start, end, encoding, field_type, dtype, bools = task
+    columns = [i for i, j in field_type]
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[start:end]
+
+    df = pd.read_csv(io.BytesIO(data), encoding=encoding, header=None,
+                     names=columns, dtype=dtype)
+
+    return list(df_to_rows(check_dtypes(df, field_type, bools)))
+
+def parallel_batches(file_path, encoding, field_type, workers, range_bytes,
+                     ordered=True, bools=()):
+    """Generate the rows of the byte ranges of a CSV file parsed by a pool of
+    worker processes, in the order of the file or as they are parsed."""
+
+    dtype = pin_dtypes(field_type)
+    tasks = [(file_path, start, end, encoding, list(field_type), dtype,
+              bools)
+             for start, end in record_ranges(file_path, range_bytes)]
+
+    with multiprocessing.Pool(workers) as pool:
+        if ordered:
+            results = pool.imap(parse_range, tasks)
+        else:
+            results = pool.imap_unordered(parse_range, tasks)
+        for rows in results:
+            yield rows
+
+def read_batches(file_path, encoding, chunksize, field_type, workers=None,
+                 range_bytes=None, ordered=True, bools=()):
+    """Return an iterator over batches of rows of a CSV file, as native values,
+    parsed in chunks or in byte ranges by worker processes. bools are the
+    positions of the boolean text columns of the first chunk."""
+
+    if workers != None:
+        return parallel_batches(file_path, encoding, field_type, workers,
+                                range_bytes, ordered, bools)
+
+    return (df_to_rows(chunk) for chunk in
+            read_chunks(file_path, encoding, chunksize, field_type, bools))
+
+def upsert_str(tb_name, field_str, ncols, key):
+    """Return a parameterized string inserting one row in a database table, or
+    updating the row with the same key columns if it exists."""
+
+    key = [sql_name(i) for i in key]
+    updates = ['{0} = excluded.{0}'.format(i) for i in field_str.split(', ')
+               if i not in key]
+    if updates:
+        conflict = 'DO UPDATE SET {}'.format(', '.join(updates))
+    else:
+        conflict = 'DO NOTHING'
+
+    return '{0} ON CONFLICT ({1}) {2}'.format(
+            insert_str(tb_name, field_str, ncols), ', '.join(key), conflict)
+
+def table_exists(cur, tb_name):
+    """Tell if a table or view is in the database."""
+
+    cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = ? AND "
+                "type IN ('table', 'view')", (tb_name,))
+
+    return cur.fetchone()[0] > 0
+
+def source_progress(cur, file_path, tb_name):
+    """Return the progress recorded by the last incremental load of a file in
+    a table, as (size, mtime, checksum, offset, rows), or None."""
+
+    cur.execute('CREATE TABLE IF NOT EXISTS {} (source TEXT, tb_name TEXT, '
+                'size INTEGER, mtime REAL, checksum TEXT, offset INTEGER, '
+                'rows INTEGER, PRIMARY KEY (source, tb_name))'\
+                .format(sources_table))
+    cur.execute('SELECT size, mtime, checksum, offset, rows FROM {} WHERE '
+                'source = ? AND tb_name = ?'.format(sources_table),
+                (os.path.abspath(file_path), tb_name))
+
+    return cur.fetchone()
+
+def resume_offset(file_path, progress, block_size=1 << 20):
+    """Return the offset where an incremental load resumes and the hash of the
+    file up to this offset. The offset is 0 if the part of the file loaded
+    before has changed."""
+
+    hasher = hashlib.sha256()
+    if progress == None or os.path.getsize(file_path) < progress[3]:
+        return 0, hasher
+
+    with open(file_path, 'rb') as file:
+        remaining = progress[3]
+        while remaining > 0:
+            block = file.read(min(block_size, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+
+    if hasher.hexdigest() != progress[2]:
+        return 0, hashlib.sha256()
+
+    return progress[3], hasher
+
+def load_incremental(cur, file_path, tb_name, encoding, exec_str, field_type,
+                     range_bytes, progress, stats=None, encoders=None,
+                     upsert=False, cancel=None, bools=()):
+    """Insert the complete records of the byte ranges of a file which were
+    not loaded yet, committing each range with the progress of the load and,
+    if a list of column statistics is given, the statistics of its rows. The
+    text columns at the positions bools hold booleans (see check_dtypes). A
+    last record without newline is left for the next load. Values of coded
+    columns are replaced by their codes with the encoders. If the part of the
+    file loaded before changed, the file is loaded again from the start when
+    its rows are upserted, else File2dbError is raised, as when the cancel
+    event is set. Return the number of rows inserted."""
+
+    source = os.path.abspath(file_path)
+    offset, hasher = resume_offset(file_path, progress)
+    if progress != None and offset == 0 and progress[4] > 0:
+        if not upsert:
+            raise File2dbError("File '{}' changed before the last loaded "
+                               "offset and its rows are already in the table. "
+                               "Please load it with a key or in a new table."\
+                               .format(file_path))
+        logger.info("File changed before the last loaded offset, loading it "
+                    "again from the start.")
+    n_rows = progress[4] if offset > 0 else 0
+
+    columns = [i for i, j in field_type]
+    dtype = pin_dtypes(field_type)
+    stat = os.stat(file_path)
+    inserted = 0
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if offset == 0:
+                offset = record_end(mm, 0, 0)
+                hasher.update(mm[0:offset])
+
+            for start, end in record_ranges(file_path, range_bytes, offset,
+                                            complete=True):
+                check_cancel(cancel)
+                data = mm[start:end]
+                hasher.update(data)
+                df = pd.read_csv(io.BytesIO(data), encoding=encoding,
+                                 header=None, names=columns, dtype=dtype)
+                rows = df_to_rows(check_dtypes(df, field_type, bools))
+                if stats != None:
+                    rows = stats_rows(rows, stats)
+                if encoders:
+                    rows = encode_rows(rows, cur, encoders)
+                inserted += insert_rows(cur, exec_str, rows, cancel=cancel)
+                offset = end
+                if stats != None:
+                    save_stats(cur, tb_name, stats, not upsert)
+
+                #the rows and the progress are committed together
+                cur.execute('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?, ?, '
+                            '?, ?)'.format(sources_table),
+                            (source, tb_name, stat.st_size, stat.st_mtime,
+                             hasher.hexdigest(), offset, n_rows + inserted))
+                cur.connection.commit()
+
+    #record the new modification time even if nothing was appended
+    cur.execute('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?, ?, ?, ?)'\
+                .format(sources_table), (source, tb_name, stat.st_size,
+                stat.st_mtime, hasher.hexdigest(), offset, n_rows + inserted))
+    cur.connection.commit()
+
+    return inserted
+
+def default_engine(engine=None):
+    """Return the engine reading CSV files: pandas if it is installed, else the
+    csv module."""
+
+    if engine == None:
+        return 'csv' if pd == None else 'pandas'
+
+    if engine not in ('pandas', 'csv'):
+        raise File2dbError("Please choose the engine 'pandas' or 'csv'.")
+    if engine == 'pandas' and pd == None:
+        raise File2dbError("The pandas engine needs pandas, please install it "
+                           "or use the 'csv' engine.")
+
+    return engine
+
+def value_kind(value):
+    """Return the kind of a CSV value: 'na', 'bool', 'int', 'bigint' (an
+    integer beyond the range of SQLite), 'float' or 'text'."""
+
+    if value in na_values:
+        return 'na'
+    if value in bool_values:
+        return 'bool'
+    #python accepts underscores in numbers, pandas does not
+    if '_' in value:
+        return 'text'
+    try:
+        number = int(value)
+        return 'int' if min_integer <= number <= max_integer else 'bigint'
+    except ValueError:
+        pass
+    try:
+        float(value)
+        return 'float'
+    except ValueError:
+        return 'text'
+
+def column_kind(kinds):
+    """Return the kind of a column from the set of kinds of its values, with
+    the same rules as the dtypes chosen by pandas: 'int', 'bool', 'float',
+    'bool_text' or 'text'."""
+
+    has_na = 'na' in kinds
+    kinds = kinds - {'na'}
+    if not kinds:
+        return 'float'
+    #pandas keeps booleans with missing values in a text column
+    if kinds == {'bool'}:
+        return 'bool_text' if has_na else 'bool'
+    if kinds == {'int'}:
+        return 'float' if has_na else 'int'
+    #pandas keeps integers beyond 64 bits as text, unless there are decimals
+    if kinds <= {'int', 'bigint'}:
+        return 'text'
+    if kinds <= {'int', 'bigint', 'float'}:
+        return 'float'
+
+    return 'text'
+
+#SQLite type of each column kind
+kind_types = {'int': 'INTEGER', 'bool': 'INTEGER', 'float': 'REAL',
+              'bool_text': 'TEXT', 'text': 'TEXT'}
+
+def open_csv(file_path, encoding):
+    """Return a csv reader over a file opened with an encoding, and the file."""
+
+    file = io.TextIOWrapper(open_source(file_path), encoding=encoding,
+                            newline='')
+
+    return csv.reader(file), file
+
+def infer_csv_types(file_path, encoding):
+    """Read a CSV file with the csv module and return its columns and the kind
+    of each column, inferred from all the values in one streaming pass."""
+
+    reader, file = open_csv(file_path, encoding)
+    with file:
+        columns = next(reader, [])
+        kinds = [set() for column in columns]
+        for line in reader:
+            for index, value in enumerate(line[:len(columns)]):
+                kinds[index].add(value_kind(value))
+
+    return columns, [column_kind(i) for i in kinds]
+
+def convert_value(value, kind):
+    """Convert a CSV value to a native value of a column kind, missing values
+    to None."""
+
+    if value in na_values:
+        return None
+    if kind == 'int':
+        return int(value)
+    if kind in ('bool', 'bool_text'):
+        return bool_values[value]
+    if kind == 'float':
+        return float(value)
+
+    return value
+
+def csv_rows(file_path, encoding, kinds):
+    """Generate the rows of a CSV file read with the csv module, as tuples of
+    native values of the column kinds. Blank lines are skipped."""
+
+    ncols = len(kinds)
+    reader, file = open_csv(file_path, encoding)
+    with file:
+        next(reader, None)
+        for line in reader:
+            if not line:
+                continue
+            if len(line) > ncols:
+                raise ValueError('Expected {0} fields in line {1}, saw {2}'\
+                        .format(ncols, reader.line_num, len(line)))
+            line += [''] * (ncols - len(line))
+            yield tuple([convert_value(value, kind)
+                         for value, kind in zip(line, kinds)])
+
+def set_pragmas(cur, pragmas):
+    """Set pragmas on the connection of the cursor."""
+
+    for name, value in pragmas.items():
+        cur.execute('PRAGMA {0} = {1}'.format(name, value))
+
+    return None
+
+def restore_pragmas(cur, profile):
+    """Restore safe settings on the connection of the cursor after a load made
+    with a load profile."""
+
+    pragmas = load_profiles[profile]
+    if not pragmas:
+        return None
+
+    #the journal mode is stored in the database file, other pragmas only last
+    #as long as the connection
+    safe = {'synchronous': 'FULL', 'temp_store': 'DEFAULT',
+            'locking_mode': 'NORMAL'}
+    if pragmas.get('journal_mode') in unsafe_journal_modes:
+        safe['journal_mode'] = 'DELETE'
+    set_pragmas(cur, safe)
+
+    #the exclusive lock is only released at the next access to the database
+    cur.execute('SELECT COUNT(*) FROM sqlite_master').fetchall()
+
+    return None
+
+def check_cancel(cancel):
+    """Raise File2dbError if the event cancelling a load is set."""
+
+    if cancel != None and cancel.is_set():
+        raise File2dbError('The load was cancelled.')
+
+    return None
+
+def insert_rows(cur, exec_str, rows, batch_size=10000, commit=False,
+                cancel=None):
+    """Insert rows with a prepared statement executed in batches. If commit is
+    True, the work is committed after each batch. The cancel event (see
+    threading.Event) is checked before each batch. Return the number of
+    rows."""
+
+    rows = iter(rows)
+    n_rows = 0
+    while True:
+        check_cancel(cancel)
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        cur.executemany(exec_str, batch)
+        n_rows += len(batch)
+        if commit:
+            cur.connection.commit()
+
+    return n_rows
+
+def file_to_db(db_path=None, tb_name=None, new_table=None, file_path=None,
+               encoding=None, chunksize=None, chunk_bytes=None,
+               profile='default', commit_rows=None, workers=None, ordered=True,
+               primary_key=None, unique=None, indexes=None,
+               without_rowid=False, incremental=False, upsert_key=None,
+               engine=None, conn=None, stats=False, dictionary=False,
+               search_columns=None, cancel=None):
+    """Function which converts a file to a table in a database. If chunksize
+    (rows) or chunk_bytes is given, the file is streamed in chunks so memory
+    use does not grow with the file size. The profile selects the pragmas used
+    during the load (see load_profiles) and commit_rows the number of rows
+    inserted between commits. If workers is given, byte ranges of chunk_bytes
+    are parsed by this number of processes and inserted in the order of the
+    file, or as they are parsed if ordered is False. primary_key, unique and
+    without_rowid define the constraints of a new table, and the secondary
+    indexes (lists of columns) are built after the load. In incremental mode
+    the progress of the load is recorded in the database, unchanged files are
+    skipped and grown files resume from the last committed byte range. Rows
+    with the same upsert_key columns as existing rows update them. The engine
+    reading the file is 'pandas' or 'csv' (standard library). With stats, the
+    count, NULL count, minimum, maximum and distinct estimate of each column
+    are recorded in the stats table with the rows, and they are updated by
+    the later loads in the table, which mark them inexact if they upsert.
+    With dictionary, the text columns of a new table with few distinct
+    values (see dictionary_ratio) are stored as codes of lookup tables, the
+    rows in a data table and the table is a view with the original values,
+    kept coded by the later loads. The text columns of
+    the list search_columns get a full-text index, filled after the load and
+    kept in sync with the table by triggers. A connection which stays open
+    can be given in conn. If the cancel event (see threading.Event) is set,
+    the load stops before its next batch and its rows which were not
+    committed are dropped. Return the number of rows inserted, or raise
+    File2dbError if the file cannot be loaded or the load is cancelled."""
     
     #=========================================#
     #=== perform checks on input variables ===#
@@ -163,11 +1115,20 @@ def file_to_db(db_path=None, tb_name=None, new_table=None, file_path=None, encod
     
     #check the user provided table name and file
     if tb_name == None:
-        print("Please provide a name for the database table.")
-        sys.exit()
+        raise File2dbError("Please provide a name for the database table.")
     if file_path == None:
-        print("Please provide a file to be inserted in the database.")
-        sys.exit()
+        raise File2dbError("Please provide a file to be inserted in the "
+                           "database.")
+    if without_rowid and not primary_key:
+        raise File2dbError("Please provide a primary key for a table without "
+                           "rowid.")
+    if without_rowid and search_columns:
+        raise File2dbError("Cannot build a full-text index of a table without "
+                           "rowid.")
+    engine = default_engine(engine)
+    if engine == 'csv' and (chunksize or chunk_bytes or workers or incremental):
+        raise File2dbError("Chunks, workers and incremental loads need the "
+                           "pandas engine.")
     
     #get working directory as the directory of the file to be put in the database
     system = sys.platform
@@ -187,120 +1148,594 @@ def file_to_db(db_path=None, tb_name=None, new_table=None, file_path=None, encod
             db_name = db_path.split('/')[-1]
         
     #create the database if it does not exist already
-    if db_name not in next(os.walk(os.getcwd()))[2]:
+    own_conn = conn == None
+    if own_conn and db_name not in next(os.walk(os.getcwd()))[2]:
         #create database file and connect to it, then create cursor
         conn = sqlite3.connect(db_path)
         cur = conn.cursor()
-        print("Created database '{}'".format(db_name))
+        logger.info("Created database '{}'".format(db_name))
     else:
-        conn = sqlite3.connect(db_path)
+        conn = conn or sqlite3.connect(db_path)
         cur = conn.cursor()
-        
-    #determine if the table is already in the database
-    #cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    #for line in cur:
-    #    if tb_name in line:
-    #        print("Table name '{}' already used. Please choose another name."\
-    #              .format(tb_name))
-    #        sys.exit()
-
-    #===========================================#
-    #=== import csv file to pandas dataframe ===#
-    #===========================================#
-    
-    df = None
-    if system == 'win32':
-        f_name = file_path.split('\\')[-1]
-    elif system == 'linux':
-        f_name = file_path.split('/')[-1]
-    #if no encoding was provided try utf-8, latin-1 and utf-16
-    if encoding == None:
+
+    #tune the connection for the load
+    set_pragmas(cur, load_profiles[profile])
+
+    #the settings of the connection are restored even if the load fails
+    loaded = False
+    try:
+        #skip files which did not change since the last incremental load
+        if incremental:
+            progress = source_progress(cur, file_path, tb_name)
+            stat = os.stat(file_path)
+            if progress != None and progress[0] == stat.st_size and \
+                    progress[1] == stat.st_mtime and \
+                    progress[3] == stat.st_size:
+                logger.info("File '{}' did not change since the last load, "
+                            "skipped.".format(file_path))
+                loaded = True
+                return 0
+
+        #determine if the table is already in the database
+        #cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        #for line in cur:
+        #    if tb_name in line:
+        #        print("Table name '{}' already used. Please choose another "
+        #              "name.".format(tb_name))
+        #        sys.exit()
+
+        #===========================================#
+        #=== import csv file to pandas dataframe ===#
+        #===========================================#
+
+        df = None
+        kinds = None
+        if system == 'win32':
+            f_name = file_path.split('\\')[-1]
+        elif system == 'linux':
+            f_name = file_path.split('/')[-1]
+
+        #in streaming mode only the first chunk is read to choose column types
+        if chunksize == None and chunk_bytes != None:
+            chunksize = rows_per_chunk(file_path, chunk_bytes)
+
+        #if no encoding was provided, detect it from the beginning of the file
+        detected = encoding == None
+        if detected:
+            encoding, reason = detect_encoding(file_path)
+            logger.info("Used '{0}' to decode the file ({1})."\
+                        .format(encoding, reason))
+
+        #incremental loads commit byte ranges
+        range_bytes = None
+        compressed = compression(file_path) != None
+        if incremental and (compressed or not byte_range_encoding(encoding)):
+            raise File2dbError("Cannot split a compressed file or '{}' text in "
+                               "byte ranges for an incremental load."\
+                               .format(encoding))
+        if incremental:
+            range_bytes = chunk_bytes or 32 * 1024 * 1024
+            workers = None
+            if chunksize == None:
+                chunksize = 10000
+
+        #byte ranges are parsed with the types of a sample of the file
+        elif workers != None:
+            if byte_range_encoding(encoding) and not compressed:
+                range_bytes = chunk_bytes or 32 * 1024 * 1024
+                if chunksize == None:
+                    chunksize = 10000
+            else:
+                logger.info("Cannot split a compressed file or '{}' text in "
+                            "byte ranges, reading the file in a single "
+                            "process.".format(encoding))
+                workers = None
+
         while True:
             try:
-                df = pd.read_csv(file_path, encoding='utf-8')
-                print("Used 'utf-8' to decode the file.")
+                #the csv engine reads the whole file once to infer the types
+                if engine == 'csv':
+                    columns, kinds = infer_csv_types(file_path, encoding)
+                else:
+                    with open_source(file_path) as file:
+                        df = pd.read_csv(file, encoding=encoding,
+                                         nrows=chunksize, compression=None)
+                    columns = list(df.columns)
                 break
             except UnicodeDecodeError:
-                print("Failed to use 'utf-8' to decode the file.")
+                if not detected or encoding not in decode_fallbacks:
+                    raise File2dbError('Could not read the file. Please '
+                                       'specify the right encoding.')
+                logger.info("Failed to use '{0}' to decode the file, used "
+                            "'{1}'.".format(encoding,
+                                            decode_fallbacks[encoding]))
+                encoding = decode_fallbacks[encoding]
+            except (ValueError, csv.Error) as err:
+                raise File2dbError('Could not parse the file: {}'.format(err))
+
+        #list of (column, type) of dataframe, and the text columns of
+        #booleans which later chunks read back as booleans
+        if engine == 'csv':
+            field_type = [(i, kind_types[j]) for i, j in zip(columns, kinds)]
+            bools = []
+        else:
+            field_type = get_field_type(df)
+            bools = bool_columns(df)
+
+        #keep the types to read the file again if decoding fails in a later
+        #chunk
+        pinned_type = list(field_type)
+
+        #stream the whole file with the types of the first chunk
+        if engine == 'csv':
+            batches = [csv_rows(file_path, encoding, kinds)]
+        elif incremental:
+            batches = []
+        elif workers != None:
+            batches = read_batches(file_path, encoding, chunksize, field_type,
+                                   workers, range_bytes, ordered, bools)
+        elif chunksize != None:
+            batches = read_batches(file_path, encoding, chunksize, field_type,
+                                   bools=bools)
+        else:
+            batches = [df_to_rows(df)]
+
+        #================================#
+        #=== create table in database ===#
+        #================================#
+
+        #rows of a table with coded columns go to its data table
+        coded = coded_columns(cur, tb_name)
+        search_columns = [sql_name(i) for i in search_columns or []]
+        missing = [i for i in search_columns
+                   if i not in [sql_name(j) for j in columns]]
+        if missing or set(search_columns) & set(coded):
+            raise File2dbError("Cannot build a full-text index of the columns "
+                               "{}.".format(', '.join(
+                                   missing or sorted(set(search_columns) &
+                                                     set(coded)))))
+
+        #incremental loads of an existing table do not create it again
+        if new_table and not (incremental and table_exists(cur, tb_name)):
+            #text columns with few distinct values in the first rows are coded
+            coded = []
+            if dictionary:
+                if engine == 'csv':
+                    try:
+                        sample = sample_rows(csv_rows(file_path, encoding,
+                                                      kinds))
+                    except (ValueError, csv.Error) as err:
+                        raise File2dbError('Could not parse the file: {}'\
+                                           .format(err))
+                else:
+                    sample = sample_rows(df_to_rows(df))
+                coded = low_cardinality([(sql_name(i), j) for i, j in field_type
+                                         if sql_name(i) not in search_columns],
+                                        sample)
+
+            #make executable string to create table in database
+            if coded:
+                exec_str_tb = create_tb_str(coded_type(
+                    [(sql_name(i), j) for i, j in field_type], coded), df,
+                    data_table(tb_name), primary_key, unique, without_rowid)
+            else:
+                exec_str_tb = create_tb_str(field_type, df, tb_name,
+                                            primary_key, unique, without_rowid)
+
+            #create table
+            cur.execute(exec_str_tb)
+            clear_dictionary(cur, tb_name)
+            if coded:
+                create_dictionary(cur, tb_name, [sql_name(i) for i in columns],
+                                  coded)
+                logger.info("Coded the columns {} with lookup tables."\
+                            .format(', '.join(coded)))
+            clear_stats(cur, tb_name)
+            logger.info("Inserted table '{}' in the database.".format(tb_name))
+        target = data_table(tb_name) if coded else tb_name
+
+        #the statistics of a table are kept up to date by every load
+        stats = stats or has_stats(cur, tb_name)
+
+        #=================================#
+        #=== put chunks into the table ===#
+        #=================================#
+
+        #get column names (fields of the table) and put them in string
+        field_str = get_field_str(columns)
+        if upsert_key:
+            exec_str = upsert_str(target, field_str, len(columns), upsert_key)
+            #upserts need a unique index on the key
+            if [sql_name(i) for i in upsert_key] != \
+                    [sql_name(i) for i in primary_key or []]:
+                cur.execute(create_index_strs(target, [upsert_key], True)[0])
+        else:
+            exec_str = insert_str(target, field_str, len(columns))
+
+        #commit after each batch of commit_rows rows, or once at the end
+        if commit_rows != None:
+            batch = dict(batch_size=commit_rows, commit=True)
+        else:
+            batch = dict()
+
+        #a detected encoding can be replaced if nothing was committed yet
+        retry = detected and commit_rows == None and not incremental and \
+                load_profiles[profile].get('journal_mode') != 'OFF'
+
+        while True:
+            n_rows = 0
+            column_stats = new_stats([sql_name(i) for i in columns]) \
+                           if stats else None
+            encoders = load_codes(cur, tb_name, [sql_name(i) for i in columns],
+                                  coded)
             try:
-                df = pd.read_csv(file_path, encoding='latin-1')
-                print("Used 'latin-1' to decode the file.")
+                if incremental:
+                    n_rows = load_incremental(cur, file_path, tb_name,
+                                              encoding, exec_str, pinned_type,
+                                              range_bytes, progress,
+                                              column_stats, encoders,
+                                              bool(upsert_key), cancel, bools)
+                    logger.info('{} new rows.'.format(n_rows))
+                for rows in batches:
+                    if stats:
+                        rows = stats_rows(rows, column_stats)
+                    if encoders:
+                        rows = encode_rows(rows, cur, encoders)
+                    n_rows += insert_rows(cur, exec_str, rows, cancel=cancel,
+                                          **batch)
                 break
             except UnicodeDecodeError:
-                print("Failed to use 'latin-1' to decode the file.")
+                if not retry or encoding not in decode_fallbacks:
+                    raise File2dbError('Could not read the file. Please '
+                                       'specify the right encoding.')
+                logger.info("Failed to use '{0}' to decode the file, used "
+                            "'{1}'.".format(encoding,
+                                            decode_fallbacks[encoding]))
+                conn.rollback()
+                encoding = decode_fallbacks[encoding]
+                batches = read_batches(file_path, encoding, chunksize,
+                                       pinned_type, workers, range_bytes,
+                                       ordered, bools)
+            except ValueError as err:
+                raise File2dbError('Chunk does not match the column types of '
+                                   'the first chunk: {}'.format(err))
+            except csv.Error as err:
+                raise File2dbError('Could not parse the file: {}'.format(err))
+
+        #the statistics are committed with the last rows
+        if stats and not incremental:
+            save_stats(cur, tb_name, column_stats, not upsert_key)
+
+        #commit work, unless the load was cancelled during the last batch
+        check_cancel(cancel)
+        conn.commit()
+
+        #indexes are faster to build once than to update for each row, then
+        #fresh statistics help the planner use them
+        for exec_str_idx in create_index_strs(target, indexes or []):
+            cur.execute(exec_str_idx)
+        if primary_key or unique or indexes:
+            cur.execute('ANALYZE {}'.format(target.replace(' ', '_')))
+            conn.commit()
+
+        #the full-text index is filled in bulk, then kept in sync by triggers
+        if search_columns and not has_search_index(cur, tb_name):
             try:
-                df = pd.read_csv(file_path, encoding='utf-16')
-                print("Used 'utf-16' to decode the file.")
-                break
-            except UnicodeDecodeError:
-                print("Failed to use 'utf-16' to decode the file.")
+                create_search_index(cur, tb_name, search_columns)
+            except ValueError as err:
+                raise File2dbError('Cannot build the full-text index: {}'\
+                                   .format(err))
+            conn.commit()
+            logger.info("Built the full-text index of the columns {}."\
+                        .format(', '.join(search_columns)))
 
-            print('Could not decode file, please select encoding')
-            sys.exit()
+        logger.info("File '{0}' inserted in the table '{1}' in the "
+                    "database '{2}'.".format(f_name, tb_name, db_name))
+        loaded = True
+    finally:
+        #the rows of a failed load which were not committed are dropped
+        if not loaded:
+            conn.rollback()
+        restore_pragmas(cur, profile)
+
+        #close cursor and connection to database
+        cur.close()
+        if own_conn:
+            conn.close()
+    
+    return n_rows
+
+def expand_files(patterns):
+    """Return the sorted list of files matching a list of paths or glob
+    patterns, without duplicates."""
+
+    file_paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        for match in matches:
+            if match not in file_paths:
+                file_paths.append(match)
+
+    return file_paths
+
+def default_db_path(file_path):
+    """Return the path of the database made when none is given: a file named
+    new_database.sq3 in the directory of the file loaded."""
+
+    return os.path.join(os.path.dirname(file_path), 'new_database.sq3')
+
+def file_table_name(file_path):
+    """Return a table name made from the name of a file, without extension."""
+
+    name = os.path.basename(file_path).split('.')[0]
+
+    return name.replace(' ', '_').replace('-', '_')
+
+def stream_file(file_path, encoding, engine, batch_rows):
+    """Read a CSV file with an engine and generate the list of (column, type)
+    of the file, then lists of at most batch_rows rows as native values. The
+    pandas engine takes the types of the first batch, as with chunksize."""
+
+    if engine == 'csv':
+        columns, kinds = infer_csv_types(file_path, encoding)
+        yield [(i, kind_types[j]) for i, j in zip(columns, kinds)]
+        rows = csv_rows(file_path, encoding, kinds)
     else:
+        with open_source(file_path) as file:
+            df = pd.read_csv(file, encoding=encoding, nrows=batch_rows,
+                             compression=None)
+        field_type = get_field_type(df)
+        yield field_type
+        rows = itertools.chain.from_iterable(read_batches(
+            file_path, encoding, batch_rows, field_type,
+            bools=bool_columns(df)))
+
+    while True:
+        batch = list(itertools.islice(rows, batch_rows))
+        if not batch:
+            break
+        yield batch
+
+def parse_file(file_path, encoding, engine, queue, batch_rows):
+    """Read a CSV file and put its parts on a queue: ('start', encoding, list
+    of (column, type)), then ('rows', batch) messages, and ('end',) on success
+    or ('error', message). If the encoding fails, a new 'start' message
+    restarts the file with the fallback encoding. Run in worker processes,
+    which wait when the queue is full."""
+
+    try:
+        if encoding == None:
+            encoding, reason = detect_encoding(file_path)
         try:
-            df = pd.read_csv(file_path, encoding=encoding)
+            parts = stream_file(file_path, encoding, engine, batch_rows)
+            queue.put(('start', encoding, next(parts)))
+            for batch in parts:
+                queue.put(('rows', batch))
         except UnicodeDecodeError:
-            print('Could not read the file. Please specify the right encoding.')
-            sys.exit()
+            if encoding not in decode_fallbacks:
+                raise
+            encoding = decode_fallbacks[encoding]
+            parts = stream_file(file_path, encoding, engine, batch_rows)
+            queue.put(('start', encoding, next(parts)))
+            for batch in parts:
+                queue.put(('rows', batch))
+        queue.put(('end',))
 
-    #dictionary of sqlite types corresponding to pandas dtypes
-    sql_types = {'int64':'INTEGER', 'float64':'REAL', 'object':'TEXT',
-                 'bool':'INTEGER'}
-    
-    #list of (column, type) of dataframe
-    field_type = [(i, sql_types[str(j)]) for i, j in zip(df.columns, df.dtypes)]
+    except (OSError, UnicodeDecodeError, ValueError, KeyError,
+            csv.Error) as err:
+        queue.put(('error', '{}: {}'.format(type(err).__name__, err)))
+    except Exception as err:
+        #the writer raises the unexpected errors instead of waiting
+        queue.put(('raise', err))
 
-    #================================#
-    #=== create table in database ===#
-    #================================#
+    return None
 
-    if new_table:
-        #make executable string to create table in database
-        exec_str_tb = create_tb_str(field_type, df, tb_name)
+def queued_rows(queue, last):
+    """Generate the rows of the 'rows' messages of a queue, and record the
+    next message in the list last."""
 
-        #create table
-        cur.execute(exec_str_tb)
-        print("Inserted table '{}' in the database.".format(tb_name))
-    
-    #============================================#
-    #=== put dataframe into table, row by row ===#
-    #============================================#
+    while True:
+        message = queue.get()
+        if message[0] != 'rows':
+            last.append(message)
+            return
+        for row in message[1]:
+            yield row
 
-    #get field types of database and put them in a list
-    field_type = [j for i, j in field_type]
-    
-    #get column names (fields of the table) and put them in string
-    fields = [i.replace(':', '_').replace('.', '_').replace(' ', '_')\
-            .replace('-', '_') for i in df.columns]
-    field_str = ('{}, ' * len(fields)).strip(', ').format(*fields)
-
-    #print(field_str)
-
-    #get dataframe shape
-    nrows, ncols = df.shape
-    for row in range(nrows):
-        #make executable string
-        exec_str_row = row_to_exec_str(df, row, field_type, tb_name, field_str)
-            
-        #print(exec_str_row)
-
-        #execute query
-        cur.execute(exec_str_row)
-
-    #commit work
-    conn.commit()
-    print("File '{0}' inserted in the table '{1}' in the database '{2}'."\
-          .format(f_name, tb_name, db_name))
-
-    #close cursor and connection to database
-    cur.close()
-    conn.close()
-    
-    #for eventual testing
-    return None
+def drain_queue(queue, message):
+    """Read the messages of a queue until the end of its file, so that its
+    worker does not wait. Return the last message."""
+
+    while message[0] in ('start', 'rows'):
+        message = queue.get()
+
+    return message
+
+def insert_queue(cur, queue, tb_name, new_table, created, stats, batch,
+                 cancel=None):
+    """Insert the rows of a file read from the queue of its worker (see
+    parse_file) in a table, which is created if new_table is True and it is
+    not in the set created. The batch options and the cancel event are those
+    of insert_rows. Return the encoding, the number of rows and an error
+    message which is None on success."""
+
+    conn = cur.connection
+    used = None
+    message = queue.get()
+    while message[0] == 'start':
+        used, field_type = message[1:]
+        last = []
+        try:
+            if new_table and tb_name not in created:
+                cur.execute(create_tb_str(list(field_type), None, tb_name))
+                clear_stats(cur, tb_name)
+                clear_dictionary(cur, tb_name)
+                created.add(tb_name)
+            columns = [sql_name(i) for i, j in field_type]
+            field_str = get_field_str(columns)
+
+            #rows of a table with coded columns go to its data table
+            coded = coded_columns(cur, tb_name)
+            target = data_table(tb_name) if coded else tb_name
+            exec_str = insert_str(target, field_str, len(field_type))
+            load_rows = queued_rows(queue, last)
+            column_stats = None
+            if stats or has_stats(cur, tb_name):
+                column_stats = new_stats(columns)
+                load_rows = stats_rows(load_rows, column_stats)
+            if coded:
+                load_rows = encode_rows(load_rows, cur, load_codes(
+                    cur, tb_name, columns, coded))
+            n_rows = insert_rows(cur, exec_str, load_rows, cancel=cancel,
+                                 **batch)
+            message = last[0]
+            if message[0] == 'end':
+                if column_stats != None:
+                    save_stats(cur, tb_name, column_stats)
+                check_cancel(cancel)
+                conn.commit()
+                return used, n_rows, None
+        except sqlite3.Error as err:
+            conn.rollback()
+            if not last:
+                drain_queue(queue, ('rows',))
+            return used, 0, '{}: {}'.format(type(err).__name__, err)
+
+        #the rows of a file which failed or restarts with another encoding
+        #are dropped
+        conn.rollback()
+        if message[0] == 'start' and batch.get('commit') and n_rows > 0:
+            drain_queue(queue, message)
+            return used, 0, "UnicodeDecodeError: rows were committed with " \
+                            "'{}'".format(used)
+
+    if message[0] == 'raise':
+        raise message[1]
+
+    return used, 0, message[1]
+
+def files_to_db(db_path=None, tb_name=None, new_table=None, file_paths=None,
+                encoding=None, profile='default', commit_rows=None,
+                workers=None, engine=None, conn=None, stats=False,
+                cancel=None):
+    """Function which converts several files to tables in a database. Files
+    are parsed by a pool of worker processes and inserted by a single writer
+    connection, in the table tb_name or in one table per file if tb_name is
+    None. With stats, the statistics of the columns are recorded as by
+    file_to_db, and the values of tables with coded columns are coded. A
+    connection which stays open can be given in conn. The workers send the
+    rows in batches of stream_rows, and the files are inserted in the order
+    they are started, so memory use does not grow with the size of the files.
+    If the cancel event is set, File2dbError is raised before the next batch
+    and the files committed before are kept. Return the list of (file, table,
+    rows, error) for each file."""
+
+    engine = default_engine(engine)
+    file_paths = expand_files(file_paths or [])
+    if len(file_paths) == 0:
+        raise File2dbError("Please provide files to be inserted in the "
+                           "database.")
+
+    #if no database name was provided, place it next to the first file
+    if db_path == None:
+        db_path = default_db_path(file_paths[0])
+
+    #the single writer connection
+    own_conn = conn == None
+    if own_conn:
+        conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    set_pragmas(cur, load_profiles[profile])
+
+    if commit_rows != None:
+        batch = dict(batch_size=commit_rows, commit=True)
+    else:
+        batch = dict()
+
+    start = time.time()
+    created = set()
+    status = []
+    n_workers = workers or os.cpu_count()
+    try:
+        with multiprocessing.Manager() as manager, \
+                multiprocessing.Pool(n_workers) as pool:
+            #each file in flight has a worker and a queue of at most
+            #stream_batches batches, which bounds the rows held in memory
+            pending = []
+            paths = iter(file_paths)
+            while True:
+                for file_path in itertools.islice(paths,
+                                                  n_workers - len(pending)):
+                    queue = manager.Queue(stream_batches)
+                    #a task which cannot run reports its error to the writer
+                    pool.apply_async(parse_file, (file_path, encoding, engine,
+                                                  queue, stream_rows),
+                                     error_callback=lambda err, queue=queue:
+                                     queue.put(('raise', err)))
+                    pending.append((file_path, queue))
+                if not pending:
+                    break
+
+                #the files are inserted in the order they were started
+                file_path, queue = pending.pop(0)
+                table = tb_name if tb_name != None else \
+                        file_table_name(file_path)
+                used, n_rows, error = insert_queue(cur, queue, table,
+                                                   new_table, created, stats,
+                                                   batch, cancel)
+                status.append((file_path, table, n_rows, error))
+                if error == None:
+                    logger.info("File '{0}' inserted in the table '{1}' ({2} "
+                                "rows, '{3}').".format(file_path, table,
+                                                       n_rows, used))
+                else:
+                    logger.info("File '{0}' failed: {1}".format(file_path,
+                                                                error))
+    finally:
+        #an unexpected error does not leave the load settings
+        conn.rollback()
+        restore_pragmas(cur, profile)
+        cur.close()
+        if own_conn:
+            conn.close()
+
+    #totals
+    n_failed = len([i for i in status if i[3] != None])
+    logger.info("{0} files inserted, {1} failed, {2} rows in {3:.1f} s."\
+                .format(len(status) - n_failed, n_failed,
+                        sum([i[2] for i in status]), time.time() - start))
+
+    return status
 
 if __name__ == '__main__':
+    #the session loads with the file2db module, whose errors are caught
+    from session import Session
+    from file2db import File2dbError
+
     print('\nRunning file2db...\n')
-    db_path, tb_name, new_table, file_path, encoding = get_args()
-    _ = file_to_db(db_path, tb_name, new_table, file_path, encoding)
+    logging.basicConfig(format='%(message)s', level=logging.INFO,
+                        stream=sys.stdout)
+    options = get_args()
+
+    file_paths = options.get('file_paths') or [options['file_path']]
+    db_path = options.pop('db_path') or \
+              default_db_path((expand_files(file_paths) or file_paths)[0])
+    if not os.path.exists(db_path) and 'shard_key' not in options:
+        logger.info("Created database '{}'".format(os.path.basename(db_path)))
+
+    try:
+        if 'shard_key' in options:
+            from shards import shard_file_to_db
+            _ = shard_file_to_db(db_path, **options)
+            sys.exit()
+        with Session(db_path) as session:
+            if 'file_paths' in options:
+                _ = session.load_files(**options)
+            else:
+                _ = session.load(**options)
+    except (File2dbError, sqlite3.Error, OSError) as err:
+        print(err)
+        sys.exit(1)
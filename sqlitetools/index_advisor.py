@@ -0,0 +1,396 @@
+#script which proposes indexes for a workload of queries on a database, from
+#the columns of their WHERE, JOIN and ORDER BY clauses and their query plans
+
+#import modules
+import sys
+import getopt
+import sqlite3
+import re
+import glob
+import time
+
+from file2db import create_index_strs
+from query_db import read_query_statements, is_query
+from query_profile import query_plan, full_scans
+
+#words which end a table name and its alias in a FROM clause
+clause_words = {'WHERE', 'JOIN', 'ON', 'USING', 'LEFT', 'RIGHT', 'FULL',
+                'INNER', 'OUTER', 'CROSS', 'NATURAL', 'GROUP', 'ORDER',
+                'LIMIT', 'HAVING', 'UNION', 'EXCEPT', 'INTERSECT', 'WINDOW',
+                'INDEXED', 'NOT'}
+
+#operators of the predicates an index searches by equality, the others
+#search a range
+equality_ops = ('=', '==', 'IN', 'IS')
+
+#rows read to estimate the selectivity of the columns of an index
+sample_rows = 100000
+
+def print_help():
+    """Print help text."""
+    help_text = \
+    """Propose indexes for the queries of one or several query files on an \
+SQLite database, ranked by estimated benefit, and optionally create them.
+
+    python index_advisor.py -d[database] -q[query file] -c -n[top] \
+-r[repeat] -h
+
+    Please provide options for database and query files.
+
+    -d, --database
+    Full path to the database, including the file name.
+
+    -q, --query
+    Full path to a query file, as read by query_db.py, or a glob pattern of \
+query files. Can be given several times.
+
+    -n, --top
+    Number of indexes proposed, 10 by default.
+
+    -c, --create
+    Create the proposed indexes, run ANALYZE and report the time of each \
+query before and after.
+
+    -r, --repeat
+    Number of runs of each query when timing it, the best is reported. 3 by \
+default.
+
+    -h, --help
+    Print help.
+    """
+
+    print(help_text)
+    return None
+
+def get_args():
+    """Function which gets options to the script passed in the command line."""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],
+                                   'd:q:n:cr:h',
+                                   ['database=', 'query=', 'top=', 'create',
+                                    'repeat=', 'help'])
+
+    except getopt.GetoptError as err:
+        print(err)
+        sys.exit(2)
+
+    if len(args) > 0:
+        print("""This function does not take arguments. Please make sure you
+              did not forget to include an option name.""")
+        sys.exit()
+
+    database = None
+    query_files = []
+    top = 10
+    create = False
+    repeat = 3
+
+    for opt, arg in opts:
+        if opt in ('-d', '--database'):
+            database = arg
+        elif opt in ('-q', '--query'):
+            query_files += sorted(glob.glob(arg)) or [arg]
+        elif opt in ('-n', '--top'):
+            top = int(arg)
+        elif opt in ('-c', '--create'):
+            create = True
+        elif opt in ('-r', '--repeat'):
+            repeat = int(arg)
+        elif opt in ('-h', '--help'):
+            print_help()
+            sys.exit()
+
+    if database == None or query_files == []:
+        print('Please provide a database and query files.')
+        sys.exit()
+
+    return database, query_files, top, create, repeat
+
+def clean_sql(exec_str):
+    """Remove comments and the content of string literals from a query, and
+    collapse its white space."""
+
+    exec_str = re.sub(r'--[^\n]*|/\*.*?\*/', ' ', exec_str, flags=re.S)
+    exec_str = re.sub(r"'(?:[^']|'')*'", "''", exec_str)
+
+    return ' '.join(exec_str.split())
+
+def clause(exec_str, start, ends):
+    """Return the texts of the clauses beginning with the start keyword and
+    ending before one of the end keywords."""
+
+    pattern = r'\b{0}\b(.*?)(?=\b(?:{1})\b|$)'.format(start, '|'.join(ends))
+
+    return re.findall(pattern, exec_str, flags=re.I)
+
+def query_tables(exec_str, columns):
+    """Return a dictionary of the tables of a query by name and alias, for the
+    tables of the database, whose columns are given by table."""
+
+    tables = {}
+    from_ends = ['WHERE', 'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'UNION',
+                 'EXCEPT', 'INTERSECT', 'WINDOW']
+    for text in clause(exec_str, 'FROM', from_ends):
+        for item in re.split(r'\bJOIN\b|,', text, flags=re.I):
+            words = re.findall(r'[\w"]+', item.split('(')[0])
+            words = [i.strip('"') for i in words]
+            words = [i for i in words if i.upper() not in
+                     ('LEFT', 'RIGHT', 'FULL', 'INNER', 'OUTER', 'CROSS',
+                      'NATURAL', 'AS')]
+            if not words or words[0] not in columns:
+                continue
+            tables[words[0]] = words[0]
+            if len(words) > 1 and words[1].upper() not in clause_words:
+                tables[words[1]] = words[0]
+
+    return tables
+
+def column_table(qualifier, column, tables, columns):
+    """Return the table of a column of a query, or None if it is unknown or
+    ambiguous."""
+
+    if qualifier != None:
+        table = tables.get(qualifier)
+        if table != None and column in columns[table]:
+            return table
+        return None
+
+    matches = set([i for i in tables.values() if column in columns[i]])
+    if len(matches) == 1:
+        return matches.pop()
+
+    return None
+
+def predicate_columns(exec_str, tables, columns):
+    """Return the (table, column, kind) of the columns of a query compared in
+    its WHERE and ON clauses, kind being 'eq' or 'range'."""
+
+    texts = clause(exec_str, 'WHERE', ['GROUP', 'ORDER', 'LIMIT', 'HAVING',
+                                       'UNION', 'EXCEPT', 'INTERSECT',
+                                       'WINDOW'])
+    texts += clause(exec_str, 'ON', ['JOIN', 'LEFT', 'RIGHT', 'FULL', 'INNER',
+                                     'CROSS', 'NATURAL', 'WHERE', 'GROUP',
+                                     'ORDER', 'LIMIT'])
+
+    ops = r'==|<=|>=|=|<|>|\bIN\b|\bIS\b|\bBETWEEN\b|\bLIKE\b|\bGLOB\b'
+    name = r'(?:(\w+)\.)?(\w+)'
+    found = []
+    for text in texts:
+        #column before the operator, then after it (the other side of a join)
+        pairs = [(q, c, op) for q, c, op in
+                 re.findall(name + r'\s*(' + ops + ')', text, flags=re.I)]
+        pairs += [(q, c, op) for op, q, c in
+                  re.findall('(' + ops + r')\s*' + name, text, flags=re.I)]
+        for qualifier, column, op in pairs:
+            table = column_table(qualifier or None, column, tables, columns)
+            if table == None:
+                continue
+            kind = 'eq' if op.upper() in equality_ops else 'range'
+            if (table, column, kind) not in found:
+                found.append((table, column, kind))
+
+    return found
+
+def order_columns(exec_str, tables, columns):
+    """Return the (table, column) of the ORDER BY clause of a query."""
+
+    found = []
+    for text in clause(exec_str, r'ORDER\s+BY', ['LIMIT']):
+        for item in text.split(','):
+            match = re.match(r'\s*(?:(\w+)\.)?(\w+)', item)
+            if match == None:
+                continue
+            table = column_table(match.group(1), match.group(2), tables,
+                                 columns)
+            if table != None:
+                found.append((table, match.group(2)))
+
+    return found
+
+def scanned_tables(plan, tables):
+    """Return the tables of a query plan read by a full scan or searched with
+    an automatic index, which an index would avoid."""
+
+    names = full_scans(plan)
+    for line in plan:
+        match = re.match(r'\s*SEARCH (\w+) USING AUTOMATIC', line)
+        if match:
+            names.append(match.group(1))
+
+    return set([tables[i] for i in names if i in tables])
+
+def candidate_indexes(exec_str, plan, columns):
+    """Return the candidate indexes of a query as a list of (table, columns):
+    the columns compared for equality, then one column compared by range or
+    else the ORDER BY columns, for the tables its plan scans or sorts."""
+
+    exec_str = clean_sql(exec_str)
+    tables = query_tables(exec_str, columns)
+    predicates = predicate_columns(exec_str, tables, columns)
+    order = order_columns(exec_str, tables, columns)
+    scanned = scanned_tables(plan, tables)
+    sorts = any(['TEMP B-TREE FOR ORDER BY' in i for i in plan])
+
+    candidates = []
+    for table in sorted(set(tables.values())):
+        eq = [c for t, c, kind in predicates if t == table and kind == 'eq']
+        ranges = [c for t, c, kind in predicates
+                  if t == table and kind == 'range' and c not in eq]
+        index = list(eq)
+        if ranges and table in scanned:
+            index.append(ranges[0])
+        elif sorts and order and all([t == table for t, c in order]):
+            index += [c for t, c in order if c not in index]
+        elif table not in scanned:
+            continue
+        if index:
+            candidates.append((table, tuple(index)))
+
+    return candidates
+
+def table_columns(conn):
+    """Return a dictionary of the columns of each table of the database."""
+
+    columns = {}
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                        "AND name NOT LIKE 'sqlite_%'").fetchall()
+    for (table,) in rows:
+        info = conn.execute('PRAGMA table_info("{}")'.format(table))
+        columns[table] = [i[1] for i in info.fetchall()]
+
+    return columns
+
+def existing_indexes(conn, table):
+    """Return the columns of the indexes of a table."""
+
+    indexes = []
+    for row in conn.execute('PRAGMA index_list("{}")'.format(table)).fetchall():
+        info = conn.execute('PRAGMA index_info("{}")'.format(row[1]))
+        indexes.append(tuple([i[2] for i in info.fetchall()]))
+
+    return indexes
+
+def rows_saved(conn, table, index):
+    """Estimate the rows of a table a query does not read with an index: all
+    but the rows sharing a value of the index columns, estimated on a sample
+    of the table."""
+
+    rows = conn.execute('SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0]
+    cols = ', '.join(['"{}"'.format(i) for i in index])
+    distinct = conn.execute(
+        'SELECT COUNT(*) FROM (SELECT DISTINCT {0} FROM (SELECT {0} FROM "{1}" '
+        'LIMIT {2}))'.format(cols, table, sample_rows)).fetchone()[0]
+
+    return rows - rows / max(distinct, 1)
+
+def advise(database, statements):
+    """Return the indexes proposed for a list of statements, ranked by
+    estimated benefit: the rows not read by the queries which would use them.
+    Each is a dictionary of its table, columns, benefit, numbers of the
+    statements using it and the string which creates it."""
+
+    conn = sqlite3.connect(database)
+    cur = conn.cursor()
+    columns = table_columns(conn)
+
+    proposals = {}
+    saved = {}
+    for number, statement in enumerate(statements):
+        if not is_query(statement):
+            continue
+        plan = query_plan(cur, statement)
+        for table, index in candidate_indexes(statement, plan, columns):
+            #an index starting with the same columns already exists
+            if any([i[:len(index)] == index
+                    for i in existing_indexes(conn, table)]):
+                continue
+            if (table, index) not in proposals:
+                proposals[(table, index)] = {
+                    'table': table, 'columns': list(index), 'benefit': 0,
+                    'statements': [],
+                    'exec_str': create_index_strs(table, [index])[0]}
+                saved[(table, index)] = rows_saved(conn, table, index)
+            proposals[(table, index)]['benefit'] += saved[(table, index)]
+            proposals[(table, index)]['statements'].append(number)
+
+    cur.close()
+    conn.close()
+
+    #an index also serves the queries of the indexes its columns start with
+    merged = []
+    proposals = sorted(proposals.values(), key=lambda i: -len(i['columns']))
+    for proposal in proposals:
+        for longer in merged:
+            if longer['table'] == proposal['table'] and \
+                    longer['columns'][:len(proposal['columns'])] == \
+                    proposal['columns']:
+                longer['benefit'] += proposal['benefit']
+                longer['statements'] = sorted(longer['statements'] +
+                                              proposal['statements'])
+                break
+        else:
+            merged.append(proposal)
+
+    return sorted(merged, key=lambda i: i['benefit'], reverse=True)
+
+def time_queries(database, statements, repeat=3):
+    """Return the best time in milliseconds of executing each query and
+    fetching its rows, None for the statements which are not queries."""
+
+    conn = sqlite3.connect(database)
+    timings = []
+    for statement in statements:
+        if not is_query(statement):
+            timings.append(None)
+            continue
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(statement).fetchall()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best == None else min(best, elapsed)
+        timings.append(best)
+    conn.close()
+
+    return timings
+
+def create_indexes(database, proposals):
+    """Create the proposed indexes and update the statistics of the query
+    planner."""
+
+    conn = sqlite3.connect(database)
+    for proposal in proposals:
+        conn.execute(proposal['exec_str'])
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+
+    return None
+
+if __name__ == '__main__':
+    database, query_files, top, create, repeat = get_args()
+
+    statements = []
+    for query_file in query_files:
+        statements += read_query_statements(query_file)
+
+    proposals = advise(database, statements)[:top]
+    if proposals == []:
+        print('No index to propose.')
+        sys.exit()
+
+    for proposal in proposals:
+        print('{0};  -- benefit {1:.0f} rows, statements {2}'.format(
+            proposal['exec_str'], proposal['benefit'],
+            ', '.join([str(i + 1) for i in proposal['statements']])))
+
+    if create:
+        before = time_queries(database, statements, repeat)
+        create_indexes(database, proposals)
+        after = time_queries(database, statements, repeat)
+        print('\nstatement   before (ms)   after (ms)')
+        for number, (old, new) in enumerate(zip(before, after)):
+            if old != None:
+                print('{0:>9} {1:>13.2f} {2:>12.2f}'.format(number + 1, old,
+                                                            new))
@@ -0,0 +1,145 @@
+#script which caches query results on disk, keyed by the query and the
+#version of the database file, with least recently used entries evicted first
+
+#import modules
+import os
+import hashlib
+import gzip
+import pickle
+
+def default_cache_dir():
+    """Return the default directory of the cache."""
+
+    return os.path.join(os.path.expanduser('~'), '.cache', 'sqlitetools')
+
+def normalize_sql(exec_str):
+    """Normalize the white space and final semi-colon of a query."""
+
+    return ' '.join(exec_str.split()).rstrip(';').strip()
+
+def short_hash(value):
+    """Return a short hexadecimal hash of a string."""
+
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:24]
+
+def db_identity(database):
+    """Return a hash identifying the database file."""
+
+    path = os.path.realpath(database)
+    stat = os.stat(path)
+
+    return short_hash('{0}:{1}:{2}'.format(path, stat.st_dev, stat.st_ino))
+
+def db_version(database):
+    """Return a hash of the size and modification time of the database file
+    and of its write-ahead log, which change with every write."""
+
+    version = []
+    for path in (database, database + '-wal'):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            version.append('{0}:{1}'.format(stat.st_size, stat.st_mtime_ns))
+
+    return short_hash('/'.join(version))
+
+def entry_path(cache_dir, database, exec_str):
+    """Return the path of the cache entry of a query on a database in its
+    current version."""
+
+    name = '{0}_{1}_{2}.gz'.format(db_identity(database),
+                                   short_hash(normalize_sql(exec_str)),
+                                   db_version(database))
+
+    return os.path.join(cache_dir, name)
+
+def cache_get(cache_dir, database, exec_str):
+    """Return the column names and a generator of the batches of rows of a
+    cached query, or None if the query is not cached for the current version
+    of the database."""
+
+    path = entry_path(cache_dir, database, exec_str)
+    try:
+        file = gzip.open(path, 'rb')
+        title = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    #entries are evicted by order of last use
+    os.utime(path)
+
+    return title, read_batches(file)
+
+def read_batches(file):
+    """Generate the batches of rows of an open cache entry, then close it."""
+
+    with file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                break
+
+def cache_put(cache_dir, database, path, title, batches, max_bytes):
+    """Generate the batches of rows of a query while writing them to the cache
+    entry at path, given by entry_path before the query is executed so that
+    the entry never has a version older than its rows. The entry is kept only
+    if all the batches were read and it fits in max_bytes, then entries of
+    older versions of the database are removed and the least recently used
+    entries are evicted down to max_bytes."""
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+
+    complete = False
+    try:
+        with gzip.open(tmp_path, 'wb', compresslevel=1) as file:
+            pickle.dump(title, file)
+            for rows in batches:
+                pickle.dump(rows, file)
+                yield rows
+        complete = True
+    finally:
+        if complete and os.path.getsize(tmp_path) <= max_bytes:
+            os.replace(tmp_path, path)
+            remove_stale(cache_dir, database, path)
+            evict(cache_dir, max_bytes)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def remove_stale(cache_dir, database, path):
+    """Remove the entries of a database which were made with another version
+    of the database than the entry at path."""
+
+    identity = db_identity(database)
+    version = os.path.basename(path).split('_')[-1]
+    for name in os.listdir(cache_dir):
+        if name.startswith(identity + '_') and name.endswith('.gz') and \
+                name.split('_')[-1] != version:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    return None
+
+def evict(cache_dir, max_bytes):
+    """Remove the least recently used entries until the total size of the
+    cache is at most max_bytes."""
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.gz'):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum([i[1] for i in entries])
+    for mtime, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    return None
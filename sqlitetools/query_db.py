@@ -6,6 +6,37 @@ import sys
 import getopt
 import sqlite3
 import re
+import itertools
+import csv
+import json
+import tempfile
+import pickle
+import os
+import threading
+import concurrent.futures
+import time
+
+from query_cache import default_cache_dir, cache_get, cache_put, entry_path
+from query_profile import query_plan, full_scans, new_profile, count_steps, \
+    timed_batches, format_profile, log_slow_query
+from query_pages import iter_pages, range_tokens
+from column_stats import stats_query, stats_report
+from text_search import search
+
+#settings of the connection by read profile: the URI parameters opening the
+#database file, then pragmas. Memory mapping is capped by SQLite at its
+#compile-time maximum, so the files are mapped whole up to that limit
+read_profiles = {
+    'default': {},
+    'readonly': {'mode': 'ro', 'mmap_size': 2 ** 40, 'cache_size': -262144,
+                 'temp_store': 'MEMORY', 'query_only': 'ON'},
+    'immutable': {'mode': 'ro', 'immutable': 1, 'mmap_size': 2 ** 40,
+                  'cache_size': -262144, 'temp_store': 'MEMORY',
+                  'query_only': 'ON'},
+}
+
+#settings of the read profiles given as URI parameters
+uri_params = ('mode', 'immutable')
 
 def print_help():
     """Print help text."""
@@ -13,16 +44,143 @@ def print_help():
     """Query an SQLite database with query from a string or text file and \
 return the query as a text file.
     
-    python query_db.py -d[database] -q[query] -h
+    python query_db.py -d[database] -q[query] -o[output] -f[format] -s \
+-w[widths] -c -j[jobs] -p -r[read profile] -h
+    python query_db.py -d[database] -t[table] -k[key] -o[output] -f[format] \
+--segment-rows[rows] --resume --part[part] -h
+    python query_db.py -d[database] -t[table] --stats -o[output] -f[format] -h
+    python query_db.py -d[database] -t[table] --search[term] --limit[rows] \
+-o[output] -f[format] -h
     
-    Please provide options for database and query.
+    Please provide options for database and query, or database and table.
     
     -d, --database
-    Full path to the database, including the file name.
+    Full path to the database, including the file name, or to the manifest \
+(.json) of a table sharded by file2db.py. The query of a sharded table runs \
+on its shards concurrently (in jobs threads), skipping the shards which the \
+conditions of the WHERE clause on the shard key exclude, and the results are \
+merged: the aggregates COUNT, SUM, TOTAL, MIN, MAX and AVG, GROUP BY and \
+DISTINCT, then ORDER BY on selected columns and LIMIT. Queries whose \
+results cannot be merged exactly are refused: aggregates of DISTINCT values, \
+GROUP_CONCAT, window functions and HAVING.
     
     -q, --query
     Query string or full path to the text file containing the query, including \
-the file name.
+the file name. A query file can hold several statements separated by \
+semi-colons, the results of each statement are saved in their own file, \
+numbered after the output file.
+
+    -t, --table
+    Export the rows of a table page by page, each page read after the key of \
+the last row of the previous one. The export is saved in segments, numbered \
+after the output file, and the position after each segment is recorded in a \
+checkpoint file named after the output file followed by '.checkpoint'.
+
+    -k, --key
+    Comma-separated columns ordering the pages of a table, unique and not \
+null. The rowid by default.
+
+    --where
+    Condition filtering the rows of the table.
+
+    --page-size
+    Number of rows of each page of the table, 10000 by default.
+
+    --segment-rows
+    Number of rows of each segment of the export, rounded up to whole pages. \
+All the rows are saved in one segment by default.
+
+    --resume
+    Continue an export after the last segment recorded in its checkpoint file.
+
+    --part
+    Export only one part of the table, given as I/N: the I-th of N key ranges \
+with about the same number of rows, so that N processes can share an export.
+
+    --stats
+    Answer the queries selecting only COUNT(*), COUNT(column), \
+COUNT(DISTINCT column), MIN(column) and MAX(column) of a whole table from \
+the statistics recorded by file2db.py --stats, without reading the table. \
+COUNT(DISTINCT column) is an estimate (about 1.6 % error). Other queries, \
+and the tables whose statistics are inexact after upserts, run as usual. With \
+a table, save the statistics of all its columns.
+
+    --search
+    Save the rows of the table whose columns indexed by file2db.py --search \
+contain a term of at least 3 characters, most relevant first. The term is \
+matched as a substring, case-insensitively, using the full-text index \
+instead of scanning the table.
+
+    --limit
+    Maximum number of rows of a search.
+
+    -o, --output
+    Full path to the output file. If not provided, the results are saved in \
+the file 'results_' followed by the name of the query file, or of the table \
+with the .txt extension.
+
+    -f, --format
+    Format of the results: 'table' (default) with right-aligned columns, \
+'csv', 'tsv' or 'jsonl' (JSON Lines). Empty values are written as 'NULL' in \
+a table, empty fields in CSV and TSV and null in JSON Lines.
+
+    -s, --stream
+    Fetch and write the results of a table in batches, so memory use does not \
+grow with the number of rows. The other formats are always streamed.
+
+    -w, --widths
+    How column widths are computed when streaming: 'sample' (default) from \
+the first rows, wider values are not aligned, or 'spill' from all the rows, \
+which are written to a temporary file before being formatted.
+
+    -c, --cache
+    Cache the results on disk, keyed by the query and the version of the \
+database file. Results of a cached query are read without opening the \
+database, until the database changes.
+
+    --cache-dir
+    Directory of the cache (implies --cache). Defaults to \
+~/.cache/sqlitetools.
+
+    --cache-size
+    Maximum size of the cache in megabytes, 256 by default. Least recently \
+used results are removed first.
+    
+    -j, --jobs
+    Number of threads running the statements of a query file when they are \
+all queries (SELECT, WITH, VALUES or EXPLAIN), each with its own read-only \
+connection. 4 by default. Files with other statements run in order in one \
+connection.
+    
+    -r, --read-profile
+    Settings of the connection: 'default' (plain connection), 'readonly' \
+(read-only mode, the whole file memory-mapped, a 256 MB page cache, \
+temporary tables in memory and only queries allowed) or 'immutable' (same as \
+'readonly', and the file is not locked nor checked for changes, only for \
+databases which do not change while they are queried).
+
+    --mmap-size
+    Size of the memory mapping of the database file in megabytes, overriding \
+the read profile. 0 reads the file with system calls.
+
+    --page-cache
+    Size of the page cache in megabytes, overriding the read profile.
+
+    --query-only
+    Refuse statements which change the database.
+
+    -p, --profile
+    Print the profile of each query: its query plan, the tables it reads \
+with a full scan, the rows returned, the virtual machine steps and the time \
+spent executing the query, fetching the rows and formatting them.
+
+    --slow-log
+    Full path to a JSON Lines file where the profile of slow queries is \
+appended.
+
+    --slow-ms
+    Time in milliseconds above which a query is logged as slow, 1000 by \
+default.
     
     -h, --help
     Print help.
@@ -37,8 +195,15 @@ def get_args():
     
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                                   'd:q:h',
-                                   ['database=', 'query=', 'help'])
+                                   'd:q:t:k:o:f:sw:cj:pr:h',
+                                   ['database=', 'query=', 'output=', 'format=',
+                                    'stream', 'widths=', 'cache', 'cache-dir=',
+                                    'cache-size=', 'jobs=', 'profile',
+                                    'slow-log=', 'slow-ms=', 'read-profile=',
+                                    'mmap-size=', 'page-cache=', 'query-only',
+                                    'table=', 'key=', 'where=', 'page-size=',
+                                    'segment-rows=', 'resume', 'part=',
+                                    'stats', 'search=', 'limit=', 'help'])
         
     except getopt.GetoptError as err:
         print(err)
@@ -52,21 +217,124 @@ def get_args():
     database = None
     table = None
     query = None
+    output_file = None
+    stream = False
+    widths = 'sample'
+    output_format = 'table'
+    cache_dir = None
+    cache_size = 256
+    jobs = 4
+    profile = False
+    slow_log = None
+    slow_ms = 1000
+    read_profile = 'default'
+    pragmas = {}
+    page_options = {}
+    from_stats = False
+    search_options = {}
         
     for opt, arg in opts:
         if opt in ('-d', '--database'):
             database = arg
         elif opt in ('-q', '--query'):
             query = arg
+        elif opt in ('-t', '--table'):
+            table = arg
+        elif opt in ('-k', '--key'):
+            page_options['key'] = arg.split(',')
+        elif opt == '--where':
+            page_options['where'] = arg
+        elif opt == '--page-size':
+            page_options['page_size'] = int(arg)
+        elif opt == '--segment-rows':
+            page_options['segment_rows'] = int(arg)
+        elif opt == '--resume':
+            page_options['resume'] = True
+        elif opt == '--part':
+            page_options['part'] = tuple([int(i) for i in arg.split('/')])
+        elif opt in ('-o', '--output'):
+            output_file = arg
+        elif opt in ('-f', '--format'):
+            output_format = arg
+        elif opt in ('-c', '--cache'):
+            cache_dir = cache_dir or default_cache_dir()
+        elif opt == '--cache-dir':
+            cache_dir = arg
+        elif opt == '--cache-size':
+            cache_size = int(arg)
+        elif opt in ('-j', '--jobs'):
+            jobs = int(arg)
+        elif opt in ('-p', '--profile'):
+            profile = True
+        elif opt == '--slow-log':
+            slow_log = arg
+        elif opt == '--slow-ms':
+            slow_ms = float(arg)
+        elif opt in ('-r', '--read-profile'):
+            read_profile = arg
+        elif opt == '--mmap-size':
+            pragmas['mmap_size'] = int(arg) * 1024 * 1024
+        elif opt == '--page-cache':
+            pragmas['cache_size'] = -int(arg) * 1024
+        elif opt == '--query-only':
+            pragmas['query_only'] = 'ON'
+        elif opt == '--stats':
+            from_stats = True
+        elif opt == '--search':
+            search_options['term'] = arg
+        elif opt == '--limit':
+            search_options['limit'] = int(arg)
+        elif opt in ('-s', '--stream'):
+            stream = True
+        elif opt in ('-w', '--widths'):
+            widths = arg
         elif opt in ('-h', '--help'):
             print_help()
             sys.exit()
             
-    if database == None or query == None:
-        print('Please provide a database and a query.')
+    if database == None or (query == None and table == None):
+        print('Please provide a database and a query or a table.')
+        sys.exit()
+
+    if 'term' in search_options and table == None:
+        print('Please provide the table to search.')
+        sys.exit()
+
+    if widths not in ('sample', 'spill'):
+        print("Please choose the widths 'sample' or 'spill'.")
+        sys.exit()
+
+    if read_profile not in read_profiles:
+        print('Please choose a read profile among: {}.'\
+              .format(', '.join(read_profiles)))
+        sys.exit()
+
+    if output_format not in writers:
+        print('Please choose a format among: {}.'.format(', '.join(writers)))
         sys.exit()
+
+    #add results to the query file name to give the output file name
+    if output_file == None and query == None:
+        output_file = 'results_' + table + '.txt'
+    elif output_file == None:
+        if sys.platform == 'win32':
+            output_file = 'results_' + query.split('\\')[-1]
+        else:
+            output_file = 'results_' + query.split('/')[-1]
             
-    return database, table, query
+    #keyword arguments of execute_query
+    options = dict(output_file=output_file, stream=stream, widths=widths,
+                   output_format=output_format, cache_dir=cache_dir,
+                   cache_size=cache_size * 1024 * 1024, profile=profile,
+                   slow_log=slow_log, slow_ms=slow_ms,
+                   read_profile=read_profile, pragmas=pragmas,
+                   from_stats=from_stats)
+
+    #a search is an export of the matching rows of the table
+    if 'term' in search_options:
+        page_options = search_options
+            
+    return database, table, query, options, jobs, page_options
 
 def read_query_str(query):
     """Removes unsafe characters from the query string."""
@@ -83,116 +351,566 @@ def read_query_file(query):
     exec_str = ''
     
     #read the query file and add each line to the executable string
-    try:
-        with open(query, 'r') as file:
-            while 1:
-                line = file.readline()
-                if line == '':
-                    break
-                else:
-                    #add a space to separate command from each line
-                    #remove semi-colon for safety and remove line-break
-                    exec_str += ' ' + line.replace(';', '').strip('\n')
-                    
-    except FileNotFoundError as err:
-        print(err)
-        sys.exit()
+    with open(query, 'r') as file:
+        while 1:
+            line = file.readline()
+            if line == '':
+                break
+            else:
+                #add a space to separate command from each line
+                #remove semi-colon for safety and remove line-break
+                exec_str += ' ' + line.replace(';', '').strip('\n')
     
     #remove the starting space
     exec_str = exec_str.strip()
     
     return exec_str
 
-def execute_query(database, exec_str):
-    """Execute a query with the SQLite cursor and saves the results in a text
-    file in the form of a table."""
-    
-    # connect to the database
-    conn = sqlite3.connect(database)
-    cur = conn.cursor()
-    
-    # execute query string and get rows from cursor
-    cur.execute(exec_str)
-    rows = [line for line in cur]
+def split_statements(text):
+    """Split SQL text in complete statements, on the semi-colons which end a
+    statement (not those inside strings or comments)."""
+
+    statements = []
+    start = 0
+    pos = text.find(';')
+    while pos != -1:
+        if sqlite3.complete_statement(text[start:pos + 1]):
+            statement = text[start:pos + 1].strip()
+            if statement != ';':
+                statements.append(statement)
+            start = pos + 1
+        pos = text.find(';', pos + 1)
+
+    #the last statement does not need a semi-colon
+    if text[start:].strip():
+        statements.append(text[start:].strip())
+
+    return statements
+
+def read_query_statements(query):
+    """Read the content of the query file and return the list of statements to
+    be executed by the SQLite cursor."""
+
+    with open(query, 'r') as file:
+        text = file.read()
 
-    # get title of table from executable string
-    exec_str = exec_str.lower()
-    sub_str = re.search('select(.+)from', exec_str)
+    return split_statements(text)
 
-    # if we queried everything, we extract field names from table info
-    if sub_str.group(1).strip() == '*':
-        tb_name = re.search('from\s([\w]+)', exec_str).group(1)
-        info = cur.execute('PRAGMA table_info ({})'.format(tb_name))
-        title = [row[1] for row in info]
+def is_query(statement):
+    """Tell if a statement only reads the database."""
 
-    # if the query contains individual field names, we get them    
+    words = statement.lstrip('(').split(None, 1)
+
+    return bool(words) and words[0].upper() in ('SELECT', 'WITH', 'VALUES',
+                                                  'EXPLAIN')
+
+def numbered_file(output_file, number):
+    """Return the name of an output file numbered before its extension."""
+
+    root, ext = os.path.splitext(output_file)
+
+    return '{0}_{1}{2}'.format(root, number, ext)
+
+def connect_database(database, read_profile='default', pragmas=None,
+                     read_only=False):
+    """Open a connection to a database file with the settings of a read
+    profile, updated with a dictionary of pragmas. If read_only is True, the
+    file is opened in read-only mode and the connection can be closed by
+    another thread than the one which uses it."""
+
+    settings = dict(read_profiles[read_profile])
+    settings.update(pragmas or {})
+    if read_only:
+        settings.setdefault('mode', 'ro')
+
+    params = [(i, settings.pop(i)) for i in uri_params if i in settings]
+    if params:
+        uri = 'file:{0}?{1}'.format(os.path.abspath(database),
+                                    '&'.join(['{0}={1}'.format(*i)
+                                              for i in params]))
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=not read_only)
     else:
-        title = sub_str.group(1).strip().split(', ')
-    
-    
-    # change empty values to 'NULL' 
-    # (empty values give None, which is not a valid string)
-    # initialize empty list to be filled with values from rows
-    rows2 = [0] * len(rows)
-    # loop through rows tuples
-    for i in range(len(rows)):
-        # if None is in the tuple, copy element one by one
-        # and replace None by 'NULL'
-        if None in rows[i]:
-            elements = [0] * len(rows[i])
-            for j in range(len(rows[i])):
-                if rows[i][j] == None:
-                    elements[j] = 'NULL'
-                else:
-                    elements[j] = rows[i][j]
-            rows2[i] = elements
-        else:
-            rows2[i] = rows[i]
+        conn = sqlite3.connect(database, check_same_thread=not read_only)
 
-    #get maximum width of query columns to format output string accordingly
-    widths = [len(i) for i in title]
-    for row in rows2:
+    for name, value in settings.items():
+        conn.execute('PRAGMA {0} = {1}'.format(name, value))
+
+    return conn
+
+def read_only_settings(read_profile='default', pragmas=None):
+    """Tell if a read profile updated with a dictionary of pragmas forbids
+    writes (mode=ro or query_only)."""
+
+    settings = dict(read_profiles[read_profile])
+    settings.update(pragmas or {})
+
+    return settings.get('mode') == 'ro' or \
+           str(settings.get('query_only', '')).upper() in ('ON', '1', 'TRUE',
+                                                            'YES')
+
+def connect_read_only(database, read_profile='default', pragmas=None):
+    """Open a read-only connection to a database file. It can be closed by
+    another thread than the one which uses it."""
+
+    return connect_database(database, read_profile, pragmas, read_only=True)
+
+def execute_queries(database, statements, output_file='query_results.txt',
+                    jobs=4, **options):
+    """Execute several statements and save the results of each in its own
+    numbered output file. When all the statements are queries they run
+    concurrently in jobs threads, each with a read-only connection reused by
+    its statements. Otherwise they run in order in one connection. Return the
+    list of (title, first row) of each statement."""
+
+    output_files = [numbered_file(output_file, i + 1)
+                    for i in range(len(statements))]
+
+    read_profile = options.get('read_profile', 'default')
+    pragmas = options.get('pragmas')
+
+    if not all([is_query(i) for i in statements]):
+        conn = connect_database(database, read_profile, pragmas)
+        results = [execute_query(database, statement, output, conn=conn,
+                                 **options)
+                   for statement, output in zip(statements, output_files)]
+        conn.commit()
+        conn.close()
+        return results
+
+    #one read-only connection for each thread of the pool
+    local = threading.local()
+    conns = []
+    lock = threading.Lock()
+
+    def run(statement, output):
+        if not hasattr(local, 'conn'):
+            local.conn = connect_read_only(database, read_profile, pragmas)
+            with lock:
+                conns.append(local.conn)
+        return execute_query(database, statement, output, conn=local.conn,
+                             **options)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            futures = [pool.submit(run, statement, output)
+                       for statement, output in zip(statements, output_files)]
+            results = [future.result() for future in futures]
+    finally:
+        for conn in conns:
+            conn.close()
+
+    return results
+
+def null_row(row):
+    """Change empty values of a row to 'NULL' (empty values give None, which
+    is not a valid string)."""
+
+    if None in row:
+        return ['NULL' if value == None else value for value in row]
+
+    return row
+
+def fetch_batches(cur, fetch_size):
+    """Generate batches of rows fetched from the cursor."""
+
+    while True:
+        rows = cur.fetchmany(fetch_size)
+        if not rows:
+            break
+        yield rows
+
+def update_widths(widths, rows):
+    """Update the maximum width of the columns with a list of rows."""
+
+    for row in rows:
         for idx, col in enumerate(row):
             widths[idx] = max(widths[idx], len(str(col)))
+
+    return widths
+
+def spill_batches(batches, widths):
+    """Write batches of rows to a temporary file while updating the widths of
+    the columns, and generate them back from the file once all are written."""
+
+    with tempfile.TemporaryFile() as spill:
+        for rows in batches:
+            update_widths(widths, rows)
+            pickle.dump(rows, spill)
+
+        spill.seek(0)
+        while True:
+            try:
+                yield pickle.load(spill)
+            except EOFError:
+                break
+
+def write_table(file, title, batches, widths='sample', sample_rows=1000):
+    """Write rows as a table of right-aligned columns. Column widths are
+    computed from the first sample_rows rows ('sample') or from all rows
+    spilled to a temporary file ('spill'). Return the title and first row
+    strings."""
+
+    batches = ([null_row(row) for row in rows] for rows in batches)
+
+    #get maximum width of query columns to format output string accordingly
+    col_widths = [len(i) for i in title]
+    if widths == 'spill':
+        batches = spill_batches(batches, col_widths)
+        #widths are known once the first batch comes back from the file
+        first = next(batches, [])
+        batches = itertools.chain([first], batches)
+    else:
+        #the sample is kept in memory and written first
+        sample = []
+        for rows in batches:
+            sample += rows
+            if len(sample) >= sample_rows:
+                break
+        update_widths(col_widths, sample)
+        batches = itertools.chain([sample], batches)
     
     #make a string formatted with title names
     str_list = []
-    for w in widths:
+    for w in col_widths:
         str_list.append('{:>' + str(w + 3) + '}')
     title_str = ''.join(str_list).format(*title)
     
     #make an empty string to be formatted with rows from query
-    row_str = ''.join(str_list)
-        
+    row_str = ''.join(str_list) + '\n'
+
+    file.write(title_str + '\n')
+    file.write('-' * (sum(col_widths) + 3 * len(col_widths)) + '\n')
+    first_row = None
+    for rows in batches:
+        if rows and first_row == None:
+            first_row = row_str.format(*rows[0]).strip('\n')
+        file.write(''.join([row_str.format(*row) for row in rows]))
+
+    return title_str, first_row
+
+def write_delimited(file, title, batches, delimiter):
+    """Write rows as delimited text with a header, empty values as empty
+    fields. Return the header and first row strings."""
+
+    writer = csv.writer(file, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(title)
+    first_row = None
+    for rows in batches:
+        if rows and first_row == None:
+            first_row = delimiter.join(['' if i == None else str(i)
+                                        for i in rows[0]])
+        writer.writerows(rows)
+
+    return delimiter.join(title), first_row
+
+def write_csv(file, title, batches):
+    """Write rows as comma-separated values."""
+
+    return write_delimited(file, title, batches, ',')
+
+def write_tsv(file, title, batches):
+    """Write rows as tab-separated values."""
+
+    return write_delimited(file, title, batches, '\t')
+
+def write_jsonl(file, title, batches):
+    """Write rows as JSON Lines, one object by row with the column names as
+    keys. Return None (no header) and the first row string."""
+
+    first_row = None
+    for rows in batches:
+        lines = [json.dumps(dict(zip(title, row)), default=str) for row in rows]
+        if lines and first_row == None:
+            first_row = lines[0]
+        file.write('\n'.join(lines + ['']))
+
+    return None, first_row
+
+#result writers by output format
+writers = {'table': write_table, 'csv': write_csv, 'tsv': write_tsv,
+           'jsonl': write_jsonl}
+
+def page_batches(pages, position):
+    """Generate the rows of (rows, token) pages, recording the token of the
+    last page generated in the position dictionary."""
+
+    for rows, token in pages:
+        yield rows
+        position['token'] = token
+
+def save_checkpoint(checkpoint, position):
+    """Save the position of an export in its checkpoint file, replaced at once
+    so that it is never left half written."""
+
+    with open(checkpoint + '.tmp', 'w') as file:
+        json.dump(position, file)
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+    return None
+
+def export_pages(database, table, output_file='query_results.txt', key=None,
+                 where=None, page_size=10000, segment_rows=None, resume=False,
+                 part=None, output_format='table', read_profile='default',
+                 pragmas=None):
+    """Export the rows of a table read by keyset pagination on a list of key
+    columns (the rowid by default) in segments of segment_rows rows, rounded
+    up to whole pages, each saved in its own numbered output file. The token
+    after each segment is saved in a checkpoint file named after the output
+    file, from which the export continues if resume is True. part is a tuple
+    (number, parts) exporting only the number-th of parts key ranges. Return
+    the list of segment files written."""
+
+    checkpoint = output_file + '.checkpoint'
+    conn = connect_database(database, read_profile, pragmas)
+
+    position = {'token': None, 'segment': 0, 'done': False}
+    if resume and os.path.exists(checkpoint):
+        with open(checkpoint) as file:
+            position = json.load(file)
+
+    until = None
+    if part != None:
+        start, until = range_tokens(conn, table, part[1], key, where)[
+            part[0] - 1]
+        position['token'] = position['token'] or start
+
+    if position['done']:
+        conn.close()
+        return []
+
+    title, pages = iter_pages(conn, table, key, None, where, (), page_size,
+                              position['token'], until)
+
+    #the segment of a page is given by the rows before it
+    counted = {'rows': 0}
+    def segment_of(page):
+        number = counted['rows'] // (segment_rows or float('inf'))
+        counted['rows'] += len(page[0])
+        return number
+
+    files = []
+    for _, segment in itertools.groupby(pages, segment_of):
+        path = numbered_file(output_file, position['segment'] + 1)
+        batches = page_batches(segment, position)
+        with open(path, 'w', newline='', buffering=1024 * 1024) as file:
+            if output_format == 'table':
+                write_table(file, title, batches)
+            else:
+                writers[output_format](file, title, batches)
+        files.append(path)
+        position['segment'] += 1
+        save_checkpoint(checkpoint, position)
+
+    position['done'] = True
+    save_checkpoint(checkpoint, position)
+    conn.close()
+
+    return files
+
+def export_stats(database, table, output_file='query_results.txt',
+                 output_format='table', read_profile='default', pragmas=None):
+    """Save the statistics of the columns of a table recorded by file2db in
+    a file: the number of values, of NULL values, the minimum, the maximum
+    and the estimated number of distinct values. Return the title and first
+    row strings."""
+
+    conn = connect_database(database, read_profile, pragmas)
+    title, rows = stats_report(conn.cursor(), table)
+    conn.close()
+    if not rows:
+        raise ValueError('no statistics of the table {}'.format(table))
+
+    with open(output_file, 'w', newline='') as file:
+        return writers[output_format](file, title, [rows])
+
+def export_search(database, table, term, output_file='query_results.txt',
+                  limit=None, output_format='table', fetch_size=1000,
+                  read_profile='default', pragmas=None):
+    """Search a term in the columns of a table indexed for full-text search
+    by file2db and save the matching rows in a file, most relevant first, at
+    most limit rows. The rows are written in batches of fetch_size, a table
+    with the widths of the first batch. Return the title and first row
+    strings."""
+
+    conn = connect_database(database, read_profile, pragmas)
+    try:
+        title, cur = search(conn.cursor(), table, term, limit)
+        with open(output_file, 'w', newline='',
+                  buffering=1024 * 1024) as file:
+            result = writers[output_format](file, title,
+                                            fetch_batches(cur, fetch_size))
+    finally:
+        conn.close()
+
+    return result
+
+def execute_query(database, exec_str, output_file='query_results.txt',
+                  stream=False, widths='sample', fetch_size=1000,
+                  sample_rows=1000, output_format='table', cache_dir=None,
+                  cache_size=256 * 1024 * 1024, conn=None, profile=False,
+                  slow_log=None, slow_ms=1000, read_profile='default',
+                  pragmas=None, from_stats=False):
+    """Execute a query with the SQLite cursor and saves the results in a text
+    file, as a table or in another format of the writers dictionary. Rows are
+    fetched and written in batches of fetch_size, except for a table which is
+    not streamed: its column widths need all the rows, unless they come from
+    the first sample_rows rows ('sample') or from rows spilled to a temporary
+    file ('spill'). If cache_dir is given, results are read from or saved in
+    the cache, of at most cache_size bytes. A connection which stays open can
+    be given in conn, otherwise one is opened with the settings of a read
+    profile, updated with a dictionary of pragmas. With profile, a report of
+    the query plan, full table scans, rows, virtual machine steps and time of
+    the execute, fetch and format phases is printed. Queries slower than
+    slow_ms milliseconds have their profile appended to the slow_log JSON
+    Lines file. With from_stats, counts, minimums and maximums of a whole
+    table are read from the column statistics recorded by file2db, if the
+    query only selects those (see stats_query). Return the title and first
+    row strings."""
+
+    profiled = profile or slow_log != None
+    if profiled:
+        stats = new_profile(database, exec_str)
+        start = time.perf_counter()
+
+    own_conn = conn == None
+    cached = None
+    answered = None
+    if cache_dir != None:
+        cached = cache_get(cache_dir, database, exec_str)
+    if profiled:
+        stats['cached'] = cached != None
+
+    #a cached query does not open the database
+    if cached != None:
+        title, batches = cached
+    else:
+        # connect to the database
+        if own_conn:
+            conn = connect_database(database, read_profile, pragmas)
+        cur = conn.cursor()
+        answered = stats_query(cur, exec_str) if from_stats else None
+
+    #metadata queries answered by the statistics of the table
+    if answered != None:
+        title, rows = answered
+        batches = iter([rows])
+    elif cached == None:
+        #the version of the cache entry is read before the rows it holds
+        if cache_dir != None:
+            path = entry_path(cache_dir, database, exec_str)
+        # execute query string and get column names from the cursor
+        if profiled:
+            if is_query(exec_str):
+                stats['plan'] = query_plan(cur, exec_str)
+                stats['full_scans'] = full_scans(stats['plan'])
+            count_steps(conn, stats)
+            execute_start = time.perf_counter()
+        cur.execute(exec_str)
+        if profiled:
+            stats['execute_ms'] = (time.perf_counter() - execute_start) * 1000
+        title = [col[0] for col in cur.description or []]
+        batches = fetch_batches(cur, fetch_size)
+        if cache_dir != None:
+            batches = cache_put(cache_dir, database, path, title, batches,
+                                cache_size)
+
+    if profiled:
+        batches = timed_batches(batches, stats)
+        format_start = time.perf_counter()
+
+    #a table which is not streamed gets its widths from all the rows
+    if output_format == 'table' and not stream:
+        batches = [list(itertools.chain.from_iterable(batches))]
+
     #save query results in a text file
-    # add results to the query file name to give the output file name
-    if sys.platform == 'linux':
-        output_file = 'results_' + query.split('/')[-1]
-    elif sys.platform == 'win32':
-        output_file = 'results_' + query.split('\\')[-1]
-    with open(output_file, 'w') as file:
-        file.write(title_str + '\n')
-        file.write('-' * (sum(widths) + 3 * len(widths)) + '\n')
-        for row in rows2:
-            file.write(row_str.format(*row) + '\n')
+    with open(output_file, 'w', newline='', buffering=1024 * 1024) as file:
+        if output_format == 'table':
+            title_str, first_row = write_table(file, title, batches, widths,
+                                               sample_rows)
+        else:
+            title_str, first_row = writers[output_format](file, title, batches)
     
+    if profiled:
+        #formatting is the time writing the results which was not fetching
+        stats['format_ms'] = ((time.perf_counter() - format_start) * 1000
+                              - stats['fetch_ms'])
+        stats['total_ms'] = (time.perf_counter() - start) * 1000
+        if cached == None:
+            conn.set_progress_handler(None, 0)
+        if profile:
+            print(format_profile(stats))
+        if slow_log != None and stats['total_ms'] >= slow_ms:
+            log_slow_query(slow_log, stats)
+
     #close database connection
-    cur.close()
-    conn.close()
+    if cached == None:
+        cur.close()
+    if own_conn and cached == None:
+        conn.close()
     
     #for testing
-    return title_str, row_str.format(*rows2[0])
+    return title_str, first_row
 
 if __name__ == '__main__':
-    database, table, query = get_args()
-    
-    #if the query is in a text file
-    if re.search('.txt$', query):
-        exec_str = read_query_file(query)
-    
-    #if query is a string
-    else:
-        exec_str = read_query_str(query)
+    from session import Session
 
-    _ = execute_query(database, exec_str)
-    
+    database, table, query, options, jobs, page_options = get_args()
+
+    try:
+        #statistics of the columns of a table
+        if table != None and options['from_stats']:
+            _ = export_stats(database, table, options['output_file'],
+                             options['output_format'],
+                             options['read_profile'], options['pragmas'])
+            sys.exit()
+
+        #rows of a table matching a full-text search
+        if table != None and 'term' in page_options:
+            _ = export_search(database, table,
+                              output_file=options['output_file'],
+                              output_format=options['output_format'],
+                              read_profile=options['read_profile'],
+                              pragmas=options['pragmas'], **page_options)
+            sys.exit()
+
+        #if a table is exported page by page
+        if table != None:
+            _ = export_pages(database, table, options['output_file'],
+                             output_format=options['output_format'],
+                             read_profile=options['read_profile'],
+                             pragmas=options['pragmas'], **page_options)
+            sys.exit()
+
+        #if the query is in a text file
+        if re.search('.txt$', query):
+            statements = read_query_statements(query)
+            if len(statements) > 1:
+                _ = execute_queries(database, statements, jobs=jobs,
+                                    **options)
+                sys.exit()
+            if not statements:
+                raise ValueError('No statement in the query file.')
+            #the statement keeps the semi-colons inside its strings
+            exec_str = statements[0]
+
+        #if query is a string
+        else:
+            exec_str = read_query_str(query)
+
+        #a sharded table
+        if database.endswith('.json'):
+            from shards import execute_shard_query
+            _ = execute_shard_query(database, exec_str,
+                                    options['output_file'],
+                                    options['output_format'], jobs,
+                                    options['read_profile'],
+                                    options['pragmas'])
+            sys.exit()
+
+        with Session(database, read_profile=options.pop('read_profile'),
+                     pragmas=options.pop('pragmas')) as session:
+            _ = session.export(exec_str, **options)
+
+    except (sqlite3.Error, OSError, ValueError) as err:
+        print(err)
+        sys.exit(1)
@@ -0,0 +1,124 @@
+#script which pages through the rows of a table with keyset pagination: each
+#page starts after the key of the last row of the previous one, given by a
+#token from which the iteration can be resumed
+
+#import modules
+import json
+import base64
+
+def encode_token(key, values):
+    """Return the token of a position in a table: the names and values of the
+    key of the last row read."""
+
+    text = json.dumps([key, list(values)])
+
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+def decode_token(token, key):
+    """Return the key values of a token, checking it was made with the same
+    key."""
+
+    try:
+        token_key, values = json.loads(base64.urlsafe_b64decode(token))
+    except ValueError:
+        raise ValueError('invalid token {}'.format(token))
+    if token_key != key:
+        raise ValueError('token of key {0}, not {1}'.format(token_key, key))
+
+    return values
+
+def key_str(key):
+    """Return the key columns as a row value."""
+
+    return '({})'.format(', '.join(['"{}"'.format(i) if i != 'rowid' else i
+                                    for i in key]))
+
+def page_sql(table, key, columns=None, where=None, after=False, until=False,
+             limit=True):
+    """Return the query of a page of a table: the key columns followed by the
+    list of selected columns, for rows after and until key values, ordered by
+    key."""
+
+    conditions = []
+    if where != None:
+        conditions.append('({})'.format(where))
+    if after:
+        conditions.append('{0} > ({1})'.format(key_str(key),
+                                               ', '.join(['?'] * len(key))))
+    if until:
+        conditions.append('{0} <= ({1})'.format(key_str(key),
+                                                ', '.join(['?'] * len(key))))
+
+    exec_str = 'SELECT {0}, {1} FROM "{2}"'.format(key_str(key)[1:-1],
+                                                   ', '.join(columns or ['*']),
+                                                   table)
+    if conditions:
+        exec_str += ' WHERE ' + ' AND '.join(conditions)
+    exec_str += ' ORDER BY ' + key_str(key)[1:-1]
+    if limit:
+        exec_str += ' LIMIT ?'
+
+    return exec_str
+
+def iter_pages(conn, table, key=None, columns=None, where=None, params=(),
+               page_size=10000, token=None, until=None):
+    """Page through the rows of a table ordered by a list of key columns, the
+    rowid by default, which must be unique and not null. Rows are read after
+    the position of token and until the position of the until token, both
+    optional, and may be filtered by a where condition with its params. Return
+    the column names and a generator of (rows, token) pages, the token giving
+    the position after the page."""
+
+    key = list(key or ['rowid'])
+    after = decode_token(token, key) if token != None else None
+    last = decode_token(until, key) if until != None else None
+
+    cur = conn.cursor()
+    cur.execute(page_sql(table, key, columns, where, False, False,
+                         False) + ' LIMIT 0', list(params))
+    title = [i[0] for i in cur.description[len(key):]]
+
+    def pages(after):
+        while True:
+            exec_str = page_sql(table, key, columns, where, after != None,
+                                last != None)
+            cur.execute(exec_str, list(params) + (after or []) +
+                        (last or []) + [page_size])
+            rows = cur.fetchall()
+            if not rows:
+                break
+            after = list(rows[-1][:len(key)])
+            yield [row[len(key):] for row in rows], encode_token(key, after)
+            if len(rows) < page_size:
+                break
+        cur.close()
+
+    return title, pages(after)
+
+def range_tokens(conn, table, parts, key=None, where=None, params=()):
+    """Split the rows of a table in parts of about the same number of rows by
+    key range. Return the list of (token, until) of each part, for iter_pages,
+    None for the start of the first and the end of the last."""
+
+    key = list(key or ['rowid'])
+    exec_str = 'SELECT COUNT(*) FROM "{}"'.format(table)
+    if where != None:
+        exec_str += ' WHERE ({})'.format(where)
+    rows = conn.execute(exec_str, list(params)).fetchone()[0]
+
+    #the key of the last row of each part but the last
+    bounds = []
+    offset_str = page_sql(table, key, None, where, False, False) + ' OFFSET ?'
+    for part in range(1, parts):
+        offset = rows * part // parts - 1
+        if offset < 0:
+            continue
+        row = conn.execute(offset_str, list(params) + [1, offset]).fetchone()
+        token = encode_token(key, row[:len(key)])
+        if token not in bounds:
+            bounds.append(token)
+
+    starts = [None] + bounds
+    ends = bounds + [None]
+
+    return list(zip(starts, ends))
@@ -0,0 +1,111 @@
+#script which profiles queries: query plan, time spent in each phase, rows
+#returned and virtual machine steps, with slow queries appended to a log
+
+#import modules
+import time
+import json
+import threading
+
+#number of virtual machine instructions between calls of the progress handler
+step_interval = 100
+
+#serialize the writes of threads to the slow-query log
+log_lock = threading.Lock()
+
+def query_plan(cur, exec_str):
+    """Return the lines of the query plan of a query, indented after their
+    parent step. A statement which cannot be explained gives no lines."""
+
+    try:
+        cur.execute('EXPLAIN QUERY PLAN ' + exec_str)
+        steps = cur.fetchall()
+    except Exception:
+        return []
+
+    #indent each step one level deeper than its parent
+    depths = {0: -1}
+    plan = []
+    for step_id, parent, _, detail in steps:
+        depths[step_id] = depths.get(parent, -1) + 1
+        plan.append('  ' * depths[step_id] + detail)
+
+    return plan
+
+def full_scans(plan):
+    """Return the tables read by a full scan in a query plan, without an
+    index to look rows up."""
+
+    tables = []
+    for line in plan:
+        words = line.split()
+        if len(words) < 2 or words[0] != 'SCAN' or 'USING' in words:
+            continue
+        #older versions of SQLite say SCAN TABLE name
+        if words[1] == 'TABLE' and len(words) > 2:
+            tables.append(words[2])
+        elif words[1] not in ('CONSTANT', 'SUBQUERY'):
+            tables.append(words[1])
+
+    return tables
+
+def new_profile(database, exec_str):
+    """Return an empty profile of a query."""
+
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'database': database,
+            'query': exec_str, 'cached': False, 'plan': [], 'full_scans': [],
+            'execute_ms': 0.0, 'fetch_ms': 0.0, 'format_ms': 0.0,
+            'total_ms': 0.0, 'rows': 0, 'vm_steps': 0}
+
+def count_steps(conn, profile):
+    """Count the virtual machine steps of the connection in the profile,
+    step_interval at a time."""
+
+    def handler():
+        profile['vm_steps'] += step_interval
+        return 0
+
+    conn.set_progress_handler(handler, step_interval)
+
+    return None
+
+def timed_batches(batches, profile):
+    """Generate batches of rows, adding the time spent fetching them and their
+    number of rows to the profile."""
+
+    batches = iter(batches)
+    while True:
+        start = time.perf_counter()
+        rows = next(batches, None)
+        profile['fetch_ms'] += (time.perf_counter() - start) * 1000
+        if rows == None:
+            break
+        profile['rows'] += len(rows)
+        yield rows
+
+def format_profile(profile):
+    """Return a readable report of a profile."""
+
+    lines = ['query: ' + ' '.join(profile['query'].split()),
+             'rows: {0}, vm steps: {1}{2}'.format(
+                 profile['rows'], profile['vm_steps'],
+                 ', cached' if profile['cached'] else ''),
+             'time (ms): execute {0:.1f}, fetch {1:.1f}, format {2:.1f}, '
+             'total {3:.1f}'.format(profile['execute_ms'], profile['fetch_ms'],
+                                    profile['format_ms'], profile['total_ms'])]
+    if profile['plan']:
+        lines.append('plan:')
+        lines += ['  ' + line for line in profile['plan']]
+    if profile['full_scans']:
+        lines.append('full scans: ' + ', '.join(profile['full_scans']))
+
+    return '\n'.join(lines)
+
+def log_slow_query(slow_log, profile):
+    """Append a profile as a JSON line to the slow-query log."""
+
+    line = json.dumps(profile) + '\n'
+    with log_lock:
+        with open(slow_log, 'a') as file:
+            file.write(line)
+
+    return None
@@ -0,0 +1,320 @@
+#script which serves queries on SQLite databases through a Unix socket, with
+#warm pools of read connections, and sends queries to it as a thin client
+
+#import modules
+import sys
+import os
+import getopt
+import socket
+import socketserver
+import sqlite3
+import json
+import queue
+import threading
+import signal
+
+#permissions of the socket: only the user running the server can connect, as
+#the server reads any database this user can read
+socket_mode = 0o600
+
+def print_help():
+    """Print help text."""
+    help_text = \
+    """Serve queries on SQLite databases from a long-running process, or send \
+a query to the server and print the results.
+    
+    python query_server.py --serve -s[socket] -p[pool size] -h
+    python query_server.py -s[socket] -d[database] -q[query] -f[format] -h
+    
+    -s, --socket
+    Path of the Unix socket of the server. Must be provided. Only the user \
+running the server can connect to it.
+
+    --serve
+    Run the server. Each database gets a pool of read-only connections which \
+stay open, keeping their page cache and prepared statements warm.
+
+    -p, --pool-size
+    Number of connections of each database pool, 4 by default.
+    
+    -d, --database
+    Full path to the database, including the file name.
+    
+    -q, --query
+    Query string sent to the server.
+
+    -f, --format
+    Format of the results printed by the client: 'table' (default), 'csv', \
+'tsv' or 'jsonl'.
+    
+    -h, --help
+    Print help.
+    """
+    
+    print(help_text)
+    return None
+
+def get_args():
+    """Function which gets options to the script passed in the command line."""
+    
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],
+                                   's:p:d:q:f:h',
+                                   ['socket=', 'serve', 'pool-size=',
+                                    'database=', 'query=', 'format=', 'help'])
+        
+    except getopt.GetoptError as err:
+        print(err)
+        sys.exit(2)
+        
+    if len(args) > 0:
+        print("""This function does not take arguments. Please make sure you 
+              did not forget to include an option name.""")
+        sys.exit()
+
+    socket_path = None
+    serve = False
+    pool_size = 4
+    database = None
+    query = None
+    output_format = 'table'
+
+    for opt, arg in opts:
+        if opt in ('-s', '--socket'):
+            socket_path = arg
+        elif opt == '--serve':
+            serve = True
+        elif opt in ('-p', '--pool-size'):
+            pool_size = int(arg)
+        elif opt in ('-d', '--database'):
+            database = arg
+        elif opt in ('-q', '--query'):
+            query = arg
+        elif opt in ('-f', '--format'):
+            output_format = arg
+        elif opt in ('-h', '--help'):
+            print_help()
+            sys.exit()
+
+    if socket_path == None:
+        print('Please provide the path of the socket.')
+        sys.exit()
+
+    if not serve and (database == None or query == None):
+        print('Please provide a database and a query.')
+        sys.exit()
+
+    return socket_path, serve, pool_size, database, query, output_format
+
+#pragmas of the pooled connections
+read_pragmas = {'cache_size': -65536, 'temp_store': 'MEMORY',
+                'query_only': 'ON'}
+
+class ConnectionPools:
+    """Pools of read-only connections which stay open, one pool by database
+    file."""
+
+    def __init__(self, pool_size=4, cached_statements=512):
+        self.pool_size = pool_size
+        self.cached_statements = cached_statements
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def connect(self, database):
+        """Open a read-only connection with a large statement cache."""
+
+        uri = 'file:{}?mode=ro'.format(database)
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for name, value in read_pragmas.items():
+            conn.execute('PRAGMA {0} = {1}'.format(name, value))
+
+        return conn
+
+    def acquire(self, database):
+        """Take a connection from the pool of a database, waiting for one if
+        they are all in use."""
+
+        database = os.path.realpath(database)
+        with self.lock:
+            if database not in self.pools:
+                if not os.path.isfile(database):
+                    raise sqlite3.OperationalError(
+                            'no database {}'.format(database))
+                pool = queue.Queue()
+                for i in range(self.pool_size):
+                    pool.put(None)
+                self.pools[database] = pool
+        
+        #connections are opened the first time they are taken
+        conn = self.pools[database].get()
+        if conn == None:
+            try:
+                conn = self.connect(database)
+            except sqlite3.Error:
+                self.pools[database].put(None)
+                raise
+
+        return database, conn
+
+    def release(self, database, conn):
+        """Give a connection back to the pool of its database."""
+
+        self.pools[database].put(conn)
+
+    def close(self):
+        """Close all the connections."""
+
+        with self.lock:
+            for pool in self.pools.values():
+                while not pool.empty():
+                    conn = pool.get()
+                    if conn != None:
+                        conn.close()
+            self.pools = {}
+
+def encode_value(value):
+    """Encode values which are not JSON types (blobs) as hexadecimal."""
+
+    if isinstance(value, bytes):
+        return value.hex()
+
+    return str(value)
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Answer the requests of a client, one JSON object by line: the columns,
+    batches of rows and the end of the results, or an error."""
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message, default=encode_value)\
+                .encode('utf-8') + b'\n')
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as err:
+                self.send({'error': 'invalid request: {}'.format(err)})
+                continue
+            self.answer(request)
+            self.wfile.flush()
+
+    def answer(self, request):
+        #any error is sent to the client, which would otherwise read the
+        #results cut short as complete
+        pools = self.server.pools
+        try:
+            database, conn = pools.acquire(request['database'])
+        except Exception as err:
+            self.send({'error': str(err)})
+            return None
+
+        try:
+            cur = conn.execute(request['query'], request.get('params', []))
+            self.send({'columns': [col[0] for col in cur.description or []]})
+            n_rows = 0
+            while True:
+                rows = cur.fetchmany(request.get('fetch_size', 1000))
+                if not rows:
+                    break
+                n_rows += len(rows)
+                self.send({'rows': rows})
+            cur.close()
+            self.send({'end': True, 'count': n_rows})
+        except Exception as err:
+            self.send({'error': str(err)})
+        finally:
+            pools.release(database, conn)
+
+        return None
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server answering queries in threads. The socket has the
+    permissions of mode, readable and writable by its owner only by
+    default."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool_size=4, mode=socket_mode):
+        #remove the socket left by a server which stopped
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.mode = mode
+        socketserver.UnixStreamServer.__init__(self, socket_path, QueryHandler)
+        self.pools = ConnectionPools(pool_size)
+
+    def server_bind(self):
+        #the permissions are set before the socket listens, so that no other
+        #user connects in between
+        socketserver.UnixStreamServer.server_bind(self)
+        os.chmod(self.server_address, self.mode)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pools.close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+def send_query(socket_path, database, exec_str, params=None, fetch_size=1000):
+    """Send a query to the server and return the column names and a generator
+    of the batches of rows. Errors of the server raise sqlite3.Error."""
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    request = {'database': os.path.abspath(database), 'query': exec_str,
+               'params': params or [], 'fetch_size': fetch_size}
+    client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+    reader = client.makefile('rb')
+    message = json.loads(reader.readline() or b'{"error": "no answer"}')
+    if 'error' in message:
+        reader.close()
+        client.close()
+        raise sqlite3.Error(message['error'])
+
+    return message['columns'], read_batches(client, reader)
+
+def read_batches(client, reader):
+    """Generate the batches of rows sent by the server, then close the
+    socket. Raise sqlite3.Error if the server sends an error or the results
+    stop before their end."""
+
+    try:
+        for line in reader:
+            message = json.loads(line)
+            if 'error' in message:
+                raise sqlite3.Error(message['error'])
+            if 'end' in message:
+                break
+            yield [tuple(row) for row in message['rows']]
+        else:
+            raise sqlite3.Error('the server closed the connection before the '
+                                'end of the results')
+    finally:
+        reader.close()
+        client.close()
+
+if __name__ == '__main__':
+    socket_path, serve, pool_size, database, query, output_format = get_args()
+
+    if serve:
+        server = QueryServer(socket_path, pool_size)
+        #stop cleanly when terminated, removing the socket
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        print("Serving queries on '{}'.".format(socket_path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        sys.exit()
+
+    #the writers of query_db print the results
+    from query_db import writers
+    try:
+        title, batches = send_query(socket_path, database, query)
+        writers[output_format](sys.stdout, title, batches)
+    except (OSError, sqlite3.Error) as err:
+        print(err)
+        sys.exit(1)
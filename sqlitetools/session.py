@@ -0,0 +1,206 @@
+#script which keeps the connections to a database open for the life of a
+#session, to load files and query the database as a library without opening a
+#connection for each call
+
+#import modules
+import sqlite3
+import queue
+import threading
+
+from file2db import file_to_db, files_to_db
+from query_db import connect_read_only, execute_query, is_query, \
+    read_only_settings
+from query_pages import iter_pages
+
+class Session:
+    """Connections to a database which stay open until the session is closed:
+    one writer connection for loads and statements changing the database, and
+    a pool of read-only connections for queries. Errors are raised, as
+    File2dbError for loads and sqlite3.Error for statements."""
+
+    def __init__(self, database, pool_size=4, read_profile='default',
+                 pragmas=None):
+        self.database = database
+        self.pool_size = pool_size
+        self.read_profile = read_profile
+        self.pragmas = pragmas
+        self.conn = None
+        #the last connection released is the next one used, its cache is warm
+        self.readers = queue.LifoQueue()
+        self.opened = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def writer(self):
+        """Return the writer connection, opened at its first use."""
+
+        with self.lock:
+            if self.conn == None:
+                self.conn = sqlite3.connect(self.database,
+                                            check_same_thread=False)
+
+        return self.conn
+
+    def acquire(self):
+        """Take a read-only connection from the pool, opening one if less than
+        pool_size are open, else waiting for one to be released."""
+
+        try:
+            return self.readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if len(self.opened) < self.pool_size:
+                conn = connect_read_only(self.database, self.read_profile,
+                                         self.pragmas)
+                self.opened.append(conn)
+                return conn
+
+        return self.readers.get()
+
+    def release(self, conn):
+        """Give a read-only connection back to the pool."""
+
+        self.readers.put(conn)
+
+        return None
+
+    def load(self, file_path, tb_name, new_table=True, **options):
+        """Load a file in a table with the options of file_to_db. Return the
+        number of rows inserted."""
+
+        with self.write_lock:
+            conn = self.writer()
+            try:
+                return file_to_db(self.database, tb_name, new_table, file_path,
+                                  conn=conn, **options)
+            except Exception:
+                conn.rollback()
+                raise
+
+    def load_files(self, file_paths, tb_name=None, new_table=True, **options):
+        """Load several files with the options of files_to_db. Return the list
+        of (file, table, rows, error) for each file."""
+
+        with self.write_lock:
+            return files_to_db(self.database, tb_name, new_table, file_paths,
+                               conn=self.writer(), **options)
+
+    def execute(self, exec_str, params=()):
+        """Execute a statement changing the database and commit it. Return the
+        number of rows changed."""
+
+        with self.write_lock:
+            conn = self.writer()
+            try:
+                cur = conn.execute(exec_str, params)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+        return cur.rowcount
+
+    def query(self, exec_str, params=()):
+        """Execute a query. Return the column names and the list of rows."""
+
+        conn = self.acquire()
+        try:
+            cur = conn.execute(exec_str, params)
+            title = [i[0] for i in cur.description or []]
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            self.release(conn)
+
+        return title, rows
+
+    def stream(self, exec_str, params=(), fetch_size=1000):
+        """Execute a query. Return the column names and a generator of batches
+        of fetch_size rows. The connection goes back to the pool once the
+        batches are exhausted or the generator is closed."""
+
+        conn = self.acquire()
+        try:
+            cur = conn.execute(exec_str, params)
+        except sqlite3.Error:
+            self.release(conn)
+            raise
+        title = [i[0] for i in cur.description or []]
+
+        def batches():
+            try:
+                while True:
+                    rows = cur.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cur.close()
+                self.release(conn)
+
+        return title, batches()
+
+    def pages(self, table, **options):
+        """Page through the rows of a table with the options of iter_pages.
+        Return the column names and a generator of (rows, token) pages."""
+
+        conn = self.acquire()
+        try:
+            title, pages = iter_pages(conn, table, **options)
+        except (sqlite3.Error, ValueError):
+            self.release(conn)
+            raise
+
+        def released():
+            try:
+                yield from pages
+            finally:
+                self.release(conn)
+
+        return title, released()
+
+    def export(self, exec_str, output_file='query_results.txt', **options):
+        """Execute a statement and save its results in a file with the options
+        of execute_query. Queries use a read-only connection, other statements
+        the writer connection, unless the read profile or pragmas of the
+        session forbid writes: they then run on a read-only connection, which
+        refuses them. Return the title and first row strings."""
+
+        if not is_query(exec_str) and \
+                not read_only_settings(self.read_profile, self.pragmas):
+            with self.write_lock:
+                conn = self.writer()
+                result = execute_query(self.database, exec_str, output_file,
+                                       conn=conn, **options)
+                conn.commit()
+            return result
+
+        conn = self.acquire()
+        try:
+            return execute_query(self.database, exec_str, output_file,
+                                 conn=conn, **options)
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close the connections of the session."""
+
+        with self.lock:
+            if self.conn != None:
+                self.conn.close()
+                self.conn = None
+            for conn in self.opened:
+                conn.close()
+            self.opened = []
+            self.readers = queue.LifoQueue()
+
+        return None
@@ -0,0 +1,717 @@
+#script which partitions a table across several database files by a hash or
+#range key, loads the shards in parallel processes and fans queries out to the
+#shards, merging their results
+
+#import modules
+import os
+import re
+import csv
+import sqlite3
+import json
+import zlib
+import bisect
+import tempfile
+import multiprocessing
+import concurrent.futures
+
+from file2db import file_to_db, File2dbError, detect_encoding, open_csv, \
+    open_source, infer_csv_types, kind_types, get_field_type, create_tb_str, \
+    table_exists, default_engine, logger, pd, na_values
+from query_db import connect_read_only, writers, write_table
+
+#aggregate functions whose results over shards can be merged, AVG is computed
+#from the sums and counts of the shards
+merge_functions = ('COUNT', 'SUM', 'TOTAL', 'MIN', 'MAX', 'AVG')
+
+#aggregate functions whose results over shards cannot be merged
+other_functions = ('GROUP_CONCAT', 'STRING_AGG', 'JSON_GROUP_ARRAY',
+                   'JSON_GROUP_OBJECT')
+
+def manifest_path(db_path):
+    """Return the path of the manifest of a sharded table: the database path
+    with the .json extension."""
+
+    return os.path.splitext(db_path)[0] + '.json'
+
+def shard_paths(db_path, n_shards):
+    """Return the paths of the shard files, numbered after the database
+    path."""
+
+    root, ext = os.path.splitext(db_path)
+
+    return ['{0}_{1}{2}'.format(root, i + 1, ext or '.sq3')
+            for i in range(n_shards)]
+
+def read_manifest(path):
+    """Read the manifest of a sharded table. Shard paths are relative to the
+    directory of the manifest."""
+
+    with open(path) as file:
+        manifest = json.load(file)
+    directory = os.path.dirname(os.path.abspath(path))
+    manifest['shards'] = [os.path.join(directory, i)
+                          for i in manifest['shards']]
+
+    return manifest
+
+def write_manifest(path, manifest):
+    """Write the manifest of a sharded table, replaced at once."""
+
+    directory = os.path.dirname(os.path.abspath(path))
+    saved = dict(manifest)
+    saved['shards'] = [os.path.relpath(i, directory)
+                       for i in manifest['shards']]
+    with open(path + '.tmp', 'w') as file:
+        json.dump(saved, file, indent=1)
+    os.replace(path + '.tmp', path)
+
+    return None
+
+def key_value(text):
+    """Return the value of a key as an integer, a float or a string, so that
+    range bounds compare numbers as numbers. Whole floats are integers, as the
+    key 1.0 of a file and the literal 1 of a query are the same value, and
+    missing values of a file are None."""
+
+    if isinstance(text, str) and text in na_values:
+        return None
+    value = text
+    #int() truncates floats, so only text is read as an integer
+    for kind in (int, float):
+        if not isinstance(value, str):
+            break
+        try:
+            value = kind(text)
+        except ValueError:
+            pass
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+def shard_of(manifest, value):
+    """Return the number of the shard of a key value: its hash modulo the
+    number of shards, or the range of bounds it falls in, values of different
+    types being ordered as in SQLite (NULL, numbers, text)."""
+
+    value = key_value(value)
+    if manifest['method'] == 'hash':
+        return zlib.crc32(str(value).encode('utf-8')) % len(manifest['shards'])
+
+    return bisect.bisect_right([sort_value(key_value(i))
+                                for i in manifest['bounds']],
+                               sort_value(value))
+
+def split_file(file_path, encoding, manifest, tmp_dir):
+    """Split a CSV file in one CSV file by shard, in UTF-8, streaming its
+    rows. Return the list of paths of the shard files, None for the shards
+    without rows."""
+
+    reader, file = open_csv(file_path, encoding)
+    with file:
+        header = next(reader, [])
+        if manifest['key'] not in header:
+            raise File2dbError("The shard key '{}' is not a column of the "
+                               "file.".format(manifest['key']))
+        key_index = header.index(manifest['key'])
+
+        outputs = {}
+        shard_writers = {}
+        for line in reader:
+            shard = shard_of(manifest, line[key_index])
+            if shard not in outputs:
+                path = os.path.join(tmp_dir, 'shard_{}.csv'.format(shard + 1))
+                outputs[shard] = open(path, 'w', encoding='utf-8', newline='')
+                shard_writers[shard] = csv.writer(outputs[shard])
+                shard_writers[shard].writerow(header)
+            shard_writers[shard].writerow(line)
+
+    for output in outputs.values():
+        output.close()
+
+    return [outputs[i].name if i in outputs else None
+            for i in range(len(manifest['shards']))]
+
+def file_field_type(file_path, encoding, engine):
+    """Return the list of (column, type) of a CSV file, from a sample of its
+    rows with pandas or all its rows with the csv engine."""
+
+    if engine == 'csv':
+        columns, kinds = infer_csv_types(file_path, encoding)
+        return [(i, kind_types[j]) for i, j in zip(columns, kinds)]
+
+    with open_source(file_path) as file:
+        df = pd.read_csv(file, encoding=encoding, nrows=10000,
+                         compression=None)
+
+    return get_field_type(df)
+
+def shard_file_to_db(db_path, tb_name, file_path, shard_key, shards=None,
+                     bounds=None, encoding=None, workers=None, engine=None,
+                     **options):
+    """Load a file in a table partitioned across several database files by the
+    shard_key column: by hash in shards files, or by range with the sorted
+    list of bounds starting each shard after the first. The layout is saved
+    in a manifest next to the shards and reused by the next loads. The file is
+    split by shard, then each shard is loaded by its own process with the
+    options of file_to_db. Return the path of the manifest and the number of
+    rows inserted."""
+
+    engine = default_engine(engine)
+    path = manifest_path(db_path)
+    if os.path.exists(path):
+        manifest = read_manifest(path)
+        if manifest['table'] != tb_name or manifest['key'] != shard_key:
+            raise File2dbError("The manifest '{0}' shards the table '{1}' by "
+                               "'{2}'.".format(path, manifest['table'],
+                                               manifest['key']))
+    elif bounds:
+        manifest = {'table': tb_name, 'key': shard_key, 'method': 'range',
+                    'bounds': list(bounds),
+                    'shards': shard_paths(db_path, len(bounds) + 1)}
+    elif shards:
+        manifest = {'table': tb_name, 'key': shard_key, 'method': 'hash',
+                    'bounds': None, 'shards': shard_paths(db_path, shards)}
+    else:
+        raise File2dbError('Please provide a number of shards or range '
+                           'bounds.')
+
+    if encoding == None:
+        encoding, reason = detect_encoding(file_path)
+        logger.info("Used '{0}' to decode the file ({1})."\
+                    .format(encoding, reason))
+
+    #every shard has the table with the types of the whole file
+    field_type = file_field_type(file_path, encoding, engine)
+    for shard in manifest['shards']:
+        conn = sqlite3.connect(shard)
+        if not table_exists(conn.cursor(), tb_name):
+            conn.execute(create_tb_str(list(field_type), None, tb_name))
+            conn.commit()
+        conn.close()
+    write_manifest(path, manifest)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shard_files = split_file(file_path, encoding, manifest, tmp_dir)
+        tasks = [(shard, tb_name, shard_file, engine, options)
+                 for shard, shard_file in zip(manifest['shards'], shard_files)
+                 if shard_file != None]
+        with multiprocessing.Pool(workers or len(tasks) or 1) as pool:
+            counts = pool.map(_load_shard_task, tasks)
+
+    logger.info("File '{0}' inserted in {1} shards of the table '{2}' ({3} "
+                "rows).".format(file_path, len(tasks), tb_name, sum(counts)))
+
+    return path, sum(counts)
+
+def _load_shard_task(task):
+    """Load the file of a shard in its database, run in a worker process."""
+
+    shard, tb_name, shard_file, engine, options = task
+
+    return file_to_db(shard, tb_name, False, shard_file, 'utf-8',
+                      engine=engine, **options)
+
+def top_level(exec_str):
+    """Return a copy of a query where the text inside parentheses and string
+    literals is replaced by spaces, so keywords found in it are at the top
+    level of the query, at the same positions."""
+
+    chars = []
+    depth = 0
+    quote = None
+    for char in exec_str:
+        if quote != None:
+            chars.append(' ')
+            if char == quote:
+                quote = None
+        elif char in ('"', "'"):
+            quote = char
+            chars.append(' ')
+        elif char == '(':
+            depth += 1
+            chars.append(' ')
+        elif char == ')':
+            depth -= 1
+            chars.append(' ')
+        else:
+            chars.append(char if depth == 0 else ' ')
+
+    return ''.join(chars)
+
+def query_parts(exec_str):
+    """Split a query at the top level in its select list, the text from FROM
+    to ORDER BY, its ORDER BY and LIMIT clauses. Return a dictionary of the
+    parts, empty strings for the missing ones."""
+
+    exec_str = exec_str.strip().rstrip(';')
+    masked = top_level(exec_str)
+
+    def find(pattern, start=0):
+        match = re.compile(pattern, re.I).search(masked, start)
+        return match.start() if match else None
+
+    select = find(r'\bSELECT\b')
+    start = find(r'\bFROM\b')
+    if select == None or start == None:
+        raise ValueError('Only SELECT ... FROM queries can run on shards.')
+    order = find(r'\bORDER\s+BY\b', start)
+    limit = find(r'\bLIMIT\b', start)
+    end = min([i for i in (order, limit, len(exec_str)) if i != None])
+
+    parts = {'select': exec_str[select + 6:start].strip(),
+             'from': exec_str[start:end].strip(),
+             'order': '', 'limit': ''}
+    if order != None:
+        parts['order'] = exec_str[order:limit].strip()
+        parts['order'] = re.sub(r'^ORDER\s+BY\s*', '', parts['order'],
+                                flags=re.I)
+    if limit != None:
+        parts['limit'] = re.sub(r'^LIMIT\s*', '', exec_str[limit:].strip(),
+                                flags=re.I)
+
+    return parts
+
+def mask_strings(text):
+    """Return a copy of an expression where the string literals and quoted
+    names are replaced by spaces, at the same positions."""
+
+    chars = []
+    quote = None
+    for char in text:
+        if quote != None:
+            chars.append(' ')
+            if char == quote:
+                quote = None
+        elif char in ('"', "'"):
+            quote = char
+            chars.append(' ')
+        else:
+            chars.append(char)
+
+    return ''.join(chars)
+
+def call_arguments(text, start):
+    """Return the text between the parenthesis opened at a position of an
+    expression and the parenthesis closing it."""
+
+    depth = 0
+    for pos in range(start, len(text)):
+        if text[pos] == '(':
+            depth += 1
+        elif text[pos] == ')':
+            depth -= 1
+            if depth == 0:
+                return text[start + 1:pos]
+
+    return text[start + 1:]
+
+def has_aggregate(expr):
+    """Tell if an expression calls an aggregate function anywhere: MIN and MAX
+    of several arguments are scalar functions."""
+
+    masked = mask_strings(expr)
+    for match in re.finditer(r'\b(\w+)\s*\(', masked):
+        function = match.group(1).upper()
+        if function not in merge_functions + other_functions:
+            continue
+        inner = call_arguments(masked, match.end() - 1)
+        if function in ('MIN', 'MAX') and len(split_items(inner)) > 1:
+            continue
+        return True
+
+    return False
+
+def split_items(text):
+    """Split a list of expressions on the commas at its top level."""
+
+    masked = top_level(text)
+    items = []
+    start = 0
+    for pos, char in enumerate(masked):
+        if char == ',':
+            items.append(text[start:pos].strip())
+            start = pos + 1
+    items.append(text[start:].strip())
+
+    return [i for i in items if i]
+
+def select_item(item):
+    """Return the expression, name and aggregate function (or None) of an item
+    of a select list. Raise ValueError for aggregates which cannot be merged
+    across shards: those of other functions, those of DISTINCT values and
+    those which are not the whole item (in an expression or with FILTER)."""
+
+    match = re.match(r'(.*?)\s+AS\s+("?)(\w+)\2$', item, flags=re.I | re.S)
+    expr, name = (match.group(1), match.group(3)) if match else (item, item)
+    function = re.match(r'(\w+)\s*\(', expr)
+    function = function.group(1).upper() if function != None and \
+        top_level(expr).strip() == function.group(1) else None
+    inner = expr[expr.index('(') + 1:expr.rindex(')')] if function else ''
+    if function in other_functions:
+        raise ValueError('{} cannot be merged across shards.'.format(function))
+    #MIN and MAX of several arguments are not aggregates
+    if function in ('MIN', 'MAX') and len(split_items(inner)) > 1:
+        function = None
+    if function not in merge_functions:
+        if has_aggregate(expr):
+            raise ValueError("The aggregate in '{}' cannot be merged across "
+                             "shards.".format(expr))
+        return expr, name, None
+    if has_aggregate(inner):
+        raise ValueError("The aggregate in '{}' cannot be merged across "
+                         "shards.".format(expr))
+    if re.match(r'\s*DISTINCT\b', inner, flags=re.I):
+        raise ValueError('{}(DISTINCT ...) cannot be merged across shards.'\
+                         .format(function))
+
+    return expr, name, function
+
+def star_item(item):
+    """Tell if an item of a select list is * or table.*."""
+
+    return re.match(r'(?:(?:\w+|"[^"]+")\s*\.\s*)?\*$', item) != None
+
+def literal_value(text):
+    """Return the value of an SQL literal: a quoted string or a number."""
+
+    text = text.strip()
+    if text.startswith("'"):
+        return text[1:-1].replace("''", "'")
+
+    return key_value(text)
+
+def conjuncts(text, masked):
+    """Split a condition on the ANDs of its top level, except those of
+    BETWEEN ... AND."""
+
+    parts = []
+    start = 0
+    betweens = 0
+    for match in re.finditer(r'\b(BETWEEN|AND)\b', masked, flags=re.I):
+        if match.group(1).upper() == 'BETWEEN':
+            betweens += 1
+        elif betweens > 0:
+            betweens -= 1
+        else:
+            parts.append(text[start:match.start()].strip())
+            start = match.end()
+    parts.append(text[start:].strip())
+
+    return parts
+
+def key_interval(exec_str, key):
+    """Return the key values of the equality predicates on the key in the
+    WHERE clause of a query and the lowest and highest key values of its range
+    predicates, None when there are none. Only the plain predicates joined by
+    AND at the top level of the clause are used: if the key is found in any
+    other condition, or the clause has OR, NOT, <> or !=, there are no
+    predicates."""
+
+    none = None, None, None
+    masked = top_level(exec_str)
+    where = re.search(r'\bWHERE\b', masked, flags=re.I)
+    if where == None:
+        return none
+    end = re.search(r'\b(GROUP\s+BY|WINDOW|ORDER\s+BY|LIMIT)\b',
+                    masked[where.end():], flags=re.I)
+    end = where.end() + end.start() if end else len(exec_str)
+    text = exec_str[where.end():end]
+    masked = masked[where.end():end]
+    if re.search(r'\b(OR|NOT)\b|<>|!=', masked, flags=re.I):
+        return none
+
+    literal = r"\s*('(?:[^']|'')*'|-?\d+(?:\.\d+)?)\s*"
+    column = r'\s*(?:\w+\.)?"?{}"?\s*'.format(re.escape(key))
+    mention = r'(?:^|[^\w"])"?{}\b'.format(re.escape(key))
+    values = None
+    low = None
+    high = None
+
+    for condition in conjuncts(text, masked):
+        if not re.search(mention, condition):
+            continue
+        equal = re.fullmatch(column + r'==?' + literal, condition)
+        among = re.fullmatch(column + r'IN\s*\((.*)\)\s*', condition,
+                             flags=re.I | re.S)
+        above = re.fullmatch(column + r'(>=|>)' + literal, condition)
+        below = re.fullmatch(column + r'(<=|<)' + literal, condition)
+        inside = re.fullmatch(column + r'BETWEEN' + literal + r'AND' +
+                              literal, condition, flags=re.I)
+        if equal:
+            values = [literal_value(equal.group(1))]
+        elif among and all([re.fullmatch(literal, i) for i in
+                            split_items(among.group(1))]):
+            values = [literal_value(i) for i in split_items(among.group(1))]
+        elif above:
+            low = literal_value(above.group(2))
+        elif below:
+            high = literal_value(below.group(2))
+        elif inside:
+            low = literal_value(inside.group(1))
+            high = literal_value(inside.group(2))
+        else:
+            return none
+
+    return values, low, high
+
+def relevant_shards(manifest, exec_str):
+    """Return the shards a query needs to read, pruned by the predicates on
+    the shard key of its WHERE clause."""
+
+    shards = manifest['shards']
+    values, low, high = key_interval(exec_str, manifest['key'])
+    if values != None:
+        numbers = set([shard_of(manifest, i) for i in values])
+        return [shards[i] for i in sorted(numbers)]
+    if manifest['method'] != 'range' or (low == None and high == None):
+        return shards
+
+    first = 0 if low == None else shard_of(manifest, low)
+    last = len(shards) - 1 if high == None else shard_of(manifest, high)
+
+    return shards[first:last + 1]
+
+def sort_value(value):
+    """Return a sort key ordering values like SQLite: NULL, then numbers, then
+    text, then blobs."""
+
+    if value == None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+
+    return (3, value)
+
+def merge_values(function, values):
+    """Merge the values of an aggregate function computed by the shards."""
+
+    values = [i for i in values if i != None]
+    if function in ('COUNT', 'TOTAL'):
+        return sum(values)
+    if not values:
+        return None
+    if function == 'SUM':
+        return sum(values)
+    if function == 'MIN':
+        return min(values, key=sort_value)
+    if function == 'MAX':
+        return max(values, key=sort_value)
+
+    #AVG from the (sum, count) of each shard
+    counts = sum([i[1] for i in values])
+    return sum([i[0] for i in values]) / counts if counts else None
+
+def order_columns(order, items, grouped, star=False):
+    """Return the (index, descending) of the output column of each ORDER BY
+    item, and the expressions of the items which are not selected, sorted on
+    extra columns after the selected ones (only when rows are not grouped and
+    the select list has no *)."""
+
+    names = [i[1].lower() for i in items]
+    exprs = [i[0].lower() for i in items]
+    sort = []
+    extra = []
+    for item in split_items(order):
+        match = re.match(r'(.*?)(?:\s+(ASC|DESC))?$', item, flags=re.I | re.S)
+        expr = match.group(1).strip()
+        if expr.isdigit():
+            index = int(expr) - 1
+        elif expr.lower() in names:
+            index = names.index(expr.lower())
+        elif expr.lower() in exprs:
+            index = exprs.index(expr.lower())
+        elif has_aggregate(expr):
+            raise ValueError("ORDER BY '{}' is not a selected column, it "
+                             "cannot be merged across shards.".format(expr))
+        elif not grouped and not star:
+            index = len(items) + len(extra)
+            extra.append(expr)
+        else:
+            raise ValueError("ORDER BY '{}' is not a selected column, it "
+                             "cannot be merged across shards.".format(expr))
+        sort.append((index, (match.group(2) or '').upper() == 'DESC'))
+
+    return sort, extra
+
+def group_exprs(from_str, items):
+    """Return the expressions of the GROUP BY clause of a query, numbers and
+    names of selected columns replaced by their expressions."""
+
+    group = re.search(r'\bGROUP\s+BY\b', top_level(from_str), flags=re.I)
+    if group == None:
+        return []
+
+    names = [i[1].lower() for i in items]
+    exprs = []
+    for expr in split_items(from_str[group.end():]):
+        if expr.isdigit():
+            expr = items[int(expr) - 1][0]
+        elif expr.lower() in names:
+            expr = items[names.index(expr.lower())][0]
+        exprs.append(expr)
+
+    return exprs
+
+def shard_plan(exec_str, describe=None):
+    """Return the query run on each shard and the way to merge its results:
+    the aggregate function of each output column (None for the others),
+    whether rows are grouped and the number of GROUP BY expressions added as
+    hidden columns to group them, the columns sorting them and the LIMIT and
+    OFFSET. describe(item, from_str) returns the columns of a * item, read
+    from a shard. Raise ValueError if the results cannot be merged exactly."""
+
+    parts = query_parts(exec_str)
+    distinct = re.match(r'DISTINCT\b', parts['select'], flags=re.I) != None
+    select = re.sub(r'^DISTINCT\s+', '', parts['select'], flags=re.I)
+    if re.search(r'\bHAVING\b', top_level(parts['from']), flags=re.I):
+        raise ValueError('HAVING cannot be merged across shards.')
+    if re.search(r'\bOVER\b', top_level(select), flags=re.I):
+        raise ValueError('Window functions cannot be merged across shards.')
+
+    #a * item is run as is on the shards and gives their columns
+    items = []
+    shard_items = []
+    star = False
+    for item in split_items(select):
+        if star_item(item):
+            if describe == None:
+                raise ValueError('The columns of * need the shards.')
+            star = True
+            items += [(i, i, None) for i in describe(item, parts['from'])]
+            shard_items.append(item)
+            continue
+        expr, name, function = select_item(item)
+        items.append((expr, name, function))
+        #AVG runs as its sum and count on each shard
+        if function == 'AVG':
+            inner = expr[expr.index('(') + 1:expr.rindex(')')]
+            shard_items.append('SUM({0}), COUNT({0})'.format(inner))
+        else:
+            shard_items.append(expr if expr == name else
+                               '{0} AS {1}'.format(expr, name))
+
+    functions = [i[2] for i in items]
+    group_by = group_exprs(parts['from'], items)
+    grouped = any(functions) or distinct or len(group_by) > 0
+    sort, extra = order_columns(parts['order'], items, grouped, star)
+
+    #groups are merged on the GROUP BY expressions, returned after the items
+    shard_str = 'SELECT {0}{1} {2}'.format('DISTINCT ' if distinct else '',
+                                           ', '.join(shard_items + extra +
+                                                     group_by),
+                                           parts['from'])
+
+    #each shard returns enough rows for the global LIMIT and OFFSET
+    limit = None
+    if parts['limit']:
+        numbers = [int(i) for i in re.findall(r'\d+', parts['limit'])]
+        if ',' in parts['limit']:
+            limit = (numbers[1], numbers[0])
+        else:
+            limit = (numbers[0], numbers[1] if len(numbers) > 1 else 0)
+    if not grouped:
+        if parts['order']:
+            shard_str += ' ORDER BY ' + parts['order']
+        if limit != None:
+            shard_str += ' LIMIT {}'.format(sum(limit))
+
+    return {'query': shard_str, 'items': items, 'functions': functions,
+            'grouped': grouped, 'group_by': len(group_by), 'sort': sort,
+            'limit': limit}
+
+def merge_rows(plan, results):
+    """Merge the rows of the shards: groups are combined with their aggregate
+    functions, then rows are sorted and limited."""
+
+    rows = [row for shard_rows in results for row in shard_rows]
+
+    if plan['grouped']:
+        groups = {}
+        for row in rows:
+            values = list(row)
+            #the sum and count of an AVG column are paired
+            merged_row = []
+            for function in plan['functions']:
+                if function == 'AVG':
+                    merged_row.append((values.pop(0), values.pop(0)))
+                else:
+                    merged_row.append(values.pop(0))
+            #the GROUP BY values are left, else the selected columns
+            if plan['group_by']:
+                group = tuple(values)
+            else:
+                group = tuple([value for value, function in
+                               zip(merged_row, plan['functions'])
+                               if function == None])
+            groups.setdefault(group, []).append(merged_row)
+        rows = []
+        for group_rows in groups.values():
+            rows.append(tuple([
+                merge_values(function, [i[index] for i in group_rows])
+                if function != None else group_rows[0][index]
+                for index, function in enumerate(plan['functions'])]))
+
+    #sort on the last key first, each sort keeps the order of equal rows
+    for index, descending in reversed(plan['sort']):
+        rows = sorted(rows, key=lambda row: sort_value(row[index]),
+                      reverse=descending)
+
+    if plan['limit'] != None:
+        count, offset = plan['limit']
+        rows = rows[offset:offset + count]
+
+    #columns added to sort rows are not returned
+    width = len(plan['items'])
+
+    return [row[:width] for row in rows]
+
+def query_shards(manifest_file, exec_str, jobs=4, read_profile='default',
+                 pragmas=None):
+    """Run a query on the relevant shards of a sharded table concurrently,
+    each on its own read-only connection, and merge the results. Return the
+    column names and the rows."""
+
+    manifest = read_manifest(manifest_file)
+
+    def describe(item, from_str):
+        conn = connect_read_only(manifest['shards'][0], read_profile, pragmas)
+        try:
+            cur = conn.execute('SELECT {0} {1} LIMIT 0'.format(item, from_str))
+            return [i[0] for i in cur.description]
+        finally:
+            conn.close()
+
+    plan = shard_plan(exec_str, describe)
+    shards = relevant_shards(manifest, exec_str)
+
+    def run(shard):
+        conn = connect_read_only(shard, read_profile, pragmas)
+        try:
+            return conn.execute(plan['query']).fetchall()
+        finally:
+            conn.close()
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        results = list(pool.map(run, shards))
+
+    title = [name for expr, name, function in plan['items']]
+
+    return title, merge_rows(plan, results)
+
+def execute_shard_query(manifest_file, exec_str,
+                        output_file='query_results.txt', output_format='table',
+                        jobs=4, read_profile='default', pragmas=None):
+    """Run a query on a sharded table and save the merged results in a text
+    file with the writers of query_db. Return the title and first row
+    strings."""
+
+    title, rows = query_shards(manifest_file, exec_str, jobs, read_profile,
+                               pragmas)
+
+    with open(output_file, 'w', newline='', buffering=1024 * 1024) as file:
+        if output_format == 'table':
+            return write_table(file, title, [rows])
+        return writers[output_format](file, title, [rows])
@@ -0,0 +1,117 @@
+#script which builds a full-text index (SQLite FTS5) over text columns of a
+#table: the index keeps no copy of the text (external content), it is filled
+#in bulk after a load and kept in sync with the table by triggers, so
+#substring searches read the index instead of scanning the table
+
+#import modules
+from dictionary import data_table, coded_columns, view_select
+
+#the trigram tokenizer matches any substring of at least 3 characters
+search_tokenizer = 'trigram'
+min_term = 3
+
+def search_table(tb_name):
+    """Return the name of the full-text index of a table."""
+
+    return '{}_fts'.format(tb_name)
+
+def table_columns(cur, tb_name):
+    """Return the columns of a table."""
+
+    cur.execute('PRAGMA table_info({})'.format(tb_name))
+
+    return [row[1] for row in cur.fetchall()]
+
+def has_search_index(cur, tb_name):
+    """Tell if a table has a full-text index."""
+
+    cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = ?",
+                (search_table(tb_name),))
+
+    return cur.fetchone()[0] > 0
+
+def content_table(cur, tb_name):
+    """Return the table holding the rows of a table: its data table if it has
+    coded columns, else the table itself."""
+
+    return data_table(tb_name) if coded_columns(cur, tb_name) else tb_name
+
+def create_search_index(cur, tb_name, columns, tokenize=search_tokenizer):
+    """Create the full-text index of a list of text columns of a table, fill
+    it from the rows already in the table and create the triggers keeping it
+    in sync with the inserts, updates and deletes of the table. Raise
+    ValueError if the columns cannot be indexed."""
+
+    content = content_table(cur, tb_name)
+    missing = [i for i in columns if i not in table_columns(cur, content)]
+    coded = [i for i in columns if i in coded_columns(cur, tb_name)]
+    if missing:
+        raise ValueError('no column {0} in the table {1}'\
+                         .format(', '.join(missing), tb_name))
+    if coded:
+        raise ValueError('cannot index the coded columns {}'\
+                         .format(', '.join(coded)))
+    cur.execute("SELECT sql FROM sqlite_master WHERE name = ?", (content,))
+    if cur.fetchone()[0].upper().rstrip().endswith('WITHOUT ROWID'):
+        raise ValueError('cannot index a table without rowid')
+
+    fts = search_table(tb_name)
+    fields = ', '.join(columns)
+    new = ', '.join(['new.' + i for i in columns])
+    old = ', '.join(['old.' + i for i in columns])
+    cur.execute("CREATE VIRTUAL TABLE {0} USING fts5({1}, content='{2}', "
+                "content_rowid='rowid', tokenize='{3}')"\
+                .format(fts, fields, content, tokenize))
+
+    #the rows already in the table are indexed at once
+    cur.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(fts))
+
+    insert = 'INSERT INTO {0}(rowid, {1}) VALUES (new.rowid, {2});'\
+             .format(fts, fields, new)
+    delete = "INSERT INTO {0}({0}, rowid, {1}) VALUES ('delete', old.rowid, " \
+             "{2});".format(fts, fields, old)
+    for name, event, body in [('insert', 'INSERT', insert),
+                              ('delete', 'DELETE', delete),
+                              ('update', 'UPDATE', delete + ' ' + insert)]:
+        cur.execute('CREATE TRIGGER {0}_{1} AFTER {2} ON {3} BEGIN {4} END'\
+                    .format(fts, name, event, content, body))
+
+    return None
+
+def search_term(term):
+    """Return an FTS5 query matching a text as a substring, quoted so that
+    its characters are not read as FTS5 syntax."""
+
+    if len(term) < min_term:
+        raise ValueError('search terms need at least {} characters'\
+                         .format(min_term))
+
+    return '"{}"'.format(term.replace('"', '""'))
+
+def search_sql(cur, tb_name, limit=None):
+    """Return the query of the rows of a table whose indexed columns contain a
+    term, most relevant first, with the original values of coded columns."""
+
+    fts = search_table(tb_name)
+    coded = coded_columns(cur, tb_name)
+    if coded:
+        select = view_select(tb_name, table_columns(cur, tb_name), coded)
+    else:
+        select = 'SELECT d.* FROM {} d'.format(tb_name)
+
+    exec_str = '{0} JOIN {1} ON {1}.rowid = d.rowid WHERE {1} MATCH ? ' \
+               'ORDER BY {1}.rank'.format(select, fts)
+    if limit != None:
+        exec_str += ' LIMIT {:d}'.format(limit)
+
+    return exec_str
+
+def search(cur, tb_name, term, limit=None):
+    """Execute a search of a term in the indexed columns of a table. Return
+    the column names and the cursor over the matching rows."""
+
+    if not has_search_index(cur, tb_name):
+        raise ValueError('no full-text index of the table {}'.format(tb_name))
+    cur.execute(search_sql(cur, tb_name, limit), (search_term(term),))
+
+    return [i[0] for i in cur.description], cur
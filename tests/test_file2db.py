@@ -2,6 +2,16 @@
 
 import unittest
 import sys
+import os
+import sqlite3
+import tempfile
+import gzip
+import lzma
+import shutil
+import threading
+import json
+import asyncio
+import subprocess
 import pandas as pd
 
 
@@ -10,8 +20,37 @@ sys.path.insert(0, '../sqlitetools')
 #import functions to be tested
 from file2db import create_tb_str
 from file2db import row_to_exec_str
+from file2db import file_to_db
+from file2db import df_to_rows
+from file2db import detect_encoding
+from file2db import files_to_db
+from file2db import record_ranges
+from file2db import create_index_strs
+from file2db import File2dbError
 from query_db import read_query_file
 from query_db import execute_query
+from query_db import split_statements
+from query_db import execute_queries
+from query_db import connect_database
+from query_db import export_pages
+from query_db import export_search
+from query_pages import iter_pages
+from query_pages import range_tokens
+from query_cache import cache_get
+from query_profile import full_scans
+from session import Session
+from async_db import AsyncSession
+from async_db import execute_query_async
+from dictionary import coded_columns
+from column_stats import new_stats, stats_rows, distinct_values, stats_query
+from shards import shard_file_to_db
+from shards import query_shards
+from shards import relevant_shards
+from shards import read_manifest
+from index_advisor import advise
+from index_advisor import create_indexes
+from query_server import QueryServer
+from query_server import send_query
 
 class Test_file2db(unittest.TestCase):
     """Test functions from file2db module."""
@@ -81,7 +120,10 @@ class Test_file2db(unittest.TestCase):
         #reference strings
         ref_title = '       name   height'
         
-        title_str, row_str = execute_query('test_db.sq3', exec_str)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, 'results.txt')
+            title_str, row_str = execute_query('test_db.sq3', exec_str,
+                                               output_file)
         
         self.assertEqual(title_str, ref_title)
         
@@ -95,7 +137,1021 @@ class Test_file2db(unittest.TestCase):
         #reference strings
         ref_row_0 = '   Jonathan      1.8'
         
-        title_str, row_str = execute_query('test_db.sq3', exec_str)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, 'results.txt')
+            title_str, row_str = execute_query('test_db.sq3', exec_str,
+                                               output_file)
         
         self.assertEqual(row_str, ref_row_0)
-        
\ No newline at end of file
+
+    def test_file_to_db_chunks(self):
+        """Does a chunked load give the same table as a load in one go?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'whole', True, 'df_utf8.csv', 'utf-8')
+            file_to_db(db_path, 'chunked', True, 'df_utf8.csv', 'utf-8',
+                       chunksize=3)
+
+            conn = sqlite3.connect(db_path)
+            whole = conn.execute('SELECT * FROM whole').fetchall()
+            chunked = conn.execute('SELECT * FROM chunked').fetchall()
+            conn.close()
+
+        self.assertEqual(len(whole), 4)
+        self.assertEqual(whole, chunked)
+
+    def test_file_to_db_chunks_nullable_bool(self):
+        """Are booleans with missing values stored the same way by chunked,
+        parallel, incremental, csv engine and one go loads?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'flags.csv')
+            with open(file_path, 'w') as file:
+                file.write('id,flag\n1,True\n2,\n3,False\n4,true\n5,\n')
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'whole', True, file_path, 'utf-8')
+            file_to_db(db_path, 'chunked', True, file_path, 'utf-8',
+                       chunksize=2)
+            file_to_db(db_path, 'ranges', True, file_path, 'utf-8',
+                       chunksize=2, chunk_bytes=10, workers=2)
+            file_to_db(db_path, 'appended', True, file_path, 'utf-8',
+                       chunksize=2, chunk_bytes=10, incremental=True)
+            file_to_db(db_path, 'engine', True, file_path, 'utf-8',
+                       engine='csv')
+
+            conn = sqlite3.connect(db_path)
+            tables = [conn.execute('SELECT * FROM {}'.format(i)).fetchall()
+                      for i in ('whole', 'chunked', 'ranges', 'appended',
+                                'engine')]
+            conn.close()
+
+        self.assertEqual(tables[0], [(1, '1'), (2, None), (3, '0'), (4, '1'),
+                                     (5, None)])
+        self.assertEqual(tables[1:], [tables[0]] * 4)
+
+    def test_df_to_rows(self):
+        """Are dataframe rows converted to native values with NULL for nan?"""
+
+        df = pd.DataFrame({'text': ['it\'s "quoted"; ok', None],
+                           'integer': [1, 2],
+                           'float': [1.5, float('nan')],
+                           'bool': [True, False]})
+
+        ref_rows = [('it\'s "quoted"; ok', 1, 1.5, 1), (None, 2, None, 0)]
+
+        self.assertEqual(list(df_to_rows(df)), ref_rows)
+
+    def test_file_to_db_profile(self):
+        """Are safe settings restored after a load with the fast profile?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'test_tb', True, 'df_utf8.csv', 'utf-8',
+                       profile='fast', commit_rows=3)
+
+            conn = sqlite3.connect(db_path)
+            journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+            count = conn.execute('SELECT COUNT(*) FROM test_tb').fetchone()[0]
+            conn.close()
+
+        self.assertEqual(journal_mode, 'delete')
+        self.assertEqual(count, 4)
+
+    def test_file_to_db_profile_restored(self):
+        """Are safe settings restored when a load with a profile fails?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            conn = sqlite3.connect(db_path)
+            with self.assertRaises(sqlite3.Error):
+                file_to_db(db_path, 'test_tb', True, 'df_utf8.csv', 'utf-8',
+                           profile='fast', upsert_key=['nope'], conn=conn)
+            settings = [conn.execute('PRAGMA {}'.format(i)).fetchone()[0]
+                        for i in ('journal_mode', 'synchronous',
+                                  'locking_mode')]
+            conn.close()
+
+        self.assertEqual(settings, ['delete', 2, 'normal'])
+
+    def test_file_to_db_malformed(self):
+        """Do malformed files raise File2dbError with both engines?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'bad.csv')
+            with open(file_path, 'w') as file:
+                file.write('a,b\n1,2\n3,4,5,6\n')
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            for engine in ('pandas', 'csv'):
+                with self.assertRaises(File2dbError):
+                    file_to_db(db_path, 'test_' + engine, True, file_path,
+                               'utf-8', engine=engine)
+
+    def test_file_to_db_integer_chunks(self):
+        """Do later chunks with text or decimals in an integer column raise
+        File2dbError, while missing values are accepted?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_path = os.path.join(tmp_dir, 'missing.csv')
+            with open(file_path, 'w') as file:
+                file.write('id,flag\n1,True\n2,False\n,True\n4,\n')
+            file_to_db(db_path, 'missing', True, file_path, 'utf-8',
+                       chunksize=2)
+            conn = sqlite3.connect(db_path)
+            rows = conn.execute('SELECT id FROM missing').fetchall()
+            conn.close()
+            self.assertEqual(rows, [(1,), (2,), (None,), (4,)])
+
+            for name, line in [('text', 'abc,True'), ('real', '1.5,True')]:
+                file_path = os.path.join(tmp_dir, name + '.csv')
+                with open(file_path, 'w') as file:
+                    file.write('id,flag\n1,True\n2,False\n{}\n'.format(line))
+                with self.assertRaises(File2dbError):
+                    file_to_db(db_path, name, True, file_path, 'utf-8',
+                               chunksize=2)
+
+    def test_detect_encoding(self):
+        """Is the encoding detected from the byte order mark or a sample?"""
+
+        self.assertEqual(detect_encoding('df_utf16.csv')[0], 'utf-16')
+        self.assertEqual(detect_encoding('df_utf8.csv')[0], 'utf-8')
+
+    def test_file_to_db_late_decode_error(self):
+        """Is the file read again when decoding fails after the sample?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'late.csv')
+            with open(file_path, 'w', encoding='latin-1') as file:
+                file.write('text,integer\n')
+                for i in range(10000):
+                    file.write('row{0},{0}\n'.format(i))
+                file.write('caf\xe9,10000\n')
+
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'test_tb', True, file_path, chunksize=1000)
+
+            conn = sqlite3.connect(db_path)
+            count = conn.execute('SELECT COUNT(*) FROM test_tb').fetchone()[0]
+            last = conn.execute('SELECT text FROM test_tb WHERE integer = 10000')\
+                    .fetchone()[0]
+            conn.close()
+
+        self.assertEqual(count, 10001)
+        self.assertEqual(last, 'caf\xe9')
+
+    def test_files_to_db(self):
+        """Are several files loaded in one table per file by the worker pool?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            status = files_to_db(db_path, None, True, ['df_utf*.csv'],
+                                 workers=2)
+
+            conn = sqlite3.connect(db_path)
+            utf8 = conn.execute('SELECT * FROM df_utf8').fetchall()
+            utf16 = conn.execute('SELECT * FROM df_utf16').fetchall()
+            conn.close()
+
+        self.assertEqual([i[3] for i in status], [None, None])
+        self.assertEqual(len(utf8), 4)
+        self.assertEqual(utf8, utf16)
+
+    def test_files_to_db_batches(self):
+        """Are files streamed in batches, and is a file failing in a later
+        batch rolled back without stopping the others?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name, last in [('good', '25000'), ('bad', 'abc')]:
+                with open(os.path.join(tmp_dir, name + '.csv'), 'w') as file:
+                    file.write('id\n')
+                    file.writelines(['{}\n'.format(i) for i in range(25000)])
+                    file.write(last + '\n')
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            status = files_to_db(db_path, None, True,
+                                 [os.path.join(tmp_dir, '*.csv')], workers=2)
+
+            conn = sqlite3.connect(db_path)
+            good = conn.execute('SELECT COUNT(*) FROM good').fetchone()
+            bad = conn.execute('SELECT COUNT(*) FROM bad').fetchone()
+            conn.close()
+
+        self.assertEqual([(i[1], i[2]) for i in status],
+                         [('bad', 0), ('good', 25001)])
+        self.assertTrue(status[0][3].startswith('ValueError'))
+        self.assertEqual((good, bad), ((25001,), (0,)))
+
+    def test_file_to_db_byte_ranges(self):
+        """Are byte ranges split on records and parsed in parallel in order?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'quoted.csv')
+            with open(file_path, 'w') as file:
+                file.write('text,integer\n')
+                for i in range(200):
+                    file.write('"line {0}\nstill ""{0}""",{0}\n'.format(i))
+
+            ranges = record_ranges(file_path, 100)
+
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'test_tb', True, file_path, 'utf-8',
+                       chunk_bytes=100, workers=2)
+
+            conn = sqlite3.connect(db_path)
+            rows = conn.execute('SELECT * FROM test_tb').fetchall()
+            conn.close()
+
+        self.assertTrue(len(ranges) > 10)
+        self.assertEqual(rows[0], ('line 0\nstill "0"', 0))
+        self.assertEqual([i[1] for i in rows], list(range(200)))
+
+    def test_create_tb_str_keys(self):
+        """Are keys and WITHOUT ROWID added to the string making the table?"""
+
+        field_type = [('text', 'TEXT'), ('integer', 'INTEGER')]
+
+        ref_str = 'CREATE TABLE test_tb (text TEXT, integer INTEGER, ' + \
+                'PRIMARY KEY (integer), UNIQUE (text)) WITHOUT ROWID'
+
+        test_str = create_tb_str(field_type, None, 'test_tb', ['integer'],
+                                 [['text']], True)
+
+        self.assertEqual(ref_str, test_str)
+
+    def test_file_to_db_indexes(self):
+        """Are secondary indexes built and the table analyzed after the load?"""
+
+        self.assertEqual(create_index_strs('test_tb', [['float', 'bool']]),
+                ['CREATE INDEX IF NOT EXISTS idx_test_tb_float_bool ON test_tb '
+                 '(float, bool)'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'test_tb', True, 'df_utf8.csv', 'utf-8',
+                       primary_key=['integer'], indexes=[['float']])
+
+            conn = sqlite3.connect(db_path)
+            indexes = [i[1] for i in conn.execute('PRAGMA index_list(test_tb)')]
+            stats = conn.execute('SELECT COUNT(*) FROM sqlite_stat1').fetchone()[0]
+            conn.close()
+
+        self.assertIn('idx_test_tb_float', indexes)
+        self.assertTrue(stats > 0)
+
+    def test_file_to_db_incremental(self):
+        """Are unchanged files skipped and grown files resumed with upserts?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'grow.csv')
+            with open(file_path, 'w') as file:
+                file.write('text,integer\nrow1,1\nrow2,2\n')
+
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            options = dict(encoding='utf-8', incremental=True,
+                           upsert_key=['integer'])
+            file_to_db(db_path, 'test_tb', True, file_path, **options)
+            file_to_db(db_path, 'test_tb', True, file_path, **options)
+
+            with open(file_path, 'a') as file:
+                file.write('row2 updated,2\nrow3,3\n')
+            file_to_db(db_path, 'test_tb', True, file_path, **options)
+
+            conn = sqlite3.connect(db_path)
+            rows = conn.execute('SELECT * FROM test_tb ORDER BY integer')\
+                    .fetchall()
+            progress = conn.execute('SELECT offset, rows FROM file2db_sources')\
+                    .fetchone()
+            conn.close()
+            size = os.path.getsize(file_path)
+
+        self.assertEqual(rows, [('row1', 1), ('row2 updated', 2), ('row3', 3)])
+        self.assertEqual(progress, (size, 4))
+
+    def test_file_to_db_incremental_tail(self):
+        """Is a last record without newline left for the next load, and a
+        rewritten file refused?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'grow.csv')
+            with open(file_path, 'w') as file:
+                file.write('integer,text\n1,a\n2,b\n3,c')
+
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            options = dict(encoding='utf-8', incremental=True)
+            first = file_to_db(db_path, 'test_tb', True, file_path, **options)
+            with open(file_path, 'a') as file:
+                file.write('d\n4,e\n')
+            second = file_to_db(db_path, 'test_tb', True, file_path,
+                                **options)
+
+            with open(file_path, 'w') as file:
+                file.write('integer,text\n1,A\n')
+            with self.assertRaises(File2dbError):
+                file_to_db(db_path, 'test_tb', True, file_path, **options)
+
+            conn = sqlite3.connect(db_path)
+            rows = conn.execute('SELECT * FROM test_tb').fetchall()
+            conn.close()
+
+        self.assertEqual((first, second), (2, 2))
+        self.assertEqual(rows, [(1, 'a'), (2, 'b'), (3, 'cd'), (4, 'e')])
+
+    def test_file_to_db_csv_engine(self):
+        """Does the csv engine give the same table as the pandas engine?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'missing.csv')
+            with open(file_path, 'w') as file:
+                file.write('text,integer,float,bool,int_na,bool_na\n'
+                           'a "b",1,1.5,True,1,False\n'
+                           ',2,NA,false,,\n')
+
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'pandas_tb', True, file_path, engine='pandas')
+            file_to_db(db_path, 'csv_tb', True, file_path, engine='csv')
+
+            conn = sqlite3.connect(db_path)
+            schemas = conn.execute("SELECT sql FROM sqlite_master WHERE type = "
+                                   "'table' ORDER BY name").fetchall()
+            pandas_rows = conn.execute('SELECT * FROM pandas_tb').fetchall()
+            csv_rows = conn.execute('SELECT * FROM csv_tb').fetchall()
+            conn.close()
+
+        self.assertEqual(schemas[0][0].replace('csv_tb', 'pandas_tb'),
+                         schemas[1][0])
+        self.assertEqual(pandas_rows, csv_rows)
+
+    def test_file_to_db_big_integers(self):
+        """Are integers beyond 64 bits kept alike by both engines?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'big.csv')
+            with open(file_path, 'w') as file:
+                file.write('small,unsigned,huge,mixed\n'
+                           '9223372036854775807,1,1,1.5\n'
+                           '1,9223372036854775808,18446744073709551616,'
+                           '100000000000000000000\n')
+
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'pandas_tb', True, file_path, engine='pandas')
+            file_to_db(db_path, 'csv_tb', True, file_path, engine='csv')
+
+            conn = sqlite3.connect(db_path)
+            schemas = conn.execute("SELECT sql FROM sqlite_master WHERE type = "
+                                   "'table' ORDER BY name").fetchall()
+            pandas_rows = conn.execute('SELECT * FROM pandas_tb').fetchall()
+            csv_rows = conn.execute('SELECT * FROM csv_tb').fetchall()
+            conn.close()
+
+        self.assertEqual(schemas[0][0].replace('csv_tb', 'pandas_tb'),
+                         schemas[1][0])
+        self.assertEqual(pandas_rows, csv_rows)
+        self.assertEqual(csv_rows[1][:3], (1, '9223372036854775808',
+                                           '18446744073709551616'))
+
+    def test_file_to_db_compressed(self):
+        """Are compressed files decompressed while they are read?"""
+
+        with open('df_utf16.csv', 'rb') as file:
+            data = file.read()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gz_path = os.path.join(tmp_dir, 'df.csv.gz')
+            with gzip.open(gz_path, 'wb') as file:
+                file.write(data)
+            #no extension, detected from the magic bytes
+            xz_path = os.path.join(tmp_dir, 'df_xz')
+            with lzma.open(xz_path, 'wb') as file:
+                file.write(data)
+
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'gz_tb', True, gz_path, chunksize=2)
+            file_to_db(db_path, 'xz_tb', True, xz_path, engine='csv')
+
+            conn = sqlite3.connect(db_path)
+            gz_rows = conn.execute('SELECT * FROM gz_tb').fetchall()
+            xz_rows = conn.execute('SELECT * FROM xz_tb').fetchall()
+            conn.close()
+
+        self.assertEqual(len(gz_rows), 4)
+        self.assertEqual(gz_rows, xz_rows)
+
+    def test_execute_query_stream(self):
+        """Are streamed results written like results fetched at once?"""
+
+        exec_str = 'SELECT * FROM family ORDER BY name'
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            outputs = []
+            for stream, widths in [(False, 'sample'), (True, 'sample'),
+                                   (True, 'spill')]:
+                output_file = os.path.join(tmp_dir, 'results.txt')
+                execute_query('test_db.sq3', exec_str, output_file, stream,
+                              widths, fetch_size=1, sample_rows=2)
+                with open(output_file) as file:
+                    outputs.append(file.read())
+
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+
+    def test_execute_query_formats(self):
+        """Are results written as CSV, TSV and JSON Lines?"""
+
+        exec_str = 'SELECT name, height FROM family WHERE age > 60 ORDER BY name'
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, 'results.txt')
+            outputs = []
+            for output_format in ['csv', 'tsv', 'jsonl']:
+                execute_query('test_db.sq3', exec_str, output_file,
+                              output_format=output_format)
+                with open(output_file) as file:
+                    outputs.append(file.read())
+
+        self.assertEqual(outputs[0], 'name,height\nRegine,1.68\nWilliam,1.83\n')
+        self.assertEqual(outputs[1], outputs[0].replace(',', '\t'))
+        self.assertEqual(outputs[2], '{"name": "Regine", "height": 1.68}\n'
+                                     '{"name": "William", "height": 1.83}\n')
+
+    def test_execute_query_cache(self):
+        """Are cached results used until the database changes?"""
+
+        exec_str = 'SELECT COUNT(*) FROM family'
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            shutil.copy('test_db.sq3', db_path)
+            cache_dir = os.path.join(tmp_dir, 'cache')
+            output_file = os.path.join(tmp_dir, 'results.txt')
+
+            self.assertEqual(cache_get(cache_dir, db_path, exec_str), None)
+            execute_query(db_path, exec_str, output_file, cache_dir=cache_dir)
+            title, batches = cache_get(cache_dir, db_path, exec_str + ';')
+            self.assertEqual(list(batches), [[(4,)]])
+
+            conn = sqlite3.connect(db_path)
+            conn.execute("INSERT INTO family VALUES (1, 'Baby', 0.5)")
+            conn.commit()
+            conn.close()
+
+            self.assertEqual(cache_get(cache_dir, db_path, exec_str), None)
+            title_str, row_str = execute_query(db_path, exec_str, output_file,
+                                               cache_dir=cache_dir)
+            entries = os.listdir(cache_dir)
+
+        self.assertEqual(row_str.strip(), '5')
+        self.assertEqual(len(entries), 1)
+
+    def test_split_statements(self):
+        """Are statements split on semi-colons outside strings and comments?"""
+
+        text = "SELECT 'a;b' FROM t;\n-- comment; here\nSELECT 2;\nSELECT 3"
+
+        ref_statements = ["SELECT 'a;b' FROM t;",
+                          '-- comment; here\nSELECT 2;', 'SELECT 3']
+
+        self.assertEqual(split_statements(text), ref_statements)
+
+    def test_query_file_one_statement(self):
+        """Are semi-colons inside strings kept in a one-statement file?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            query = os.path.join(tmp_dir, 'query.txt')
+            output = os.path.join(tmp_dir, 'results.csv')
+            with open(query, 'w') as file:
+                file.write("SELECT 'a;b' AS x;\n")
+            subprocess.run([sys.executable, '../sqlitetools/query_db.py', '-d',
+                            'test_db.sq3', '-q', query, '-o', output, '-f',
+                            'csv'], check=True, stdout=subprocess.DEVNULL)
+            with open(output) as file:
+                lines = file.read().splitlines()
+
+        self.assertEqual(lines, ['x', 'a;b'])
+
+    def test_query_read_only_write(self):
+        """Are statements changing the database refused by the command line
+        when the read profile or the pragmas forbid writes?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            output = os.path.join(tmp_dir, 'results.csv')
+            conn = sqlite3.connect(db_path)
+            conn.execute('CREATE TABLE t (x)')
+            conn.execute('INSERT INTO t VALUES (1)')
+            conn.commit()
+            conn.close()
+            codes = []
+            for option in (['--query-only'], ['-r', 'readonly']):
+                codes.append(subprocess.run(
+                    [sys.executable, '../sqlitetools/query_db.py', '-d',
+                     db_path, '-q', 'DELETE FROM t', '-o', output] + option,
+                    stdout=subprocess.DEVNULL).returncode)
+            conn = sqlite3.connect(db_path)
+            rows = conn.execute('SELECT COUNT(*) FROM t').fetchone()
+            conn.close()
+
+        self.assertEqual(codes, [1, 1])
+        self.assertEqual(rows, (1,))
+
+    def test_execute_queries(self):
+        """Are several queries run concurrently with their own output file?"""
+
+        statements = ['SELECT name FROM family WHERE age > 60 ORDER BY name;',
+                      'SELECT COUNT(*) FROM family;']
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, 'results.csv')
+            results = execute_queries('test_db.sq3', statements, output_file,
+                                      jobs=2, output_format='csv')
+            with open(os.path.join(tmp_dir, 'results_2.csv')) as file:
+                count = file.read()
+
+        self.assertEqual(results, [('name', 'Regine'), ('COUNT(*)', '4')])
+        self.assertEqual(count, 'COUNT(*)\n4\n')
+
+    def test_execute_query_slow_log(self):
+        """Are slow queries logged with their plan, full scans and rows?"""
+
+        exec_str = 'SELECT name FROM family WHERE age > 30'
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, 'results.txt')
+            slow_log = os.path.join(tmp_dir, 'slow.jsonl')
+            execute_query('test_db.sq3', exec_str, output_file,
+                          slow_log=slow_log, slow_ms=0)
+            execute_query('test_db.sq3', exec_str, output_file,
+                          slow_log=slow_log, slow_ms=60000)
+            with open(slow_log) as file:
+                profiles = [json.loads(line) for line in file]
+
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]['rows'], 3)
+        self.assertEqual(profiles[0]['full_scans'], ['family'])
+        self.assertEqual(full_scans(['SCAN family USING INDEX idx_age',
+                                     'SEARCH family USING INDEX idx_age (age>?)',
+                                     'SCAN TABLE family']), ['family'])
+
+    def test_connect_database(self):
+        """Are the read profile and pragmas applied to the connection?"""
+
+        conn = connect_database('test_db.sq3', 'immutable',
+                                {'cache_size': -1024})
+        settings = [conn.execute('PRAGMA {}'.format(i)).fetchone()[0]
+                    for i in ('cache_size', 'temp_store', 'query_only')]
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute('CREATE TABLE nope (a)')
+        conn.close()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, 'results.txt')
+            title_str, row_str = execute_query('test_db.sq3',
+                                               'SELECT COUNT(*) FROM family',
+                                               output_file,
+                                               read_profile='readonly')
+
+        self.assertEqual(settings, [-1024, 2, 1])
+        self.assertEqual(row_str.strip(), '4')
+
+    def test_iter_pages(self):
+        """Are pages resumed after their token and split by key range?"""
+
+        conn = sqlite3.connect('test_db.sq3')
+        title, pages = iter_pages(conn, 'family', ['name'], ['name', 'age'],
+                                  page_size=3)
+        rows, token = next(pages)
+        _, resumed = iter_pages(conn, 'family', ['name'], ['name'],
+                                page_size=3, token=token)
+        resumed = list(resumed)
+        parts = range_tokens(conn, 'family', 2)
+        _, second = iter_pages(conn, 'family', columns=['name'],
+                               token=parts[1][0], until=parts[1][1])
+        second = list(second)
+        conn.close()
+
+        self.assertEqual(title, ['name', 'age'])
+        self.assertEqual([i[0] for i in rows], ['Jonathan', 'Laure', 'Regine'])
+        self.assertEqual([rows for rows, token in resumed], [[('William',)]])
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(len(second[0][0]), 2)
+
+    def test_export_pages(self):
+        """Is a table exported in segments which a new export resumes?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, 'family.csv')
+            files = export_pages('test_db.sq3', 'family', output_file,
+                                 page_size=1, segment_rows=2,
+                                 output_format='csv')
+            with open(files[1]) as file:
+                segment = file.read().splitlines()
+            resumed = export_pages('test_db.sq3', 'family', output_file,
+                                   resume=True)
+
+        self.assertEqual([os.path.basename(i) for i in files],
+                         ['family_1.csv', 'family_2.csv'])
+        self.assertEqual(len(segment), 3)
+        self.assertEqual(resumed, [])
+
+    def test_session(self):
+        """Are loads and queries run on the connections of a session?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            with Session(db_path, pool_size=2) as session:
+                n_rows = session.load('df_utf8.csv', 'test_tb',
+                                      encoding='utf-8')
+                changed = session.execute('DELETE FROM test_tb WHERE '
+                                          'integer > ?', [3])
+                title, rows = session.query('SELECT text FROM test_tb')
+                _, batches = session.stream('SELECT integer FROM test_tb',
+                                            fetch_size=2)
+                batches = list(batches)
+                with self.assertRaises(File2dbError):
+                    session.load('df_utf8.csv', 'other_tb',
+                                 without_rowid=True)
+                with self.assertRaises(sqlite3.Error):
+                    session.query('SELECT * FROM nope')
+                readers = len(session.opened)
+
+        self.assertEqual((n_rows, changed), (4, 1))
+        self.assertEqual(title, ['text'])
+        self.assertEqual(rows, [('row1',), ('row2',), ('row3',)])
+        self.assertEqual(batches, [[(1,), (2,)], [(3,)]])
+        self.assertEqual(readers, 1)
+
+    def test_session_failed_load(self):
+        """Does a failed load leave safe settings on the writer?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            with Session(db_path) as session:
+                with self.assertRaises(sqlite3.Error):
+                    session.load('df_utf8.csv', 'test_tb', encoding='utf-8',
+                                 profile='fast', upsert_key=['nope'])
+                conn = session.writer()
+                settings = [conn.execute('PRAGMA {}'.format(i)).fetchone()[0]
+                            for i in ('journal_mode', 'synchronous',
+                                      'locking_mode')]
+                session.execute('CREATE TABLE other (x)')
+                other = sqlite3.connect(db_path, timeout=0)
+                other.execute('INSERT INTO other VALUES (1)')
+                other.commit()
+                other.close()
+
+        self.assertEqual(settings, ['delete', 2, 'normal'])
+
+    def test_file_to_db_cancel(self):
+        """Does a cancelled load stop between batches without committing its
+        rows, also when an async task is cancelled?"""
+
+        class Cancel:
+            #cancel event which is set after a number of checks
+            def __init__(self, checks):
+                self.checks = checks
+            def is_set(self):
+                self.checks -= 1
+                return self.checks < 0
+
+        async def run(db_path, file_path):
+            async with AsyncSession(db_path) as session:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(session.load(
+                        file_path, 'async_tb', encoding='utf-8',
+                        chunksize=100), 0.01)
+            #closing the session waits for the load to stop
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_path = os.path.join(tmp_dir, 'big.csv')
+            with open(file_path, 'w') as file:
+                file.write('id,name\n')
+                file.writelines(['{0},name{0}\n'.format(i)
+                                 for i in range(50000)])
+            with self.assertRaises(File2dbError):
+                file_to_db(db_path, 'test_tb', True, file_path, 'utf-8',
+                           cancel=Cancel(2))
+            conn = sqlite3.connect(db_path)
+            n_rows = conn.execute('SELECT COUNT(*) FROM test_tb').fetchone()
+            conn.close()
+            asyncio.run(run(db_path, file_path))
+            conn = sqlite3.connect(db_path)
+            n_async = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE "
+                                   "name = 'async_tb'").fetchone()
+            if n_async == (1,):
+                n_async = conn.execute('SELECT COUNT(*) FROM async_tb')\
+                              .fetchone()
+            conn.close()
+
+        self.assertEqual(n_rows, (0,))
+        self.assertEqual(n_async, (0,))
+
+    def test_async_session(self):
+        """Are loads and streamed queries awaited without blocking the loop,
+        and can a stream stop early?"""
+
+        async def run(db_path):
+            async with AsyncSession(db_path, pool_size=2) as session:
+                n_rows = await session.load('df_utf8.csv', 'test_tb',
+                                            encoding='utf-8')
+                title, batches = await session.stream(
+                        'SELECT integer FROM test_tb', fetch_size=1, buffer=1)
+                first = [rows async for rows in batches][:1]
+                title, early = await session.stream(
+                        'SELECT integer FROM test_tb', fetch_size=1, buffer=1)
+                async for rows in early:
+                    break
+                await early.aclose()
+                results = await asyncio.gather(
+                        session.query('SELECT COUNT(*) FROM test_tb'),
+                        session.query('SELECT MAX(float) FROM test_tb'))
+                with self.assertRaises(sqlite3.Error):
+                    await session.stream('SELECT * FROM nope')
+            return n_rows, title, first, results
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            n_rows, title, first, results = asyncio.run(run(db_path))
+
+        self.assertEqual((n_rows, title, first), (4, ['integer'], [[(1,)]]))
+        self.assertEqual([rows for title, rows in results], [[(4,)], [(8.0,)]])
+
+    def test_execute_query_async_cancel(self):
+        """Are async statements committed, and interrupted and rolled back
+        when their task is cancelled?"""
+
+        endless = ('WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 '
+                   'FROM c) ')
+
+        async def run(db_path, output_file):
+            await execute_query_async(db_path, 'CREATE TABLE t (x INTEGER)',
+                                      output_file)
+            await execute_query_async(db_path, 'INSERT INTO t VALUES (1)',
+                                      output_file)
+            for exec_str in (endless + 'SELECT COUNT(*) FROM c',
+                             'INSERT INTO t ' + endless + 'SELECT x FROM c'):
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(execute_query_async(
+                        db_path, exec_str, output_file), 0.2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            asyncio.run(run(db_path, os.path.join(tmp_dir, 'results.txt')))
+            conn = sqlite3.connect(db_path)
+            n_rows = conn.execute('SELECT COUNT(*) FROM t').fetchone()
+            conn.close()
+
+        self.assertEqual(n_rows, (1,))
+
+    def test_sharded_table(self):
+        """Are shards pruned by the key and their results merged?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            path, n_rows = shard_file_to_db(db_path, 'test_tb', 'df_utf8.csv',
+                                            'integer', bounds=[3],
+                                            encoding='utf-8')
+            manifest = read_manifest(path)
+            pruned = relevant_shards(manifest, 'SELECT * FROM test_tb WHERE '
+                                               'integer >= 3')
+            totals = query_shards(path, 'SELECT COUNT(*), SUM(float), '
+                                        'AVG(integer) FROM test_tb')
+            top = query_shards(path, 'SELECT text FROM test_tb ORDER BY '
+                                     'float DESC LIMIT 2 OFFSET 1')
+
+        self.assertEqual(n_rows, 4)
+        self.assertEqual([os.path.basename(i) for i in pruned], ['test_2.sq3'])
+        self.assertEqual(totals, (['COUNT(*)', 'SUM(float)', 'AVG(integer)'],
+                                  [(4, 26.0, 2.5)]))
+        self.assertEqual(top[1], [('row3',), ('row2',)])
+
+    def test_sharded_table_exact(self):
+        """Are * and GROUP BY merged exactly, and the others refused?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            csv_path = os.path.join(tmp_dir, 'cities.csv')
+            pd.DataFrame({'id': range(100),
+                          'city': ['Paris', 'Lyon', 'Nice'] * 33 + ['Paris']})\
+                .to_csv(csv_path, index=False)
+            path, _ = shard_file_to_db(db_path, 't', csv_path, 'id', shards=4,
+                                       encoding='utf-8')
+            one = query_shards(path, 'SELECT * FROM t WHERE id = 7')
+            first = query_shards(path, 'SELECT * FROM t ORDER BY id LIMIT 3')
+            groups = query_shards(path, 'SELECT COUNT(*) FROM t GROUP BY '
+                                        'city ORDER BY 1')
+            negated = query_shards(path, 'SELECT COUNT(*) FROM t WHERE NOT '
+                                         'id = 5')
+            with self.assertRaises(ValueError):
+                query_shards(path, 'SELECT COUNT(DISTINCT city) FROM t')
+            with self.assertRaises(ValueError):
+                query_shards(path, 'SELECT * FROM t ORDER BY id + 1')
+            #aggregates inside expressions would give a row per shard
+            for item in ('COUNT(*) * 2', 'ROUND(AVG(id), 2)',
+                         'COALESCE(SUM(id), 0)', 'SUM(id) / COUNT(*)',
+                         "COUNT(*) FILTER (WHERE city = 'Nice')"):
+                with self.assertRaises(ValueError):
+                    query_shards(path, 'SELECT {} FROM t'.format(item))
+            scalar = query_shards(path, 'SELECT MAX(id, 50) AS m FROM t WHERE '
+                                        'id = 7')
+
+        self.assertEqual(one, (['id', 'city'], [(7, 'Lyon')]))
+        self.assertEqual(first[1], [(0, 'Paris'), (1, 'Lyon'), (2, 'Nice')])
+        self.assertEqual(groups[1], [(33,), (33,), (34,)])
+        self.assertEqual(negated[1], [(99,)])
+        self.assertEqual(scalar[1], [(50,)])
+
+    def test_sharded_table_keys(self):
+        """Are real keys pruned to the shard of their value, and missing or
+        text keys put in a range shard?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'reals.csv')
+            with open(csv_path, 'w') as file:
+                file.write('k,v\n1.0,a\n2.0,b\n3.0,c\n2.5,d\n')
+            path, _ = shard_file_to_db(os.path.join(tmp_dir, 'hash.sq3'), 't',
+                                       csv_path, 'k', shards=4,
+                                       encoding='utf-8')
+            counts = [query_shards(path, 'SELECT COUNT(*) FROM t WHERE '
+                                         + i)[1][0][0]
+                      for i in ('k = 1.0', 'k = 1', 'k IN (1, 2, 3)',
+                                'k = 2.5')]
+
+            with open(csv_path, 'w') as file:
+                file.write('k,v\n1,a\n,b\nx,c\n20,d\n')
+            path, n_rows = shard_file_to_db(os.path.join(tmp_dir, 'range.sq3'),
+                                            't', csv_path, 'k', bounds=[10],
+                                            encoding='utf-8', engine='csv')
+            low = query_shards(path, 'SELECT v FROM t WHERE k < 10 ORDER BY v')
+
+        self.assertEqual(counts, [1, 1, 3, 1])
+        self.assertEqual(n_rows, 4)
+        self.assertEqual(low[1], [('a',)])
+
+    def test_index_advisor(self):
+        """Are indexes proposed for scanned columns, and not once created?"""
+
+        statements = ["SELECT height FROM family WHERE name = 'Regine' AND "
+                      "age > 30",
+                      'SELECT f.name FROM family f JOIN family g '
+                      'ON f.height = g.height',
+                      "SELECT age FROM family WHERE name = 'William'"]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            shutil.copy('test_db.sq3', db_path)
+            proposals = advise(db_path, statements)
+            create_indexes(db_path, proposals)
+            after = advise(db_path, statements)
+
+        self.assertEqual([(i['columns'], i['statements']) for i in proposals],
+                         [(['name', 'age'], [0, 2]), (['height'], [1])])
+        self.assertEqual(after, [])
+
+    def test_column_stats(self):
+        """Are column statistics updated by appends and used by queries?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            output = os.path.join(tmp_dir, 'results.txt')
+            file_to_db(db_path, 'test_tb', True, 'df_utf8.csv', 'utf-8',
+                       stats=True)
+            #the append updates the statistics without the option
+            file_to_db(db_path, 'test_tb', False, 'df_utf8.csv', 'utf-8')
+            result = execute_query(db_path, 'SELECT COUNT(*), COUNT(DISTINCT '
+                                   'text), MIN(float), MAX(text) AS last '
+                                   'FROM test_tb', output, from_stats=True,
+                                   output_format='csv')
+            conn = sqlite3.connect(db_path)
+            scanned = stats_query(conn.cursor(),
+                                  'SELECT COUNT(*) FROM test_tb WHERE 1')
+            conn.close()
+
+        self.assertEqual(result, ('COUNT(*),COUNT(DISTINCT text),'
+                                  'MIN(float),last', '8,4,5.0,row4'))
+        self.assertEqual(scanned, None)
+
+    def test_column_stats_upsert(self):
+        """Are statistics inexact after an upsert, so that queries scan the
+        table?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            file_to_db(db_path, 'test_tb', True, 'df_utf8.csv', 'utf-8',
+                       primary_key=['integer'], stats=True)
+            conn = sqlite3.connect(db_path)
+            exact = stats_query(conn.cursor(), 'SELECT COUNT(*) FROM test_tb')
+            conn.close()
+            file_to_db(db_path, 'test_tb', False, 'df_utf8.csv', 'utf-8',
+                       upsert_key=['integer'])
+            conn = sqlite3.connect(db_path)
+            inexact = stats_query(conn.cursor(), 'SELECT COUNT(*) FROM test_tb')
+            count = conn.execute('SELECT COUNT(*) FROM test_tb').fetchone()
+            conn.close()
+
+        self.assertEqual(exact, (['COUNT(*)'], [(4,)]))
+        self.assertEqual(inexact, None)
+        self.assertEqual(count, (4,))
+
+    def test_distinct_estimate(self):
+        """Is the distinct estimate of a column close to the true count?"""
+
+        stats = new_stats(['value'])
+        rows = [(i % 20000,) for i in range(50000)]
+        _ = list(stats_rows(rows, stats))
+        self.assertAlmostEqual(distinct_values(stats[0]) / 20000, 1, delta=0.05)
+
+    def test_file_to_db_dictionary(self):
+        """Are repeated text columns coded and read back through the view?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            csv_path = os.path.join(tmp_dir, 'orders.csv')
+            df = pd.DataFrame({'name': ['name{}'.format(i) for i in range(60)],
+                               'status': ['open', 'closed', None] * 20})
+            df.to_csv(csv_path, index=False)
+            file_to_db(db_path, 'orders', True, csv_path, 'utf-8',
+                       dictionary=True)
+            #the append codes its values without the option
+            file_to_db(db_path, 'orders', False, csv_path, 'utf-8',
+                       engine='csv')
+            conn = sqlite3.connect(db_path)
+            cur = conn.cursor()
+            coded = coded_columns(cur, 'orders')
+            cur.execute('SELECT status, COUNT(*) FROM orders GROUP BY status')
+            counts = cur.fetchall()
+            cur.execute('SELECT name, status FROM orders LIMIT 2')
+            first = cur.fetchall()
+            cur.execute('SELECT COUNT(*) FROM orders_status_values')
+            n_values = cur.fetchone()[0]
+            conn.close()
+
+        self.assertEqual(coded, ['status'])
+        self.assertEqual(counts, [(None, 40), ('closed', 40), ('open', 40)])
+        self.assertEqual(first, [('name0', 'open'), ('name1', 'closed')])
+        self.assertEqual(n_values, 2)
+
+    def test_file_to_db_search(self):
+        """Is the full-text index filled, kept in sync and searched?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.sq3')
+            output = os.path.join(tmp_dir, 'results.csv')
+            file_to_db(db_path, 'test_tb', True, 'df_utf8.csv', 'utf-8',
+                       search_columns=['text'])
+            #the append and the statements are indexed by the triggers
+            file_to_db(db_path, 'test_tb', False, 'df_utf8.csv', 'utf-8')
+            conn = sqlite3.connect(db_path)
+            conn.execute("UPDATE test_tb SET text = 'other' WHERE rowid = 1")
+            conn.execute('DELETE FROM test_tb WHERE rowid = 6')
+            conn.commit()
+            conn.close()
+            result = export_search(db_path, 'test_tb', 'OW2', output,
+                                   output_format='csv')
+            with open(output) as file:
+                n_rows = len(file.readlines()) - 1
+            with self.assertRaises(File2dbError):
+                file_to_db(db_path, 'other_tb', True, 'df_utf8.csv', 'utf-8',
+                           search_columns=['nope'])
+
+        self.assertEqual(result, ('text,integer,float,bool', 'row2,2,6.0,0'))
+        self.assertEqual(n_rows, 1)
+
+    def test_query_server(self):
+        """Are queries answered by the server with its pooled connections, on
+        a socket only its owner can use?"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, 'query.sock')
+            server = QueryServer(socket_path, pool_size=1)
+            mode = os.stat(socket_path).st_mode & 0o777
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                results = []
+                for age in (60, 30):
+                    title, batches = send_query(socket_path, 'test_db.sq3',
+                            'SELECT name FROM family WHERE age > ? ORDER BY '
+                            'name', [age], fetch_size=1)
+                    results.append([row for rows in batches for row in rows])
+                with self.assertRaises(sqlite3.Error):
+                    send_query(socket_path, 'test_db.sq3', 'SELECT * FROM nope')
+                #an error after the columns is raised, not a short result
+                _, batches = send_query(socket_path, 'test_db.sq3',
+                                        'SELECT name FROM family',
+                                        fetch_size='x')
+                with self.assertRaises(sqlite3.Error):
+                    list(batches)
+                #the connection of the pool was released
+                _, batches = send_query(socket_path, 'test_db.sq3',
+                                        'SELECT COUNT(*) FROM family')
+                count = list(batches)
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+        self.assertEqual(mode, 0o600)
+        self.assertEqual(count, [[(4,)]])
+        self.assertEqual(title, ['name'])
+        self.assertEqual(results, [[('Regine',), ('William',)],
+                                   [('Jonathan',), ('Regine',), ('William',)]])